@@ -1,35 +1,249 @@
-from fastapi import FastAPI
-import redis
-from influxdb_client import InfluxDBClient
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
+import redis.asyncio as redis
+import asyncio
+import json
+import math
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import List
+from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
 import os
 
 INFLUX_DB_TOKEN = os.getenv("INFLUX_DB_TOKEN")
+INFLUX_DB_URL = os.getenv("INFLUX_DB_URL", "http://terrarium_influx:8086")
 ORG = os.getenv("INFLUX_DB_ORG", "Terrarium")
 BUCKET = os.getenv("INFLUX_DB_BUCKET", "terrarium_logs")
+# Limit czasu zapytań (ms) - długie strumienie historii potrzebują więcej niż domyślne 10 s
+INFLUX_DB_TIMEOUT = int(os.getenv("INFLUX_DB_TIMEOUT", "60000"))
+REDIS_HOST = os.getenv("REDIS_HOST", "terrarium_settings")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
 
-app = FastAPI()
+# Nastawy terrarium trzymane w jednym haszu; zmiany ogłaszane na kanale pub/sub
+SETTINGS_PARAMETERS = ("temp_setting", "hum_setting", "aq_thresh_setting")
+SETTINGS_KEY = "terrarium:{}:settings"
+SETTINGS_CHANNEL = "terrarium:{}:settings:changed"
+# Ostatni stan terrarium publikowany przez bridge
+STATE_KEY = "terrarium:{}:state"
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "5"))
+# Limit wpisów cache - nazwa terrarium pochodzi z zapytania, więc bez limitu cache rósłby bez końca
+STATUS_CACHE_MAX_ENTRIES = int(os.getenv("STATUS_CACHE_MAX_ENTRIES", "1024"))
+# Historia: domyślne pola i limit liczby punktów na serię
+HISTORY_FIELDS = ["temperature", "humidity", "air_quality"]
+HISTORY_MAX_POINTS = 10000
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+# Agregaty utrzymywane przez bridge, od najgrubszego: (długość okna w s, kubełek, retencja w dniach; 0 = bez limitu)
+ROLLUPS = (
+    (3600, f"{BUCKET}_1h", int(os.getenv("INFLUX_DB_ROLLUP_1H_RETENTION_DAYS", "0"))),
+    (60, f"{BUCKET}_1m", int(os.getenv("INFLUX_DB_ROLLUP_1M_RETENTION_DAYS", "30"))),
+)
+ROLLUP_FIELDS = {"temperature", "humidity", "air_quality", "fan", "heat", "mist"}
 
-# Połączenia
-r = redis.Redis(host='terrarium_settings', port=6379, db=0)
-client = InfluxDBClient(
-    url="http://terrarium_influx:8086", 
-    token=INFLUX_DB_TOKEN, 
-    org=ORG)
+# Połączenia - tworzone raz w lifespan i współdzielone przez wszystkie żądania
+r = None
+client = None
+
+
+class LatestStateCache:
+    """Ostatni stan każdego terrarium w pamięci; równoczesne braki w cache dają jedno zapytanie"""
+
+    def __init__(self, loader, ttl, max_entries=STATUS_CACHE_MAX_ENTRIES):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}   # terrarium -> (ważne do, dane), w kolejności odczytu
+        self._inflight = {}  # terrarium -> zadanie trwającego odczytu
+
+    async def get(self, terrarium):
+        entry = self._entries.get(terrarium)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        task = self._inflight.get(terrarium)
+        if task is None:
+            task = self._inflight[terrarium] = asyncio.ensure_future(self._load(terrarium))
+        # shield: przerwane żądanie nie anuluje odczytu, na który czekają inni
+        return await asyncio.shield(task)
+
+    async def _load(self, terrarium):
+        try:
+            data = await self.loader(terrarium)
+            self._store(terrarium, data)
+            return data
+        finally:
+            del self._inflight[terrarium]
+
+    def _store(self, terrarium, data):
+        now = time.monotonic()
+        self._entries.pop(terrarium, None)
+        if len(self._entries) >= self.max_entries:
+            # Najpierw wygasłe wpisy, a jeśli to za mało - najdawniej odczytane
+            for key in [key for key, (expires, _) in self._entries.items() if expires <= now]:
+                del self._entries[key]
+            while len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+        self._entries[terrarium] = (now + self.ttl, data)
+
+
+async def load_latest_state(terrarium):
+    # Najpierw stan opublikowany przez bridge w Redis, dopiero potem zapytanie do InfluxDB
+    stored = await r.hgetall(STATE_KEY.format(terrarium))
+    if stored:
+        return {key.decode(): float(value) for key, value in stored.items()}
+
+    query = f'''from(bucket: "{BUCKET}")
+  |> range(start: -10m)
+  |> filter(fn: (r) => r.location == _terrarium)
+  |> last()'''
+    result = await client.query_api().query(query, params={"_terrarium": terrarium})
 
-@app.get("/status")
-def get_status():
-    # Pobieranie ostatniego pomiaru z InfluxDB
-    query = 'from(bucket: "sensor_data") |> range(start: -10m) |> last()'
-    result = client.query_api().query(query)
-    
     data = {}
     for table in result:
         for record in table.records:
             data[record.get_field()] = record.get_value()
     return data
 
+
+status_cache = LatestStateCache(load_latest_state, STATUS_CACHE_TTL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global r, client
+    pool = redis.ConnectionPool(host=REDIS_HOST, port=6379, db=0, max_connections=REDIS_MAX_CONNECTIONS)
+    r = redis.Redis(connection_pool=pool)
+    client = InfluxDBClientAsync(url=INFLUX_DB_URL, token=INFLUX_DB_TOKEN, org=ORG, timeout=INFLUX_DB_TIMEOUT)
+    try:
+        yield
+    finally:
+        await client.close()
+        await r.aclose()
+        await pool.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/status")
+async def get_status(terrarium: str = "terrarium_1"):
+    # Ostatni pomiar z pamięci podręcznej (TTL kilka sekund)
+    return await status_cache.get(terrarium)
+
 @app.post("/settings/{parameter}")
-def set_param(parameter: str, value: float):
-    # Zmiana nastawy w Redis (np. target_temp)
-    r.set(parameter, value)
-    return {"status": "success", "param": parameter, "value": value}
\ No newline at end of file
+async def set_param(parameter: str, value: float, terrarium: str = "terrarium_1"):
+    # Zmiana nastawy w Redis (np. temp_setting) i powiadomienie sterownika
+    if parameter not in SETTINGS_PARAMETERS:
+        raise HTTPException(status_code=404, detail=f"Nieznany parametr: {parameter}")
+    if not math.isfinite(value):
+        # nan/inf trafiłyby do Redis i do sterownika, zanim odpowiedź by się wywróciła
+        raise HTTPException(status_code=422, detail=f"Niepoprawna wartość: {value}")
+
+    # Zapis i publikacja w jednej transakcji (MULTI/EXEC)
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(SETTINGS_KEY.format(terrarium), parameter, value)
+        pipe.publish(SETTINGS_CHANNEL.format(terrarium), json.dumps({parameter: value, "published_at": time.time()}))
+        await pipe.execute()
+    return {"status": "success", "param": parameter, "value": value, "terrarium": terrarium}
+
+
+@app.get("/settings")
+async def get_settings(terrarium: str = "terrarium_1"):
+    # Pełny zestaw nastaw terrarium
+    stored = await r.hgetall(SETTINGS_KEY.format(terrarium))
+    values = {key.decode(): float(value) for key, value in stored.items()}
+    # Wartości zapisane przed walidacją (nan/inf) nie dają się zserializować do JSON
+    return {key: value for key, value in values.items() if math.isfinite(value)}
+
+
+def parse_time(value: str, now: datetime) -> datetime:
+    """Czas bezwzględny (ISO 8601) albo względny, np. -24h, -7d"""
+    match = re.fullmatch(r"-(\d+)([smhdw])", value)
+    if match:
+        return now - timedelta(seconds=int(match.group(1)) * DURATION_UNITS[match.group(2)])
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Niepoprawny czas: {value}")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def history_source(start_time, every, fields, now):
+    """Najgrubszy agregat, który ma dane od start_time i okno nie dłuższe niż every; inaczej surowe dane"""
+    if set(fields) <= ROLLUP_FIELDS:
+        for step, bucket, retention_days in ROLLUPS:
+            covers = not retention_days or now - start_time <= timedelta(days=retention_days)
+            if step <= every.total_seconds() and covers:
+                return bucket
+    return BUCKET
+
+
+async def stream_history(query, params, fields, fmt):
+    # Rekordy idą prosto z odpowiedzi InfluxDB do klienta - bez budowania listy w pamięci
+    if fmt == "csv":
+        yield "time," + ",".join(fields) + "\n"
+    records = await client.query_api().query_stream(query, params=params)
+    async for record in records:
+        values = record.values
+        timestamp = record.get_time().isoformat()
+        if fmt == "csv":
+            row = ["" if values.get(f) is None else str(values[f]) for f in fields]
+            yield timestamp + "," + ",".join(row) + "\n"
+        else:
+            row = {"time": timestamp}
+            for f in fields:
+                row[f] = values.get(f)
+            yield json.dumps(row) + "\n"
+
+
+@app.get("/history")
+async def get_history(
+    start: str = "-24h",
+    stop: str = "now",
+    fields: List[str] = Query(default=HISTORY_FIELDS),
+    points: int = Query(default=500, ge=1, le=HISTORY_MAX_POINTS),
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+    stat: str = Query(default="mean", pattern="^(mean|min|max)$"),
+    terrarium: str = "terrarium_1",
+):
+    # Historia pomiarów zagregowana w InfluxDB (aggregateWindow) do ~points punktów
+    now = datetime.now(timezone.utc)
+    start_time = parse_time(start, now)
+    stop_time = now if stop == "now" else parse_time(stop, now)
+    if start_time >= stop_time:
+        raise HTTPException(status_code=400, detail="start musi być wcześniejszy niż stop")
+
+    # Pola mogą przyjść jako ?fields=a&fields=b albo ?fields=a,b
+    fields = [f for item in fields for f in item.split(",") if f]
+    if not fields or not all(re.fullmatch(r"\w+", f) for f in fields):
+        raise HTTPException(status_code=400, detail="Niepoprawna lista pól")
+
+    every = max(timedelta(seconds=1), (stop_time - start_time) / points)
+    every = timedelta(seconds=int(every.total_seconds()))
+
+    # Dłuższe zakresy czytamy z agregatów minutowych/godzinowych zamiast z surowych pomiarów
+    source = history_source(start_time, every, fields, now)
+    stat_filter = "\n  |> filter(fn: (r) => r.stat == _stat)" if source != BUCKET else ""
+    query = f'''from(bucket: "{source}")
+  |> range(start: _start, stop: _stop)
+  |> filter(fn: (r) => r.location == _terrarium){stat_filter}
+  |> filter(fn: (r) => contains(value: r._field, set: _fields))
+  |> aggregateWindow(every: _every, fn: {stat}, createEmpty: false)
+  |> keep(columns: ["_time", "_field", "_value"])
+  |> group()
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> sort(columns: ["_time"])'''
+    # Parametry trafiają do zapytania jako opcje Flux (bez sklejania tekstu)
+    params = {
+        "_start": start_time,
+        "_stop": stop_time,
+        "_terrarium": terrarium,
+        "_fields": fields,
+        "_every": every,
+    }
+    if source != BUCKET:
+        params["_stat"] = stat
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(stream_history(query, params, fields, format), media_type=media_type,
+                             headers={"X-History-Source": source})
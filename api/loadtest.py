@@ -0,0 +1,70 @@
+"""Prosty test obciążeniowy API: żądania/s i percentyle opóźnień.
+
+Przykład:
+    python loadtest.py http://localhost:8000 /status /settings -c 100 -d 15 --terrariums 50
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import aiohttp
+
+
+async def worker(session, base_url, paths, terrariums, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        path = random.choice(paths)
+        params = {"terrarium": f"terrarium_{random.randint(1, terrariums)}"}
+        start = time.perf_counter()
+        try:
+            async with session.get(base_url + path, params=params) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    errors.append(resp.status)
+                    continue
+        except aiohttp.ClientError as e:
+            errors.append(repr(e))
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run(args):
+    latencies, errors = [], []
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            worker(session, args.url.rstrip("/"), args.paths, args.terrariums, deadline, latencies, errors)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"żądania: {len(latencies)}  błędy: {len(errors)}  czas: {elapsed:.1f} s")
+    print(f"req/s: {len(latencies) / elapsed:.0f}")
+    print("opóźnienie ms: " + "  ".join(
+        f"p{p}={percentile(latencies, p) * 1000:.1f}" for p in (50, 90, 99)
+    ) + f"  max={latencies[-1] * 1000 if latencies else 0:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test obciążeniowy API terrarium")
+    parser.add_argument("url", help="adres API, np. http://localhost:8000")
+    parser.add_argument("paths", nargs="*", default=["/status"], help="ścieżki GET losowane w teście")
+    parser.add_argument("-c", "--concurrency", type=int, default=50, help="liczba równoległych klientów")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="czas testu w sekundach")
+    parser.add_argument("--terrariums", type=int, default=1,
+                        help="liczba różnych terrariów w zapytaniach (omija wspólny cache)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
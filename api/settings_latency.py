@@ -0,0 +1,165 @@
+"""Opóźnienie nastaw: od zapisu nastawy do chwili, gdy regulator sterownika ją stosuje.
+
+Po stronie sterownika działa prawdziwy main.RedisSettingsListener z obiektami main.Controller;
+czas liczymy do momentu, w którym Controller.current_settings() zwraca nową wartość.
+Nastawy zapisujemy tą samą transakcją co API albo przez samo API (--api).
+
+Przykłady:
+    python settings_latency.py --fake -n 2000
+    python settings_latency.py --redis redis://localhost:6379/0 -n 5000 --terrariums 20
+    python settings_latency.py --redis redis://localhost:6379/0 --api http://localhost:8000 -c 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+import redis.asyncio as redis
+
+from loadtest import percentile
+
+# Sterownik (main.py) leży katalog wyżej
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import main  # noqa: E402
+
+SETTINGS_KEY = "terrarium:{}:settings"
+SETTINGS_CHANNEL = "terrarium:{}:settings:changed"
+
+
+def clients(args):
+    """Fabryka klientów: (dla zapisującego, dla nasłuchu sterownika)"""
+    if args.fake:
+        # fakeredis: serwer w pamięci procesu, wspólny dla zapisującego i sterownika
+        import fakeredis
+
+        server = fakeredis.FakeServer()
+        return (lambda: fakeredis.aioredis.FakeRedis(server=server),
+                lambda: fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    return (lambda: redis.from_url(args.redis),
+            lambda: redis.from_url(args.redis, decode_responses=True))
+
+
+class WatchedController(main.Controller):
+    """Controller, który zgłasza, kiedy current_settings() pokazuje oczekiwaną nastawę"""
+
+    def __init__(self):
+        super().__init__(main.Settings())
+        self.waiters = {}  # temp_setting -> future z czasem zastosowania
+
+    def update_settings(self, new_settings):
+        super().update_settings(new_settings)
+        applied = time.perf_counter()
+        waiter = self.waiters.pop(self.current_settings().temp_setting, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(applied)
+
+
+async def publish_direct(r, terrarium, parameter, value):
+    # Tak jak set_param w api.py: zapis i publikacja w jednej transakcji
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(SETTINGS_KEY.format(terrarium), parameter, value)
+        pipe.publish(SETTINGS_CHANNEL.format(terrarium), json.dumps({parameter: value, "published_at": time.time()}))
+        await pipe.execute()
+
+
+async def writer(args, r, session, controllers, latencies, errors, counter):
+    loop = asyncio.get_running_loop()
+    while counter[0] < args.count:
+        counter[0] += 1
+        terrarium = random.choice(list(controllers))
+        controller = controllers[terrarium]
+        # Unikalna wartość pozwala dopasować zastosowanie do zapisu
+        value = round(20 + counter[0] / 1000, 3)
+        waiter = controller.waiters[value] = loop.create_future()
+        start = time.perf_counter()
+        try:
+            if session is None:
+                await publish_direct(r, terrarium, "temp_setting", value)
+            else:
+                async with session.post(f"{args.api.rstrip('/')}/settings/temp_setting",
+                                        params={"value": value, "terrarium": terrarium}) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        errors.append(resp.status)
+                        controller.waiters.pop(value, None)
+                        continue
+            applied = await asyncio.wait_for(waiter, args.timeout)
+        except Exception as e:
+            errors.append(repr(e))
+            controller.waiters.pop(value, None)
+            continue
+        latencies.append(applied - start)
+
+
+async def run(args):
+    # Sterownik loguje każdą zmianę nastaw - tu tylko ostrzeżenia
+    logging.getLogger().setLevel(logging.WARNING)
+    writer_client, listener_client = clients(args)
+    r = writer_client()
+    controllers = {f"terrarium_{i}": WatchedController() for i in range(1, args.terrariums + 1)}
+    listener = main.RedisSettingsListener(args.redis, controllers, connect=listener_client)
+    task = asyncio.create_task(listener.run())
+    # Subskrypcja gotowa, gdy kanały są zarejestrowane na serwerze
+    channels = set(listener.channels)
+    while len(channels & {c.decode() for c in await r.pubsub_channels()}) < len(channels):
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+
+    session = None
+    if args.api:
+        import aiohttp
+
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency))
+    latencies, errors, counter = [], [], [0]
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            writer(args, r, session, controllers, latencies, errors, counter)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+    finally:
+        task.cancel()
+        if session is not None:
+            await session.close()
+        await r.aclose()
+
+    latencies.sort()
+    # Ten sam pomiar, który sterownik eksportuje w /metrics (published_at -> apply)
+    lag = [main.SETTINGS_APPLY_LAG.labels(name, "redis") for name in controllers]
+    lag_count = sum(h.count for h in lag)
+    print(f"nastawy: {len(latencies)}  błędy: {len(errors)}  zastosowane: {listener.applied}  "
+          f"czas: {elapsed:.1f} s ({len(latencies) / elapsed:.0f}/s)")
+    print("zapis -> current_settings() ms: " + "  ".join(
+        f"p{p}={percentile(latencies, p) * 1000:.2f}" for p in (50, 90, 99)
+    ) + f"  max={latencies[-1] * 1000 if latencies else 0:.2f}")
+    if lag_count:
+        print(f"terrarium_settings_apply_lag_seconds (redis): średnio "
+              f"{sum(h.sum for h in lag) / lag_count * 1000:.2f} ms z {lag_count} pomiarów")
+    if errors:
+        print(f"pierwsze błędy: {errors[:5]}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Opóźnienie zastosowania nastaw przez Redis pub/sub")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--redis", default="redis://localhost:6379/0", help="adres Redis")
+    target.add_argument("--fake", action="store_true", help="fakeredis w pamięci zamiast serwera Redis")
+    parser.add_argument("--api", help="zapis przez API (POST /settings/...), np. http://localhost:8000")
+    parser.add_argument("-n", "--count", type=int, default=1000, help="liczba zmian nastaw")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="liczba równoległych zapisujących")
+    parser.add_argument("--terrariums", type=int, default=1, help="liczba terrariów (kanałów)")
+    parser.add_argument("--timeout", type=float, default=5.0, help="limit oczekiwania na zastosowanie [s]")
+    args = parser.parse_args()
+    if args.fake and args.api:
+        parser.error("--api wymaga prawdziwego serwera Redis (--redis)")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
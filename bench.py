@@ -0,0 +1,466 @@
+"""Benchmark sterownika bez sprzętu: symulowana płytka na pty, atrapa ThingSpeak/bridge/InfluxDB.
+
+main.py działa jako osobny proces, dokładnie jak na Raspberry Pi; mierzymy go z zewnątrz.
+
+Przykłady:
+    python bench.py                          # 200 odczytów/s przez 10 s, komenda po każdym odczycie
+    python bench.py --rate 0 --count 20000   # przepustowość: odczyty wysyłane bez przerw
+    python bench.py --binary --json wynik.json
+    python bench.py --imports                # czas importu main.py (-X importtime) i zakazane moduły
+
+Każdy odczyt niesie numer w temperaturze i jakości powietrza, więc komendy da się przypisać do odczytów,
+które je wywołały (RX->TX), a brakujące odczyty policzyć po próbkach, które dotarły do bridge.
+"""
+import argparse
+import asyncio
+import binascii
+import json
+import os
+import pty
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tty
+
+from aiohttp import web
+
+from main import BOARD_ACK, BOARD_HELLO, BinaryProtocol
+
+TAG_MODULO = 60000
+AQ_STEPS = 150  # jakość powietrza < 200, żeby nie włączać wietrzenia
+# Częste paczki do bridge, żeby bufor sterownika (10000 próbek) nie przepełnił się przy dużym tempie
+BRIDGE_FLUSH_INTERVAL = 0.2
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+# Moduły, które nie mogą się ładować przy starcie sterownika (sieć i walidacja dopiero przy użyciu)
+IMPORT_FORBIDDEN = ("aiohttp", "pydantic", "requests", "redis")
+
+
+def encode_tag(seq):
+    """Numer odczytu -> (temperatura, jakość powietrza); temperatura < 24 °C, więc grzałka stale pracuje"""
+    tag = seq % TAG_MODULO
+    return 20 + (tag // AQ_STEPS) / 100, tag % AQ_STEPS
+
+
+def decode_tag(temp, quality):
+    return round((temp - 20) * 100) * AQ_STEPS + round(quality)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Stub:
+    """Atrapa ThingSpeak (/update, bulk_update, feeds/last), bridge (/samples) i InfluxDB (/api/v2/write)"""
+
+    def __init__(self):
+        self.requests = 0
+        self.samples = []  # numery odczytów w kolejności przetwarzania
+        self.points = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/update", self.update)
+        app.router.add_post("/channels/{channel}/bulk_update.json", self.bulk_update)
+        app.router.add_get("/channels/{channel}/feeds/last.json", self.last_settings)
+        app.router.add_post("/samples", self.bridge_samples)
+        app.router.add_post("/api/v2/write", self.influx_write)
+        return app
+
+    async def update(self, request):
+        self.requests += 1
+        return web.Response(text="1")
+
+    async def bulk_update(self, request):
+        self.requests += 1
+        return web.json_response({"success": True}, status=202)
+
+    async def last_settings(self, request):
+        self.requests += 1
+        if request.headers.get("If-None-Match") == '"1"':
+            return web.Response(status=304)
+        body = {"entry_id": 1, "created_at": "2026-01-01T00:00:00Z", "field1": "25", "field2": "40", "field3": "200"}
+        return web.json_response(body, headers={"ETag": '"1"'})
+
+    async def bridge_samples(self, request):
+        self.requests += 1
+        for sample in await request.json():
+            self.samples.append(decode_tag(sample["temperature"], sample["air_quality"]))
+        return web.json_response({"accepted": True})
+
+    async def influx_write(self, request):
+        self.requests += 1
+        self.points += (await request.read()).count(b"\n") + 1
+        return web.Response(status=204)
+
+
+class FakeBoard:
+    """Płytka na pty: wysyła odczyty w zadanym tempie i zapisuje czas nadejścia komend"""
+
+    def __init__(self, binary=False, seed=1):
+        self.master, slave = pty.openpty()
+        tty.setraw(self.master)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(slave)
+        self._slave = slave  # trzymany otwarty, żeby pty nie znikało między ponownymi otwarciami
+        self.binary = binary
+        self.random = random.Random(seed)
+        self.sent = []       # czas wysłania odczytu (perf_counter), indeks = numer odczytu
+        self.commands = []   # czas nadejścia komendy
+        self.negotiated = asyncio.Event()
+        self._rx = bytearray()
+        self._seq = 0
+        self._binary_active = False
+
+    def start(self):
+        asyncio.get_running_loop().add_reader(self.master, self._on_readable)
+
+    def stop(self):
+        asyncio.get_running_loop().remove_reader(self.master)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.master, 65536)
+        except (BlockingIOError, OSError):
+            return
+        now = time.perf_counter()
+        self._rx += data
+        if self._binary_active:
+            self._parse_frames(now)
+        else:
+            self._parse_lines(now)
+
+    def _parse_lines(self, now):
+        while True:
+            end = self._rx.find(b"\n")
+            if end < 0:
+                return
+            line = bytes(self._rx[:end])
+            del self._rx[:end + 1]
+            if line.startswith(BOARD_HELLO.strip()):
+                self._write(BOARD_ACK + b" bench\n")
+                continue
+            if line.startswith(BinaryProtocol.HELLO):
+                if self.binary:
+                    self._write(BinaryProtocol.ACK + line[len(BinaryProtocol.HELLO):] + b"\n")
+                    self._binary_active = True
+                    self.negotiated.set()
+                    self._parse_frames(now)
+                    return
+                continue
+            if line.count(b";") == 4:
+                self.commands.append(now)
+
+    def _parse_frames(self, now):
+        frame = BinaryProtocol.FRAMES[BinaryProtocol.COMMAND]
+        while True:
+            start = self._rx.find(BinaryProtocol.SYNC)
+            if start < 0 or len(self._rx) - start < frame.size:
+                return
+            fields = frame.unpack_from(self._rx, start)
+            body = bytes(self._rx[start + 2:start + frame.size - 2])
+            if fields[1] == BinaryProtocol.COMMAND and binascii.crc_hqx(body, 0xFFFF) == fields[-1]:
+                self.commands.append(now)
+                del self._rx[:start + frame.size]
+            else:
+                del self._rx[:start + 1]
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.master, view):]
+            except BlockingIOError:
+                time.sleep(0.0005)
+
+    def reading(self):
+        temp, quality = encode_tag(self._seq)
+        hum = 40 + self.random.choice((-0.5, 0.0, 0.5))
+        self._seq += 1
+        if self._binary_active:
+            body = struct.pack("<BBhHH", BinaryProtocol.SENSOR, self._seq & 0xFF,
+                               round(temp * 100), round(hum * 100), quality)
+            return BinaryProtocol.SYNC + body + struct.pack("<H", binascii.crc_hqx(body, 0xFFFF))
+        return f"{temp:.2f};{hum:.2f};{quality}\n".encode()
+
+    def send(self, count):
+        data = b"".join(self.reading() for _ in range(count))
+        now = time.perf_counter()
+        self.sent.extend([now] * count)
+        self._write(data)
+
+
+def process_stats(pid):
+    """Czas CPU (s), bieżący i szczytowy RSS (MB) procesu z /proc"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLK_TCK
+    rss = peak = 0.0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) / 1024
+            elif line.startswith("VmHWM:"):
+                peak = int(line.split()[1]) / 1024
+    return cpu, rss, peak
+
+
+def children_cpu(pid):
+    """Łączny czas CPU (s) procesów potomnych (np. telemetrii w trybie --split)"""
+    total = 0.0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            total += (int(fields[11]) + int(fields[12])) / CLK_TCK
+    return total
+
+
+async def run(args):
+    stub = Stub()
+    runner = web.AppRunner(stub.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    stub_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    board = FakeBoard(binary=args.binary, seed=args.seed)
+    board.start()
+    # Bufor telemetrii, porty i stan regulatora w katalogu tymczasowym (w repozytorium zostałby plik ~15 MB)
+    ring_dir = tempfile.TemporaryDirectory()
+    env = dict(
+        os.environ,
+        RINGSTORE_DIR=ring_dir.name,
+        PORT_CACHE_FILE=os.path.join(ring_dir.name, "ports.json"),
+        SNAPSHOT_DIR=ring_dir.name,
+        SERIAL_PORT=board.port,
+        SEND_INTERVAL=str(args.send_interval),
+        SERIAL_BINARY_BAUD="115200" if args.binary else "0",
+        TS_API_URL=stub_url,
+        BRIDGE_URL=stub_url,
+        BRIDGE_FLUSH_INTERVAL=str(BRIDGE_FLUSH_INTERVAL),
+        TS_LOGS_CHANNEL_ID="1", TS_LOGS_WRITE_API_KEY="bench",
+        TS_SETTINGS_CHANNEL_ID="2", TS_SETTINGS_READ_API_KEY="bench",
+    )
+    env.pop("REDIS_URL", None)
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")]
+    if args.split:
+        command.append("--split")
+    launched = time.perf_counter()
+    controller = subprocess.Popen(command,
+                                  env=env, stdout=subprocess.DEVNULL,
+                                  stderr=open(args.log, "w") if args.log else subprocess.DEVNULL)
+    try:
+        # Rozgrzewka: czekamy na pierwszą komendę (i negocjację protokołu binarnego)
+        if args.binary:
+            await asyncio.wait_for(board.negotiated.wait(), 10)
+        deadline = time.monotonic() + 10
+        while not board.commands:
+            if time.monotonic() > deadline:
+                raise RuntimeError("sterownik nie odpowiada na odczyty")
+            board.send(1)
+            await asyncio.sleep(0.05)
+        startup = board.commands[0] - launched
+        await asyncio.sleep(max(args.send_interval, 0.1) + 0.1)
+        first = len(board.sent)
+        first_command = seen_before = len(board.commands)
+        cpu_start, _, _ = process_stats(controller.pid)
+        children_start = children_cpu(controller.pid)
+        start = time.perf_counter()
+
+        if args.rate > 0:
+            count = int(args.rate * args.duration)
+            sent = 0
+            while sent < count:
+                due = min(count, int((time.perf_counter() - start) * args.rate) + 1)
+                if due > sent:
+                    board.send(due - sent)
+                    sent = due
+                await asyncio.sleep(0.001)
+        else:
+            count = args.count
+            for _ in range(0, count, 100):
+                board.send(min(100, count - (len(board.sent) - first)))
+                await asyncio.sleep(0)
+
+        if args.send_interval > 0:
+            # Harmonogram wysyła komendę w każdym kroku - wystarczą dwa okresy na ostatnie odczyty
+            await asyncio.sleep(args.send_interval * 2)
+        else:
+            # Czekamy, aż sterownik przestanie odpowiadać (przetworzył wszystko, co mógł)
+            quiet_since = time.perf_counter()
+            seen = len(board.commands)
+            while time.perf_counter() - quiet_since < 0.5:
+                await asyncio.sleep(0.05)
+                if len(board.commands) != seen:
+                    seen, quiet_since = len(board.commands), time.perf_counter()
+        cpu_end, rss, peak = process_stats(controller.pid)
+        children_end = children_cpu(controller.pid)
+        cpu_wall = time.perf_counter() - start
+        # Czas od startu pomiaru do ostatniego odczytu albo ostatniej komendy (bez oczekiwania na ciszę)
+        last_command = board.commands[-1] if len(board.commands) > seen_before else start
+        elapsed = max(board.sent[-1], last_command) - start
+        # Ostatnie paczki próbek do bridge - czekamy, aż przestaną przychodzić
+        received = -1
+        while len(stub.samples) != received:
+            received = len(stub.samples)
+            await asyncio.sleep(BRIDGE_FLUSH_INTERVAL * 2 + 0.5)
+    finally:
+        controller.terminate()
+        controller.wait()
+        ring_dir.cleanup()
+        board.stop()
+        await runner.cleanup()
+
+    # Odczyty przetworzone przez sterownik (próbki w bridge) w kolejności przetwarzania
+    measured = set(range(first, first + count))
+    processed_measured = [tag for tag in stub.samples if tag in measured]
+    commands = board.commands[first_command:]
+    latencies = []
+    if args.send_interval == 0:
+        # Komenda po każdym przetworzonym odczycie - i-ta komenda odpowiada i-temu przetworzonemu odczytowi
+        for tag, arrived in zip(processed_measured, commands):
+            latencies.append(arrived - board.sent[tag])
+    latencies.sort()
+    late = sum(1 for latency in latencies if latency * 1000 > args.deadline)
+    expected_commands = count if args.send_interval == 0 else int(elapsed / args.send_interval)
+    gaps = [b - a for a, b in zip(commands, commands[1:])]
+
+    result = {
+        "protocol": "binary" if args.binary else "text",
+        "rate": args.rate,
+        # Od uruchomienia procesu do pierwszej komendy (rozpoznanie płytki i pierwszy odczyt)
+        "startup_s": startup,
+        "sent": count,
+        "processed": len(processed_measured),
+        "dropped_readings": count - len(processed_measured),
+        "processed_per_s": len(processed_measured) / elapsed,
+        "commands": len(commands),
+        "dropped_commands": max(0, expected_commands - len(commands)),
+        "late_commands": late,
+        "latency_ms": {f"p{p}": percentile(latencies, p) * 1000 for p in (50, 90, 99)},
+        "latency_max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        "command_gap_max_s": max(gaps) if gaps else 0.0,
+        # Odchyłka odstępu komend od okresu harmonogramu
+        "command_jitter_max_ms": max(abs(g - args.send_interval) for g in gaps) * 1000
+        if gaps and args.send_interval > 0 else 0.0,
+        "cpu_percent": (cpu_end - cpu_start) / cpu_wall * 100,
+        "cpu_children_percent": (children_end - children_start) / cpu_wall * 100,
+        "rss_mb": rss,
+        "rss_peak_mb": peak,
+        "stub_requests": stub.requests,
+    }
+    return result
+
+
+def import_times(runs):
+    """`python -X importtime -c "import main"`: czas całkowity i moduły ładowane przez main (ms, mediany)"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    totals = []
+    modules = {}  # moduł -> (zagnieżdżenie, czasy)
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=here,
+                              capture_output=True, text=True, check=True)
+        subtree = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if not cumulative.strip().isdigit():
+                continue  # nagłówek
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            # Importy wypisywane są po zakończeniu, więc poddrzewo main poprzedza jego wiersz
+            if depth == 0:
+                if name.strip() == "main":
+                    totals.append(int(cumulative) / 1000)
+                    break
+                subtree = []
+            else:
+                subtree.append((name.strip(), depth, int(cumulative) / 1000))
+        for module, depth, ms in subtree:
+            modules.setdefault(module, (depth, []))[1].append(ms)
+    return {
+        "import_ms": percentile(sorted(totals), 50),
+        "direct_ms": {module: percentile(sorted(times), 50)
+                      for module, (depth, times) in modules.items() if depth == 1},
+        "forbidden": sorted({m.split(".")[0] for m in modules} & set(IMPORT_FORBIDDEN)),
+    }
+
+
+def report_imports(result, args):
+    budget = f"  budżet {args.import_budget:g} ms" if args.import_budget else ""
+    print(f"import main: {result['import_ms']:.1f} ms (mediana z {args.runs}){budget}")
+    top = sorted(result["direct_ms"].items(), key=lambda item: -item[1])[:8]
+    print("największe: " + ", ".join(f"{module} {ms:.1f}" for module, ms in top))
+    print(f"zakazane:    {', '.join(result['forbidden']) or 'brak'}")
+
+
+def report(result, args):
+    rate = "bez przerw" if result["rate"] <= 0 else f"{result['rate']:g} odczytów/s"
+    latency = "  ".join(f"{k}={v:.2f}" for k, v in result["latency_ms"].items())
+    print(f"protokół {result['protocol']}, {rate}")
+    print(f"start:      pierwsza komenda {result['startup_s']:.2f} s po uruchomieniu sterownika")
+    print(f"odczyty:    wysłane {result['sent']}  przetworzone {result['processed']}"
+          f"  zgubione {result['dropped_readings']}  ({result['processed_per_s']:.0f}/s)")
+    print(f"komendy:    {result['commands']}  zgubione {result['dropped_commands']}"
+          f"  spóźnione (>{args.deadline:g} ms) {result['late_commands']}"
+          f"  najdłuższa przerwa {result['command_gap_max_s']:.3f} s")
+    if result["command_jitter_max_ms"]:
+        print(f"okres:      największa odchyłka odstępu komend {result['command_jitter_max_ms']:.2f} ms")
+    if result["latency_ms"]["p50"]:
+        print(f"RX->TX ms:  {latency}  max={result['latency_max_ms']:.2f}")
+    print(f"proces:     CPU {result['cpu_percent']:.1f} %  RSS {result['rss_mb']:.1f} MB"
+          f" (szczyt {result['rss_peak_mb']:.1f} MB)")
+    if result["cpu_children_percent"] >= 0.05:
+        print(f"potomne:    CPU {result['cpu_children_percent']:.1f} %")
+    print(f"atrapa:     {result['stub_requests']} żądań HTTP")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sterownika terrarium na symulowanej płytce")
+    parser.add_argument("--rate", type=float, default=200, help="odczytów na sekundę (0 = bez przerw)")
+    parser.add_argument("--duration", type=float, default=10, help="czas pomiaru (s) przy --rate > 0")
+    parser.add_argument("--count", type=int, default=20000, help="liczba odczytów przy --rate 0")
+    parser.add_argument("--send-interval", type=float, default=0.0,
+                        help="SEND_INTERVAL sterownika (0 = komenda po każdym odczycie, potrzebne do RX->TX)")
+    parser.add_argument("--binary", action="store_true", help="płytka negocjuje protokół binarny")
+    parser.add_argument("--split", action="store_true", help="sterownik z telemetrią w osobnym procesie")
+    parser.add_argument("--deadline", type=float, default=100, help="komenda spóźniona po tylu ms")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="zapis wyniku do pliku JSON (porównania między wersjami)")
+    parser.add_argument("--log", help="plik na logi sterownika")
+    parser.add_argument("--imports", action="store_true",
+                        help="tylko czas importu main.py; błąd, gdy ładuje sieć/walidację albo przekracza budżet")
+    parser.add_argument("--runs", type=int, default=5, help="liczba pomiarów przy --imports")
+    parser.add_argument("--import-budget", type=float, default=250,
+                        help="limit czasu importu main.py w ms (0 = bez limitu; na Pi Zero odpowiednio więcej)")
+    args = parser.parse_args()
+
+    if args.imports:
+        result = import_times(args.runs)
+        report_imports(result, args)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(result, f, indent=2)
+        over_budget = args.import_budget and result["import_ms"] > args.import_budget
+        sys.exit(1 if result["forbidden"] or over_budget else 0)
+
+    result = asyncio.run(run(args))
+    report(result, args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,801 @@
 import influxdb_client
-from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.client.write_api import SYNCHRONOUS, WriteOptions
+from influxdb_client.domain.bucket_retention_rules import BucketRetentionRules
+from influxdb_client.rest import ApiException
+import argparse
+import asyncio
+import json
+import logging
+import math
 import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import prometheus_client
+import redis.asyncio as redis
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, Response
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 from dotenv import load_dotenv
 
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("terrarium_bridge")
+
 token = os.getenv("INFLUX_DB_TOKEN")
-org = "Terrarium"
-url = "http://terrarium_influx:8086"
-bucket = "terrarium_logs"
+org = os.getenv("INFLUX_DB_ORG", "Terrarium")
+url = os.getenv("INFLUX_DB_URL", "http://terrarium_influx:8086")
+bucket = os.getenv("INFLUX_DB_BUCKET", "terrarium_logs")
+redis_host = os.getenv("REDIS_HOST", "terrarium_settings")
+
+BRIDGE_PORT = int(os.getenv("BRIDGE_PORT", "8001"))
+# Zapis wsadowy do InfluxDB
+BATCH_SIZE = int(os.getenv("BRIDGE_BATCH_SIZE", "5000"))
+FLUSH_INTERVAL_MS = int(os.getenv("BRIDGE_FLUSH_INTERVAL_MS", "1000"))
+# Bufor na dysku na czas niedostępności InfluxDB
+SPOOL_PATH = os.getenv("BRIDGE_SPOOL_PATH", "/data/spool.lp")
+SPOOL_MAX_BYTES = int(os.getenv("BRIDGE_SPOOL_MAX_BYTES", str(256 * 1024 * 1024)))
+REPLAY_INTERVAL = float(os.getenv("BRIDGE_REPLAY_INTERVAL", "5"))
+REPLAY_CHUNK_BYTES = 1024 * 1024
+
+MEASUREMENT = "air_quality"
+FIELDS = ("temperature", "humidity", "air_quality", "fan", "heat", "mist",
+          "temp_setting", "hum_setting", "aq_thresh_setting")
+
+# Agregaty przyrostowe (mean/min/max) w osobnych kubełkach z własną retencją:
+# (nazwa, długość okna w s, retencja w dniach; 0 = bez limitu)
+ROLLUPS = (
+    ("1m", 60, int(os.getenv("INFLUX_DB_ROLLUP_1M_RETENTION_DAYS", "30"))),
+    ("1h", 3600, int(os.getenv("INFLUX_DB_ROLLUP_1H_RETENTION_DAYS", "0"))),
+)
+ROLLUP_FIELDS = ("temperature", "humidity", "air_quality", "fan", "heat", "mist")
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("BRIDGE_ROLLUP_FLUSH_INTERVAL", "10"))
+# Przeliczanie agregatów z surowych danych - zakres jednego zapytania
+BACKFILL_CHUNK = 86400
+
+# Ostatni stan terrarium dla API (/status czyta go z Redis zamiast z InfluxDB); wygasa, gdy sterownik
+# przestanie wysyłać próbki - tak jak zapasowe zapytanie API do InfluxDB sięga 10 minut wstecz
+STATE_KEY = "terrarium:{}:state"
+STATE_TTL = int(os.getenv("BRIDGE_STATE_TTL", "600"))
+
+# batch: od przyjęcia punktów do potwierdzenia paczki (z czekaniem na jej skompletowanie);
+# replay: jeden synchroniczny zapis fragmentu bufora
+INFLUX_WRITE_SECONDS = prometheus_client.Histogram(
+    "terrarium_bridge_influx_write_seconds", "Czas zapisu do InfluxDB", ["bucket", "path"])
+
+
+def count_lines(data):
+    newline = b"\n" if isinstance(data, bytes) else "\n"
+    return len(data.strip(newline).split(newline)) if data else 0
+
+
+def escape_tag(value):
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ").replace("=", "\\=")
+
+
+def rollup_bucket(name):
+    return f"{bucket}_{name}"
+
+
+def finite(name, value):
+    value = float(value)
+    # NaN/inf nie mają zapisu w protokole linii - InfluxDB odrzuciłby całą paczkę
+    if not math.isfinite(value):
+        raise ValueError(f"{name}={value}")
+    return value
+
+
+def to_line(sample):
+    """Próbka sterownika -> linia protokołu InfluxDB (bez pośrednich obiektów Point)"""
+    fields = ",".join(f"{name}={finite(name, sample[name])}" for name in FIELDS if sample.get(name) is not None)
+    if not fields:
+        raise ValueError("próbka bez pól pomiarowych")
+    line = f"{MEASUREMENT},location={escape_tag(sample.get('location', 'terrarium_1'))} {fields}"
+    if sample.get("time") is not None:
+        line += f" {int(finite('time', sample['time']) * 1e9)}"
+    return line
+
+
+class Rollup:
+    """Agregaty mean/min/max w oknach stałej długości, aktualizowane przy każdej próbce.
+
+    Otwarte okna są co jakiś czas zapisywane ponownie (ten sam znacznik czasu nadpisuje punkt),
+    więc agregat bieżącej minuty/godziny jest aktualny z opóźnieniem ROLLUP_FLUSH_INTERVAL.
+    Poprzednie okno zostaje otwarte na spóźnione próbki, starsze są zwalniane.
+
+    Okna rozpoczęte przed startem procesu są zapisywane dopiero po uzupełnieniu ich próbkami
+    z surowego kubełka (seed) - inaczej zrzut nadpisałby punkt agregatem z samych nowych próbek.
+    Próbki sprzed startu nadesłane przed seedem nie są sumowane w pamięci - seed odczyta je
+    z surowego kubełka; te, które przyjdą już w trakcie seeda, czekają w _backlog.
+    """
+
+    def __init__(self, name, step):
+        self.name = name
+        self.step = step
+        self.late = 0
+        self.started = time.time()
+        self.seeded = False
+        self._seeding = False
+        self._backlog = []  # (lokalizacja, czas, próbka) sprzed startu, nadesłane w trakcie seeda
+        self._windows = {}  # (lokalizacja, początek okna) -> {pole: [liczba, suma, min, max]}
+        self._latest = {}   # lokalizacja -> początek najnowszego okna
+        self._dirty = set()
+        self._stale = set()  # zamknięte okna ze spóźnionymi próbkami
+
+    @property
+    def stale(self):
+        return bool(self._stale)
+
+    def take_stale(self):
+        stale, self._stale = self._stale, set()
+        return stale
+
+    def mark_stale(self, windows):
+        self._stale |= windows
+
+    @property
+    def seed_range(self):
+        """Zakres surowych próbek sprzed startu, które należą do wciąż otwartych okien"""
+        return (int(self.started // self.step) - 1) * self.step, self.started
+
+    def begin_seed(self):
+        """Od tej chwili próbki sprzed startu mogą nie trafić do zapytania seeda - odkładamy je"""
+        self._seeding = True
+        self._backlog = []
+
+    def abort_seed(self):
+        # Odłożone próbki są już w surowym kubełku - następna próba seeda je odczyta
+        self._seeding = False
+        self._backlog = []
+
+    def seed(self, rows):
+        """Dokłada agregaty surowych próbek sprzed startu: (lokalizacja, początek okna, pole, liczba, suma, min, max)"""
+        for location, start, name, count, total, low, high in rows:
+            latest = self._latest.get(location)
+            if latest is None or start > latest:
+                self._latest[location] = latest = start
+            if start < latest - self.step or not count:
+                continue
+            count, total, low, high = int(count), float(total), float(low), float(high)
+            key = (location, start)
+            window = self._windows.setdefault(key, {})
+            acc = window.get(name)
+            if acc is None:
+                window[name] = [count, total, low, high]
+            else:
+                acc[0] += count
+                acc[1] += total
+                acc[2] = min(acc[2], low)
+                acc[3] = max(acc[3], high)
+            self._dirty.add(key)
+        self.seeded = True
+        self._seeding = False
+        backlog, self._backlog = self._backlog, []
+        for args in backlog:
+            self.add(*args)
+
+    def add(self, location, timestamp, sample):
+        start = int(timestamp // self.step) * self.step
+        if not self.seeded and timestamp < self.started:
+            if start < self.seed_range[0]:
+                # Poza zasięgiem seeda - okno przeliczy reaggregate_late
+                self.late += 1
+                self._stale.add((location, start))
+            elif self._seeding:
+                self._backlog.append((location, timestamp, sample))
+            return
+        latest = self._latest.get(location)
+        if latest is not None and start < latest - self.step:
+            # Okno już zamknięte - zostanie przeliczone z surowego kubełka (reaggregate_late)
+            self.late += 1
+            self._stale.add((location, start))
+            return
+        if latest is None or start > latest:
+            self._latest[location] = start
+
+        key = (location, start)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = {}
+        for name in ROLLUP_FIELDS:
+            value = sample.get(name)
+            if value is None:
+                continue
+            value = float(value)
+            acc = window.get(name)
+            if acc is None:
+                window[name] = [1, value, value, value]
+            else:
+                acc[0] += 1
+                acc[1] += value
+                if value < acc[2]:
+                    acc[2] = value
+                if value > acc[3]:
+                    acc[3] = value
+        self._dirty.add(key)
+
+    def flush(self):
+        """Linie dla okien zmienionych od ostatniego zrzutu; zamknięte okna są zwalniane"""
+        lines = []
+        held = set()
+        for key in self._dirty:
+            if not self.seeded and key[1] < self.started:
+                # Okno sprzed startu czeka na seed
+                held.add(key)
+                continue
+            lines.extend(self._lines(*key))
+        self._dirty = held
+        for location, start in list(self._windows):
+            if start < self._latest[location] - self.step:
+                del self._windows[(location, start)]
+                held.discard((location, start))
+        return lines
+
+    def _lines(self, location, start):
+        return rollup_lines(location, start, self._windows[(location, start)])
+
+
+def rollup_lines(location, start, window):
+    """Okno {pole: [liczba, suma, min, max]} -> linie mean/min/max z czasem początku okna"""
+    if not window:
+        return []
+    prefix = f"{MEASUREMENT},location={escape_tag(location)},stat="
+    suffix = f" {start * 1_000_000_000}"
+    stats = {"mean": [], "min": [], "max": []}
+    for name, (count, total, low, high) in window.items():
+        stats["mean"].append(f"{name}={total / count}")
+        stats["min"].append(f"{name}={low}")
+        stats["max"].append(f"{name}={high}")
+    return [prefix + stat + " " + ",".join(fields) + suffix for stat, fields in stats.items()]
+
+
+class Spool:
+    """Ograniczony plik dopisywany na końcu; paczki linii czekające na ponowny zapis do InfluxDB"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.offset = 0
+        if os.path.exists(self.offset_path):
+            try:
+                with open(self.offset_path) as f:
+                    offset = max(0, min(int(f.read()), self.size))
+                if offset:
+                    # Offset zawsze wskazuje początek linii - inaczej plik offsetu jest uszkodzony
+                    with open(path, "rb") as f:
+                        f.seek(offset - 1)
+                        if f.read(1) != b"\n":
+                            raise ValueError(f"{offset} nie jest początkiem linii")
+                self.offset = offset
+            except (OSError, ValueError) as e:
+                # Np. plik ucięty przy zaniku zasilania - odtwarzamy od początku (duplikaty punktów
+                # InfluxDB nadpisze tym samym znacznikiem czasu, zamiast je zgubić)
+                logger.error(f"[SPOOL] Niepoprawny offset {self.offset_path} ({e}) - odtwarzanie od początku")
+
+    @property
+    def pending(self):
+        return self.size > self.offset
+
+    def append(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if not data.endswith(b"\n"):
+            data += b"\n"
+        with self._lock:
+            if self.size + len(data) > self.max_bytes:
+                lost = count_lines(data)
+                self.dropped += lost
+                logger.error(f"[SPOOL] Bufor pełny ({self.size} B) - odrzucono {lost} punktów")
+                return False
+            with open(self.path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.size += len(data)
+        return True
+
+    def read_chunk(self, max_bytes=REPLAY_CHUNK_BYTES):
+        """Najstarszy fragment bufora (całe linie) i offset jego końca"""
+        with self._lock:
+            start = self.offset
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            chunk = f.read(max_bytes)
+        end = chunk.rfind(b"\n") + 1
+        if end == 0 and chunk:
+            # Pojedyncza linia dłuższa niż fragment - czytamy ją w całości
+            with open(self.path, "rb") as f:
+                f.seek(start)
+                chunk = f.readline()
+            end = len(chunk)
+        return chunk[:end], start + end
+
+    def commit(self, end):
+        """Zaznacza fragment do offsetu `end` jako zapisany; pusty bufor jest obcinany"""
+        with self._lock:
+            self.offset = end
+            if self.offset >= self.size:
+                with open(self.path, "wb"):
+                    pass
+                self.size = self.offset = 0
+            tmp = self.offset_path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(str(self.offset))
+            os.replace(tmp, self.offset_path)
+
+
+class Ingestor:
+    """Zapis wsadowy do InfluxDB; przy awarii punkty trafiają do bufora na dysku i wracają po kolei"""
+
+    def __init__(self, client, spool, bucket):
+        self.client = client
+        self.spool = spool
+        self.bucket = bucket
+        # Paczki odrzucone przez InfluxDB (4xx) - odkładane obok bufora do ręcznego przejrzenia
+        self.rejected = Spool(spool.path + ".rejected", spool.max_bytes)
+        self.received = 0
+        self.written = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.quarantined = 0
+        self.failed_batches = 0
+        self.failed_replays = 0
+        self._batch_seconds = INFLUX_WRITE_SECONDS.labels(bucket, "batch")
+        self._replay_seconds = INFLUX_WRITE_SECONDS.labels(bucket, "replay")
+        self._lock = threading.Lock()
+        self.write_api = self._batching_api()
+        self.replay_api = client.write_api(write_options=SYNCHRONOUS)
+
+    def _batching_api(self):
+        # (czas przyjęcia, liczba linii) w kolejności write(); write_scheduler ma jeden wątek, więc paczki
+        # są potwierdzane w tej samej kolejności i zdejmujemy je z początku kolejki
+        self._enqueued = enqueued = deque()
+        # Bez wewnętrznych ponowień - nieudana paczka od razu ląduje w buforze i wraca przy odtwarzaniu
+        return self.client.write_api(
+            write_options=WriteOptions(batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL_MS, max_retries=0),
+            success_callback=lambda conf, data: self._on_success(enqueued, data),
+            error_callback=lambda conf, data, exception: self._on_error(enqueued, data, exception),
+        )
+
+    def detach_batch(self):
+        """Nowe punkty idą do świeżego write_api; zwraca poprzednie - jego close() zapisuje zaległą paczkę.
+
+        WriteApi.flush() w influxdb_client nic nie robi, a close() blokuje, więc wołający zamyka je w wątku.
+        """
+        batch, self.write_api = self.write_api, self._batching_api()
+        return batch
+
+    def write(self, lines):
+        self.received += len(lines)
+        if self.spool.pending:
+            # Dopóki bufor nie jest pusty, nowe punkty ustawiają się za nim (zachowanie kolejności)
+            self._spool("\n".join(lines))
+        else:
+            self._enqueued.append((time.perf_counter(), len(lines)))
+            self.write_api.write(bucket=self.bucket, org=org, record=lines)
+
+    def _observe_batch(self, enqueued, lines):
+        # Wywołania zwrotne write_api przychodzą z jego wątku
+        with self._lock:
+            if not enqueued:
+                return
+            start = enqueued[0][0]
+            while lines > 0 and enqueued:
+                t, n = enqueued.popleft()
+                if n > lines:
+                    enqueued.appendleft((t, n - lines))
+                lines -= n
+        self._batch_seconds.observe(time.perf_counter() - start)
+
+    def _on_success(self, enqueued, data):
+        lines = count_lines(data)
+        self._observe_batch(enqueued, lines)
+        self.written += lines
+
+    def _on_error(self, enqueued, data, exception):
+        self._observe_batch(enqueued, count_lines(data))
+        self.failed_batches += 1
+        logger.warning(f"[INFLUX] Zapis paczki nieudany ({exception}) - do bufora na dysku")
+        self._spool(data)
+
+    def _spool(self, data):
+        if self.spool.append(data):
+            self.spooled += count_lines(data)
+
+    def replay(self):
+        """Odtwarza bufor od najstarszych punktów; przerywa przy błędzie sieci lub serwera (5xx, 429)"""
+        while self.spool.pending:
+            chunk, end = self.spool.read_chunk()
+            start = time.perf_counter()
+            try:
+                self.replay_api.write(bucket=self.bucket, org=org, record=chunk)
+            except Exception as e:
+                self._replay_seconds.observe(time.perf_counter() - start)
+                self.failed_replays += 1
+                if not isinstance(e, ApiException) or e.status is None or e.status >= 500 or e.status == 429:
+                    raise
+                # Ponowienie niczego nie zmieni - paczka blokowałaby bufor na zawsze
+                lost = count_lines(chunk)
+                logger.error(f"[SPOOL] InfluxDB odrzucił paczkę ({e.status} {e.reason}) - "
+                             f"{lost} punktów do {self.rejected.path}")
+                if self.rejected.append(chunk):
+                    self.quarantined += lost
+            else:
+                self._replay_seconds.observe(time.perf_counter() - start)
+                self.replayed += count_lines(chunk)
+            self.spool.commit(end)
+        logger.info(f"[SPOOL] Bufor {self.bucket} odtworzony do InfluxDB")
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "written": self.written,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "quarantined": self.quarantined,
+            "dropped": self.spool.dropped + self.rejected.dropped,
+            "failed_batches": self.failed_batches,
+            "failed_replays": self.failed_replays,
+            "spool_bytes": self.spool.size - self.spool.offset,
+        }
+
+    def close(self):
+        self.write_api.close()
+        self.replay_api.close()
+
+
+client = None
+ingestor = None
+rollups = {}            # nazwa -> Rollup
+rollup_ingestors = {}   # nazwa -> Ingestor zapisujący do kubełka agregatów
+buckets_ready = False
+samples_rejected = 0    # próbki pominięte przez /samples (niepoprawne pola)
+r = None
+
+
+class StatsCollector:
+    """Liczniki Ingestor.stats() w /metrics - odczytywane przy pobraniu, bez osobnej kopii"""
+
+    POINTS = {
+        "received": "Punkty przyjęte przez /samples",
+        "written": "Punkty zapisane paczkami do InfluxDB",
+        "spooled": "Punkty odłożone do bufora na dysku",
+        "replayed": "Punkty odtworzone z bufora do InfluxDB",
+        "quarantined": "Punkty odrzucone przez InfluxDB (4xx), odłożone do przejrzenia",
+        "dropped": "Punkty utracone przy pełnym buforze",
+    }
+
+    def collect(self):
+        if ingestor is None:
+            return
+        stats = {i.bucket: i.stats() for i in (ingestor, *rollup_ingestors.values())}
+        for key, help in self.POINTS.items():
+            family = CounterMetricFamily(f"terrarium_bridge_points_{key}", help, labels=["bucket"])
+            for name, s in stats.items():
+                family.add_metric([name], s[key])
+            yield family
+        errors = CounterMetricFamily("terrarium_bridge_influx_errors", "Nieudane zapisy do InfluxDB",
+                                     labels=["bucket", "path"])
+        spool = GaugeMetricFamily("terrarium_bridge_spool_bytes", "Bajty czekające w buforze na dysku",
+                                  labels=["bucket"])
+        for name, s in stats.items():
+            errors.add_metric([name, "batch"], s["failed_batches"])
+            errors.add_metric([name, "replay"], s["failed_replays"])
+            spool.add_metric([name], s["spool_bytes"])
+        yield errors
+        yield spool
+        yield CounterMetricFamily("terrarium_bridge_samples_rejected", "Próbki pominięte przez /samples",
+                                  value=samples_rejected)
+
+
+prometheus_client.REGISTRY.register(StatsCollector())
+
+
+def ensure_rollup_buckets():
+    """Zakłada brakujące kubełki agregatów z retencją z konfiguracji"""
+    buckets_api = client.buckets_api()
+    for name, step, retention_days in ROLLUPS:
+        if buckets_api.find_bucket_by_name(rollup_bucket(name)) is not None:
+            continue
+        rules = []
+        if retention_days:
+            rules.append(BucketRetentionRules(type="expire", every_seconds=retention_days * 86400))
+        buckets_api.create_bucket(bucket_name=rollup_bucket(name), retention_rules=rules, org=org)
+        logger.info(f"[ROLLUP] Utworzono kubełek {rollup_bucket(name)} (retencja: {retention_days or '∞'} d)")
+
+
+def query_raw_windows(step, start, stop):
+    """Liczba/suma/min/max surowych próbek z [start, stop) w oknach długości step"""
+    fields = ", ".join(f'"{name}"' for name in ROLLUP_FIELDS)
+    query = f'''from(bucket: "{bucket}")
+  |> range(start: _start, stop: _stop)
+  |> filter(fn: (r) => r._measurement == "{MEASUREMENT}" and contains(value: r._field, set: [{fields}]))
+  |> window(every: {step}s)
+  |> reduce(
+      identity: {{count: 0, sum: 0.0, min: 0.0, max: 0.0}},
+      fn: (r, accumulator) => ({{
+        count: accumulator.count + 1,
+        sum: accumulator.sum + r._value,
+        min: if accumulator.count == 0 or r._value < accumulator.min then r._value else accumulator.min,
+        max: if accumulator.count == 0 or r._value > accumulator.max then r._value else accumulator.max,
+      }}))'''
+    params = {"_start": datetime.fromtimestamp(start, timezone.utc),
+              "_stop": datetime.fromtimestamp(stop, timezone.utc)}
+    rows = []
+    for table in client.query_api().query(query, params=params):
+        for record in table.records:
+            rows.append((record.values["location"], int(record.get_start().timestamp()), record.get_field(),
+                         record["count"], record["sum"], record["min"], record["max"]))
+    return rows
+
+
+async def seed_rollups():
+    pending = [rollup for rollup in rollups.values() if not rollup.seeded]
+    # W jednym kroku pętli: próbki sprzed startu nadesłane od teraz nie zdążą do surowego kubełka
+    # przed zapytaniem, więc Rollup je odkłada; wcześniejsze zapisuje close() starego write_api
+    for rollup in pending:
+        rollup.begin_seed()
+    batch = ingestor.detach_batch()
+    try:
+        await asyncio.to_thread(batch.close)
+        for rollup in pending:
+            rows = await asyncio.to_thread(query_raw_windows, rollup.step, *rollup.seed_range)
+            # Scalanie w pętli zdarzeń - tu też działa Rollup.add
+            rollup.seed(rows)
+            logger.info(f"[ROLLUP] Okna {rollup.name} sprzed startu uzupełnione ({len(rows)} serii)")
+    except Exception:
+        for rollup in pending:
+            if not rollup.seeded:
+                rollup.abort_seed()
+        raise
+
+
+def raw_window_lines(step, windows=None, start=None, stop=None):
+    """Linie agregatu przeliczone z surowego kubełka: wskazane okna (lokalizacja, początek)
+    albo wszystkie okna z [start, stop); zapytania obejmują najwyżej dobę"""
+    if windows is not None:
+        starts = sorted({window_start for _, window_start in windows})
+        ranges = []
+        for window_start in starts:
+            if ranges and window_start + step <= ranges[-1][0] + BACKFILL_CHUNK:
+                ranges[-1][1] = window_start + step
+            else:
+                ranges.append([window_start, window_start + step])
+    else:
+        ranges = [[lo, min(lo + BACKFILL_CHUNK, stop)] for lo in range(start, stop, BACKFILL_CHUNK)]
+
+    lines = []
+    for lo, hi in ranges:
+        found = {}
+        for location, window_start, name, count, total, low, high in query_raw_windows(step, lo, hi):
+            key = (location, window_start)
+            if count and (windows is None or key in windows):
+                found.setdefault(key, {})[name] = [int(count), float(total), float(low), float(high)]
+        for (location, window_start), window in found.items():
+            lines.extend(rollup_lines(location, window_start, window))
+    return lines
+
+
+async def reaggregate_late():
+    """Okna, do których przyszły spóźnione próbki (np. uzupełnianie historii), liczone od nowa z surowych danych"""
+    stale = {name: rollup.take_stale() for name, rollup in rollups.items()}
+    try:
+        # Spóźnione próbki mogą jeszcze czekać w paczce write_api
+        await asyncio.to_thread(ingestor.detach_batch().close)
+        for name, windows in stale.items():
+            if not windows:
+                continue
+            lines = await asyncio.to_thread(raw_window_lines, rollups[name].step, windows)
+            if lines:
+                rollup_ingestors[name].write(lines)
+            logger.info(f"[ROLLUP] Przeliczono {len(windows)} okien {name} ze spóźnionymi próbkami")
+            stale[name] = set()
+    except Exception:
+        for name, windows in stale.items():
+            rollups[name].mark_stale(windows)
+        raise
+
+
+async def replay_loop():
+    global buckets_ready
+    while True:
+        await asyncio.sleep(REPLAY_INTERVAL)
+        pending = [i for i in (ingestor, *rollup_ingestors.values()) if i.spool.pending]
+        seeded = all(rollup.seeded for rollup in rollups.values())
+        stale = any(rollup.stale for rollup in rollups.values())
+        if not pending and buckets_ready and seeded and not stale:
+            continue
+        try:
+            if not await asyncio.to_thread(client.ping):
+                continue
+            if not buckets_ready:
+                await asyncio.to_thread(ensure_rollup_buckets)
+                buckets_ready = True
+            for i in pending:
+                await asyncio.to_thread(i.replay)
+            if not seeded:
+                # Po odtworzeniu bufora - w surowym kubełku są już próbki zapisane przed restartem
+                await seed_rollups()
+            if stale:
+                await reaggregate_late()
+        except Exception as e:
+            logger.warning(f"[SPOOL] Odtwarzanie przerwane: {e}")
+
+
+def flush_rollups():
+    for name, rollup in rollups.items():
+        lines = rollup.flush()
+        if lines:
+            rollup_ingestors[name].write(lines)
+
+
+async def rollup_loop():
+    while True:
+        await asyncio.sleep(ROLLUP_FLUSH_INTERVAL)
+        flush_rollups()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, ingestor, r
+    client = influxdb_client.InfluxDBClient(url=url, token=token, org=org)
+    ingestor = Ingestor(client, Spool(SPOOL_PATH, SPOOL_MAX_BYTES), bucket)
+    spool_base, spool_ext = os.path.splitext(SPOOL_PATH)
+    for name, step, retention_days in ROLLUPS:
+        rollups[name] = Rollup(name, step)
+        spool = Spool(f"{spool_base}_{name}{spool_ext}", SPOOL_MAX_BYTES)
+        rollup_ingestors[name] = Ingestor(client, spool, rollup_bucket(name))
+    r = redis.Redis(host=redis_host, port=6379, db=0)
+    tasks = [asyncio.ensure_future(replay_loop()), asyncio.ensure_future(rollup_loop())]
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        flush_rollups()
+        for i in (ingestor, *rollup_ingestors.values()):
+            i.close()
+        client.close()
+        await r.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+async def publish_state(location, timestamp, fields):
+    """Zapisuje ostatnie wartości pomiaru w haszu Redis (z czasem wygaśnięcia); starszy pomiar
+    (uzupełnianie historii, paczki spoza kolejności) nie nadpisuje nowszego"""
+    key = STATE_KEY.format(location)
+    try:
+        async with r.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # WATCH: równoległe żądanie z nowszą próbką przerywa transakcję i porównujemy od nowa
+                    await pipe.watch(key)
+                    stored = await pipe.hget(key, "time")
+                    try:
+                        if stored is not None and float(stored) > timestamp:
+                            return
+                    except ValueError:
+                        pass
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.hset(key, mapping={**fields, "time": timestamp})
+                    pipe.expire(key, STATE_TTL)
+                    await pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue
+    except redis.RedisError as e:
+        logger.warning(f"[REDIS] Nie udało się zapisać stanu {location}: {e}")
+
+
+@app.post("/samples")
+async def post_samples(request: Request):
+    # Lista próbek sterownika: [{"location": ..., "time": ..., "temperature": ..., ...}, ...]
+    global samples_rejected
+    try:
+        samples = json.loads(await request.body())
+        if not isinstance(samples, list):
+            raise ValueError("oczekiwano listy próbek")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Niepoprawne próbki: {e}")
+
+    # Zła próbka (np. nan) jest pomijana - odrzucenie całej paczki zablokowałoby kolejkę sterownika
+    lines, accepted, errors = [], [], []
+    for sample in samples:
+        try:
+            lines.append(to_line(sample))
+        except (ValueError, TypeError, AttributeError) as e:
+            errors.append(str(e))
+            continue
+        accepted.append(sample)
+    if errors:
+        samples_rejected += len(errors)
+        logger.warning(f"[BRIDGE] Pominięto {len(errors)} niepoprawnych próbek (np. {errors[0]})")
+    if lines:
+        ingestor.write(lines)
+
+    now = time.time()
+    latest = {}
+    for sample in accepted:
+        location = sample.get("location", "terrarium_1")
+        timestamp = float(sample["time"]) if sample.get("time") is not None else now
+        for rollup in rollups.values():
+            rollup.add(location, timestamp, sample)
+        if location not in latest or timestamp >= latest[location][0]:
+            latest[location] = (timestamp, sample)
+    for location, (timestamp, sample) in latest.items():
+        await publish_state(location, timestamp, {k: sample[k] for k in FIELDS if sample.get(k) is not None})
+    return {"accepted": len(lines), "rejected": len(errors)}
+
+
+@app.get("/stats")
+async def get_stats():
+    stats = ingestor.stats()
+    stats["rejected_samples"] = samples_rejected
+    stats["rollups"] = {
+        name: {**rollup_ingestors[name].stats(), "late": rollups[name].late} for name in rollups
+    }
+    return stats
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(prometheus_client.generate_latest(), media_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+def backfill_rollups(start, stop):
+    """Agregaty z istniejącej surowej historii (np. sprzed wdrożenia agregatów); tylko zamknięte okna"""
+    ensure_rollup_buckets()
+    write_api = client.write_api(write_options=SYNCHRONOUS)
+    try:
+        for name, step, _ in ROLLUPS:
+            lo = int(start // step) * step
+            # Bieżące i poprzednie okno prowadzi działający bridge
+            hi = min(int(stop // step) * step, (int(time.time() // step) - 1) * step)
+            written = 0
+            for chunk in range(lo, hi, BACKFILL_CHUNK):
+                lines = raw_window_lines(step, start=chunk, stop=min(chunk + BACKFILL_CHUNK, hi))
+                if lines:
+                    write_api.write(bucket=rollup_bucket(name), org=org, record=lines)
+                    written += len(lines)
+            logger.info(f"[ROLLUP] {rollup_bucket(name)}: zapisano {written} punktów")
+    finally:
+        write_api.close()
+
 
-client = influxdb_client.InfluxDBClient(url=url, token=token, org=org)
-write_api = client.write_api(write_options=SYNCHRONOUS)
+def parse_time(value):
+    """Sekundy od epoki albo ISO 8601 (bez strefy = UTC)"""
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
 
-# Przykład zapisu pomiaru
-point = influxdb_client.Point("air_quality") \
-    .tag("location", "terrarium_1") \
-    .field("temperature", 24.0) \
-    .field("humidity", 58.0)
 
-write_api.write(bucket=bucket, org=org, record=point)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bridge sterownik -> InfluxDB")
+    parser.add_argument("--backfill-rollups", metavar="OD",
+                        help="zamiast serwera: przelicz agregaty 1m/1h z surowej historii od podanego czasu")
+    parser.add_argument("--until", metavar="DO", help="koniec zakresu --backfill-rollups (domyślnie teraz)")
+    args = parser.parse_args()
+    if args.backfill_rollups:
+        client = influxdb_client.InfluxDBClient(url=url, token=token, org=org)
+        try:
+            backfill_rollups(parse_time(args.backfill_rollups),
+                             parse_time(args.until) if args.until else time.time())
+        finally:
+            client.close()
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=BRIDGE_PORT)
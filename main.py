@@ -2,16 +2,34 @@ import serial
 import json
 import time
 import glob
-from pydantic import BaseModel
 import os
 import logging
-import requests
 import asyncio
-import aiohttp
-import threading
+import argparse
+import math
+import random
+import struct
+import binascii
+import signal
+import queue
+import logging.handlers
+import multiprocessing
+import tempfile
+import importlib
+from array import array
+from dataclasses import dataclass, asdict, fields as dataclass_fields
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+from itertools import islice
+from contextlib import AsyncExitStack
+from functools import partial
+from typing import Optional
 from dotenv import load_dotenv
 
-logging.basicConfig(level=logging.INFO)
+import metrics
+import ringstore
+from sharedchannel import TelemetryChannel
+
 logger = logging.getLogger("terrarium_controller")
 
 load_dotenv()
@@ -24,22 +42,170 @@ TS_SETTINGS_CHANNEL_ID = os.getenv("TS_SETTINGS_CHANNEL_ID")
 TS_SETTINGS_WRITE_KEY = os.getenv("TS_SETTINGS_WRITE_API_KEY")
 TS_SETTINGS_READ_KEY = os.getenv("TS_SETTINGS_READ_API_KEY")
 
-SEND_INTERVAL = 1.0
+TS_API_URL = os.getenv("TS_API_URL", "https://api.thingspeak.com")
+# Limity czasu i ponowienia żądań HTTP do ThingSpeak
+TS_TIMEOUT = 5.0
+TS_RETRIES = 2
+TS_RETRY_BACKOFF = 0.5
+# Bulk update ThingSpeak przyjmuje do 960 wpisów w jednym żądaniu
+TS_BULK_BATCH_SIZE = 960
+# Zaległe okna trzymane podczas braku sieci (24 h okien po 15 s)
+TS_BACKLOG_SIZE = 5760
+# Odpytywanie ustawień: krótszy okres, gdy zmiany napływają, dłuższy, gdy nic się nie dzieje
+TS_SETTINGS_INTERVAL = 15.0
+TS_SETTINGS_INTERVAL_MIN = 5.0
+TS_SETTINGS_INTERVAL_MAX = 60.0
+# Mapowanie pól kanału ustawień (f1=Temp, f2=Hum, f3=AQ)
+TS_SETTINGS_FIELDS = (("field1", "temp_setting"), ("field2", "hum_setting"), ("field3", "aq_thresh_setting"))
+
+# Redis (opcjonalny): API publikuje zmiany nastaw, sterownik stosuje je od razu
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_SETTINGS_KEY = "terrarium:{}:settings"
+REDIS_SETTINGS_CHANNEL = "terrarium:{}:settings:changed"
+
+# Bridge (opcjonalny): każda próbka trafia do InfluxDB paczkami co kilka sekund
+BRIDGE_URL = os.getenv("BRIDGE_URL")
+BRIDGE_FLUSH_INTERVAL = float(os.getenv("BRIDGE_FLUSH_INTERVAL", "5.0"))
+BRIDGE_BUFFER_SIZE = 10000
+# Próbek w jednym żądaniu - duża zaległość idzie kilkoma żądaniami zamiast jednego ogromnego
+BRIDGE_BATCH_SIZE = 2000
+
+# Plik z listą terrariów dla trybu --supervisor (patrz terrariums.example.json)
+TERRARIUMS_FILE = os.getenv("TERRARIUMS_FILE", "terrariums.json")
+
+# Okres kroku regulacji i wysyłki komend (s, zegar monotoniczny) na średniej odczytów z okresu;
+# 0 = krok i komenda po każdym odczycie
+SEND_INTERVAL = float(os.getenv("SEND_INTERVAL", "1.0"))
+# Bez odczytu przez tyle sekund krok regulacji wyłącza grzanie i zraszanie
+CONTROL_STALE_AFTER = float(os.getenv("CONTROL_STALE_AFTER", "10.0"))
+
+# Protokół binarny na UART (opcjonalny): prędkość proponowana płytce, 0 = tylko linie tekstowe
+SERIAL_BAUD = 9600
+SERIAL_BINARY_BAUD = int(os.getenv("SERIAL_BINARY_BAUD", "0"))
+SERIAL_NEGOTIATE_TIMEOUT = 2.0
+# Bez poprawnej ramki przez tyle sekund wracamy do tekstu (np. płytka się zresetowała)
+SERIAL_BINARY_SILENCE = 5.0
+# Bez linii w formacie tekstowym przez tyle sekund łączymy od nowa (np. płytka została w trybie binarnym)
+SERIAL_TEXT_SILENCE = float(os.getenv("SERIAL_TEXT_SILENCE", "30.0"))
+# Rozpoznawanie płytek: wszystkie porty naraz, `?ID` -> `!ID <id>` albo poprawny odczyt w tym czasie
+# (otwarcie portu resetuje Arduino - start bootloadera trwa ok. 2 s)
+SERIAL_PROBE_TIMEOUT = float(os.getenv("SERIAL_PROBE_TIMEOUT", "4.0"))
+SERIAL_PROBE_RETRY = 1.0
+# Zapamiętane przypisanie terrarium -> port; po restarcie sprawdzany jest najpierw tylko ten port
+PORT_CACHE_FILE = os.getenv("PORT_CACHE_FILE", "ports.json")
+# ID płytki pojedynczego terrarium (tryb bez --supervisor); puste = pierwsza płytka, która odpowie
+BOARD_ID = os.getenv("BOARD_ID")
+
+# Logowanie: co który odczyt/komenda trafia do logu na INFO (wszystkie na DEBUG)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "60"))
+# Ostatnie surowe dane z portu (RX i TX) - zrzut na SIGUSR1 lub przy błędzie ramki
+RAW_RING_SIZE = 256
+RAW_DUMP_MIN_INTERVAL = 60.0
+
+# Lokalny bufor telemetrii (plik mmap na terrarium); pusty katalog = wyłączony
+RINGSTORE_DIR = os.getenv("RINGSTORE_DIR", "telemetry")
+RINGSTORE_CAPACITY = int(os.getenv("RINGSTORE_CAPACITY", str(ringstore.DEFAULT_CAPACITY)))
+# Najwięcej rekordów w jednej odpowiedzi GET /samples
+RINGSTORE_PAGE = 10000
+
+# Ciepły start: stan regulatorów i nastawy zapisywane co SNAPSHOT_INTERVAL s; pusty katalog = wyłączony
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "state")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "30.0"))
+# Starszy stan regulatorów pomijamy (po długiej przerwie nie opisuje już terrarium); nastawy zawsze
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", "300.0"))
+SNAPSHOT_VERSION = 1
+
+# Tryb --split: sterowanie i telemetria w osobnych procesach (kanał w pamięci współdzielonej)
+TELEMETRY_CHANNEL_SIZE = 4096
+TELEMETRY_POLL_INTERVAL = 0.2
+TELEMETRY_WATCH_INTERVAL = 5.0
+# Wyższy priorytet procesu sterowania w trybie --split: nice (np. -10) albo SCHED_FIFO 1-99
+CONTROL_NICE = int(os.getenv("CONTROL_NICE", "0"))
+CONTROL_RT_PRIORITY = int(os.getenv("CONTROL_RT_PRIORITY", "0"))
 
-class Settings(BaseModel):
+# Metryki w formacie Prometheusa (GET /metrics, GET /samples z bufora); 0 = serwer wyłączony
+# W trybie --split proces telemetrii wystawia swoje metryki i /samples na METRICS_PORT + 1
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+
+SERIAL_LINES = metrics.REGISTRY.counter(
+    "terrarium_serial_lines_total", "Linie lub ramki odebrane z płytki", ["terrarium"])
+SERIAL_ERRORS = metrics.REGISTRY.counter(
+    "terrarium_serial_errors_total", "Odrzucone linie/ramki (decode, parse, crc)", ["terrarium", "kind"])
+SERIAL_FRAMES_LOST = metrics.REGISTRY.counter(
+    "terrarium_serial_frames_lost_total", "Ramki binarne pominięte według numerów kolejnych", ["terrarium"])
+SERIAL_FIRST_SAMPLE = metrics.REGISTRY.histogram(
+    "terrarium_serial_first_sample_seconds", "Czas od rozpoczęcia łączenia do pierwszego poprawnego odczytu",
+    ["terrarium"], bounds=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0, 60.0))
+READINGS_DROPPED = metrics.REGISTRY.counter(
+    "terrarium_readings_dropped_total", "Odczyty odrzucone przy pełnej kolejce", ["terrarium"])
+SERIAL_WRITE_SECONDS = metrics.REGISTRY.histogram(
+    "terrarium_serial_write_seconds", "Czas zapisu komendy na port", ["terrarium"])
+CONTROL_SECONDS = metrics.REGISTRY.histogram(
+    "terrarium_control_seconds", "Czas Controller.process_sensor_data()", ["terrarium"])
+CONTROL_TICK_LAG = metrics.REGISTRY.histogram(
+    "terrarium_control_tick_lag_seconds", "Spóźnienie kroku regulacji względem harmonogramu", ["terrarium"])
+CONTROL_OVERRUNS = metrics.REGISTRY.counter(
+    "terrarium_control_overruns_total", "Kroki regulacji pominięte z powodu spóźnienia", ["terrarium"])
+CONTROL_STALE = metrics.REGISTRY.counter(
+    "terrarium_control_stale_total", "Kroki regulacji bez świeżego odczytu (tryb bezpieczny)", ["terrarium"])
+TELEMETRY_DROPPED = metrics.REGISTRY.counter(
+    "terrarium_telemetry_dropped_total", "Próbki odrzucone, bo proces telemetrii nie nadążał", ["terrarium"])
+HTTP_SECONDS = metrics.REGISTRY.histogram(
+    "terrarium_http_request_seconds", "Czas pojedynczej próby żądania HTTP", ["service"])
+HTTP_ERRORS = metrics.REGISTRY.counter(
+    "terrarium_http_errors_total", "Nieudane próby żądań HTTP (sieć, 5xx, 429)", ["service"])
+HTTP_RETRIES = metrics.REGISTRY.counter(
+    "terrarium_http_retries_total", "Ponowienia żądań HTTP", ["service"])
+SETTINGS_APPLY_LAG = metrics.REGISTRY.histogram(
+    "terrarium_settings_apply_lag_seconds", "Opóźnienie od zapisu nastaw do ich zastosowania",
+    ["terrarium", "source"], bounds=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0))
+
+# Zwykłe dataclassy zamiast pydantic: wartości są sprawdzane raz, tam gdzie wchodzą do programu
+# (ThingSpeak, Redis, plik stanu, terrariums.json), a nie przy każdej zmianie nastaw
+@dataclass
+class Settings:
     temp_setting: float = 25.0
     hum_setting: float = 30.0
     aq_thresh_setting: float = 250
     # fan_delta: float = 5.0
     # heat_hysteresis: float = 0.5
 
-class LogParams(BaseModel):
-    pass
+
+@dataclass
+class TerrariumConfig:
+    """Port szeregowy i kanały ThingSpeak jednego terrarium"""
+    name: str = "terrarium_1"
+    port: Optional[str] = None
+    board_id: Optional[str] = None  # ID z odpowiedzi `!ID <id>` - wtedy port nie jest potrzebny
+    ts_logs_channel_id: Optional[str] = None
+    ts_logs_write_key: Optional[str] = None
+    ts_settings_channel_id: Optional[str] = None
+    ts_settings_read_key: Optional[str] = None
+    binary_baud: int = SERIAL_BINARY_BAUD
+
+    @classmethod
+    def from_dict(cls, entry: dict):
+        """Wpis z terrariums.json; nieznane klucze są pomijane, błędne typy zgłaszają ValueError"""
+        values = {}
+        for field in dataclass_fields(cls):
+            if field.name not in entry:
+                continue
+            value = entry[field.name]
+            if field.name == "binary_baud":
+                value = int(value)
+            elif value is not None and not isinstance(value, str):
+                raise ValueError(f"{field.name}: oczekiwano tekstu, jest {value!r}")
+            values[field.name] = value
+        return cls(**values)
 
 
 class CoolingPID:
-    def __init__(self, target, delta_range):
+    def __init__(self, target, delta_range, clock=time.monotonic):
         self.target = target
+        # Źródło czasu do liczenia dt (w odtwarzaniu offline - czas z nagrania)
+        self.clock = clock
         
         # Automatyczne dobranie Kp:
         # Chcemy, aby przy błędzie równym 'delta_range', wyjście wynosiło 255 (max).
@@ -53,12 +219,12 @@ class CoolingPID:
 
         self.prev_error = 0
         self.integral = 0
-        self.prev_time = time.time()
+        self.prev_time = clock()
         self.min_out = 170
         self.max_out = 255
 
     def compute(self, current_temp):
-        now = time.time()
+        now = self.clock()
         dt = now - self.prev_time
         
         # Dla chłodzenia: Error jest dodatni, gdy jest ZA CIEPŁO
@@ -141,14 +307,17 @@ class HumidifierController:
         self.hum_setting = new_hum
 
 class Controller:
-    def __init__(self, settings: Settings):
+    def __init__(self, settings: Settings, clock=time.monotonic, log=None):
+        self.logger = log or logger
         self.temp_setting: float = settings.temp_setting
         self.hum_setting: float = settings.hum_setting
         self.aq_thresh_setting: float = settings.aq_thresh_setting
         self.aq_trigger_delay = 0
+        # Liczba odczytów po zraszaniu, przez które zła jakość powietrza nie włącza wietrzenia
+        self.aq_trigger_steps = 90
         # self.fan_delta: float = settings.fan_delta
         # self.heat_hysteresis: float = settings.heat_hysteresis
-        self.cooling_pid = CoolingPID(settings.temp_setting + (settings.temp_setting * 0.05), delta_range=5.0)
+        self.cooling_pid = CoolingPID(settings.temp_setting + (settings.temp_setting * 0.05), delta_range=5.0, clock=clock)
         self.heating_controller = HeatingController(heat_hysteresis=0.5, heat_setting=settings.temp_setting)
         self.humidifier_controller = HumidifierController(hum_setting=self.hum_setting)
         self.clear_smog = False
@@ -160,21 +329,26 @@ class Controller:
             self.aq_trigger_delay -= 1
         # wywietrzenie w przypadku slabego powietrza
 
+        # Komunikaty tylko przy zmianie stanu, nie przy każdym odczycie
         if float(quality) > self.aq_thresh_setting:
             if self.aq_trigger_delay == 0:
+                if not self.clear_smog:
+                    self.logger.info("Zanieczyszczenie powietrza powyżej progu! Wentylator na pełnej mocy.")
                 self.clear_smog = True
-                # print("Zanieczyszczenie powietrza powyżej progu! Wentylator na pełnej mocy.")
         elif float(quality) <= self.aq_thresh_setting * 0.9:
+            if self.clear_smog:
+                self.logger.info("Jakość powietrza poprawiła się. Wentylator wraca do normalnej pracy.")
             self.clear_smog = False
-            print("Jakość powietrza poprawiła się. Wentylator wraca do normalnej pracy.")
 
 
         if float(hum) > self.hum_setting + 10:
+                if not self.clear_humidity:
+                    self.logger.info("wilgotnosc powietrza powyżej progu! Wentylator na pełnej mocy.")
                 self.clear_humidity = True
-                print("wilgotnosc powietrza powyżej progu! Wentylator na pełnej mocy.")
         elif float(hum) <= self.hum_setting:
+            if self.clear_humidity:
+                self.logger.info("wilgotnosc powietrza poprawiła się. Wentylator wraca do normalnej pracy.")
             self.clear_humidity = False
-            print("wilgotnosc powietrza poprawiła się. Wentylator wraca do normalnej pracy.")
         
         if self.clear_smog:
                 fan_speed=255
@@ -189,7 +363,7 @@ class Controller:
             humidifier_on = self.humidifier_controller.calculate_humidifier(float(hum))
 
         if humidifier_on:
-            self.aq_trigger_delay = 90
+            self.aq_trigger_delay = self.aq_trigger_steps
 
         heating_on = self.heating_controller.calculate_heating(float(temp))
         
@@ -209,206 +383,1858 @@ class Controller:
         if self.aq_thresh_setting != new_settings.aq_thresh_setting:
             self.aq_thresh_setting = new_settings.aq_thresh_setting
 
+    def current_settings(self) -> Settings:
+        return Settings(
+            temp_setting=self.temp_setting,
+            hum_setting=self.hum_setting,
+            aq_thresh_setting=self.aq_thresh_setting,
+        )
+
+    def snapshot(self) -> dict:
+        """Nastawy i stan wewnętrzny regulatorów (do ciepłego startu po restarcie)"""
+        pid = self.cooling_pid
+        return {
+            "settings": {
+                "temp_setting": self.temp_setting,
+                "hum_setting": self.hum_setting,
+                "aq_thresh_setting": self.aq_thresh_setting,
+            },
+            "pid": {"target": pid.target, "integral": pid.integral, "prev_error": pid.prev_error},
+            "is_heating": self.heating_controller.is_heating,
+            "is_humidifier_on": self.humidifier_controller.is_humidifier_on,
+            "aq_trigger_delay": self.aq_trigger_delay,
+            "clear_smog": self.clear_smog,
+            "clear_humidity": self.clear_humidity,
+        }
+
+    def restore(self, state: dict):
+        """Przywraca stan z snapshot(); dt regulatora PID liczy się od chwili przywrócenia"""
+        self.update_settings(Settings(**state["settings"]))
+        pid = self.cooling_pid
+        pid.target = float(state["pid"]["target"])
+        pid.integral = float(state["pid"]["integral"])
+        pid.prev_error = float(state["pid"]["prev_error"])
+        pid.prev_time = pid.clock()
+        self.heating_controller.is_heating = bool(state["is_heating"])
+        self.humidifier_controller.is_humidifier_on = bool(state["is_humidifier_on"])
+        self.aq_trigger_delay = int(state["aq_trigger_delay"])
+        self.clear_smog = bool(state["clear_smog"])
+        self.clear_humidity = bool(state["clear_humidity"])
+
+class WindowAggregator:
+    """Min/max/średnia/ostatnia wartość każdego pola w oknie wysyłki - bez alokacji na próbkę"""
+
+    FIELDS = ("temp", "hum", "aq", "set_temp", "set_hum", "fan", "mist", "heat", "aq_thresh")
+    TEMP, HUM, AQ, SET_TEMP, SET_HUM, FAN, MIST, HEAT, AQ_THRESH = range(len(FIELDS))
+
+    def __init__(self):
+        n = len(self.FIELDS)
+        self.min = array('d', [math.inf] * n)
+        self.max = array('d', [-math.inf] * n)
+        self.sum = array('d', [0.0] * n)
+        self.last = array('d', [0.0] * n)
+        self.count = 0
+
+    def add(self, *values):
+        mn, mx, sm, last = self.min, self.max, self.sum, self.last
+        i = 0
+        for v in values:
+            if v < mn[i]:
+                mn[i] = v
+            if v > mx[i]:
+                mx[i] = v
+            sm[i] += v
+            last[i] = v
+            i += 1
+        self.count += 1
+
+    def mean(self, i):
+        return self.sum[i] / self.count
+
+    def reset(self):
+        for i in range(len(self.FIELDS)):
+            self.min[i] = math.inf
+            self.max[i] = -math.inf
+            self.sum[i] = 0.0
+        self.count = 0
+
+    def flush(self):
+        """Zamienia bieżące okno na jeden wpis ThingSpeak i zeruje statystyki"""
+        if not self.count:
+            return None
+
+        # field6: 1 = Fan ON, 2 = Mist ON, 3 = Both ON (choć raz w oknie)
+        status = 0
+        if self.max[self.FAN] > 0:
+            status += 1
+        if self.max[self.MIST] > 0:
+            status += 2
+
+        record = {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "field1": round(self.mean(self.TEMP), 2),
+            "field2": round(self.mean(self.HUM), 2),
+            "field3": round(self.mean(self.AQ), 2),
+            "field4": self.last[self.SET_TEMP],
+            "field5": self.last[self.SET_HUM],
+            "field6": status,
+            # Średnie PWM grzałki = wypełnienie w oknie
+            "field7": round(self.mean(self.HEAT), 1),
+            "field8": self.last[self.AQ_THRESH],
+            "status": (
+                f"n={self.count}"
+                f" t={self.min[self.TEMP]:g}..{self.max[self.TEMP]:g}"
+                f" h={self.min[self.HUM]:g}..{self.max[self.HUM]:g}"
+                f" aq={self.min[self.AQ]:g}..{self.max[self.AQ]:g}"
+            ),
+        }
+        self.reset()
+        return record
+
+
+HttpResponse = namedtuple("HttpResponse", ["status", "body", "headers"])
+
+
+class RetryableStatus(Exception):
+    """Odpowiedź serwera, którą warto ponowić (5xx / 429)"""
+
+
+class HttpTransport:
+    """Jedna sesja aiohttp (keep-alive) na usługę (ThingSpeak, bridge), z ponowieniami i licznikami"""
+
+    def __init__(self, base_url=TS_API_URL, timeout=TS_TIMEOUT, retries=TS_RETRIES,
+                 retry_backoff=TS_RETRY_BACKOFF, max_connections=8, service="thingspeak"):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.max_connections = max_connections
+        self.session = None
+
+        # Liczniki do diagnostyki
+        self.request_count = 0
+        self.error_count = 0
+        self.retry_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_hist = HTTP_SECONDS.labels(service)
+        self.errors = HTTP_ERRORS.labels(service)
+        self.retries_total = HTTP_RETRIES.labels(service)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.session is not None:
+            await self.session.close()
+
+    async def _open(self):
+        """Tworzy sesję przy pierwszym żądaniu"""
+        # Import aiohttp w wątku pomocniczym - na Raspberry Pi Zero trwa kilka sekund,
+        # a w tym czasie pętla zdarzeń obsługuje już port szeregowy
+        aiohttp = await asyncio.get_running_loop().run_in_executor(None, importlib.import_module, "aiohttp")
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+
+    async def request(self, method, path, timeout=None, **kwargs) -> HttpResponse:
+        """Wykonuje żądanie; błędy sieci, 5xx i 429 ponawia z losowym opóźnieniem"""
+        if self.session is None:
+            await self._open()
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        url = self.base_url + path
+        client_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        attempt = 0
+        while True:
+            start = loop.time()
+            self.request_count += 1
+            try:
+                async with self.session.request(method, url, timeout=client_timeout, **kwargs) as resp:
+                    body = await resp.read()
+                    if resp.status >= 500 or resp.status == 429:
+                        raise RetryableStatus(f"HTTP {resp.status}")
+                    return HttpResponse(resp.status, body, resp.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatus) as e:
+                self.error_count += 1
+                self.errors.inc()
+                if attempt >= self.retries:
+                    raise
+                error = e
+            finally:
+                latency = loop.time() - start
+                self.latency_hist.observe(latency)
+                self.latency_sum += latency
+                if latency > self.latency_max:
+                    self.latency_max = latency
+
+            self.retry_count += 1
+            self.retries_total.inc()
+            delay = self.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.debug("[HTTP] %s %s nieudane (%r), ponowienie za %.2f s", method, path, error, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "requests": self.request_count,
+            "errors": self.error_count,
+            "retries": self.retry_count,
+            "latency_avg": self.latency_sum / self.request_count if self.request_count else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+
 class ThingspeakClient:
-    def __init__(self, update_settings_callback):
-        self.ts_logs_channel_id = TS_LOGS_CHANNEL_ID
-        self.ts_settings_channel_id = TS_SETTINGS_CHANNEL_ID
-        self.ts_settings_read_key = TS_SETTINGS_READ_KEY
-        self.ts_logs_write_key = TS_LOGS_WRITE_KEY
+    def __init__(self, config: TerrariumConfig, transport: HttpTransport, update_settings_callback,
+                 current_settings_callback=Settings):
+        self.ts_logs_channel_id = config.ts_logs_channel_id
+        self.ts_settings_channel_id = config.ts_settings_channel_id
+        self.ts_settings_read_key = config.ts_settings_read_key
+        self.ts_logs_write_key = config.ts_logs_write_key
+        self.transport = transport
         self.update_settings_callback = update_settings_callback
-        
-        self.latest_data = {}
-        # Flagi do akumulacji stanu (jeśli choć raz włączono w cyklu)
-        self.fan_triggered = False
-        self.mist_triggered = False
-        self.heat_triggered = False
-        
-        self.lock = threading.Lock()
+        self.current_settings_callback = current_settings_callback
+        self.logger = logger.getChild(config.name)
+        self.apply_lag = SETTINGS_APPLY_LAG.labels(config.name, "thingspeak")
+
+        # Stan ostatniego odczytu ustawień - pozwala pominąć niezmienione odpowiedzi
+        self.settings_interval = TS_SETTINGS_INTERVAL
+        self._settings_etag = None
+        self._settings_last_modified = None
+        self._settings_body = None
+        self._settings_entry_id = None
+        self.settings_polls = 0
+        self.settings_unchanged = 0
+        self.settings_applied = 0
+
+        # Statystyki bieżącego okna i zaległe okna czekające na wysłanie
+        self.window = WindowAggregator()
+        self.backlog = deque(maxlen=TS_BACKLOG_SIZE)
+
         self.running = True
 
-    def start(self):
-        """Uruchamia wątki w tle"""
-        t_logs = threading.Thread(target=self._logs_loop, daemon=True)
-        t_settings = threading.Thread(target=self._settings_loop, daemon=True)
-        t_logs.start()
-        t_settings.start()
+    async def run(self):
+        """Uruchamia pętle wysyłania logów i pobierania ustawień"""
+        loops = []
+        if self.ts_logs_channel_id or self.ts_logs_write_key:
+            loops.append(self._logs_loop())
+        if self.ts_settings_channel_id:
+            loops.append(self._settings_loop())
+        if not loops:
+            self.logger.warning("[TS] Brak konfiguracji kanałów - telemetria wyłączona.")
+            return
+        await asyncio.gather(*loops)
 
     def update_current_state(self, temp, hum, set_temp, set_hum, aq, fan, mist, heat, aq_thresh):
-        """Aktualizuje dane, które zostaną wysłane w najbliższym cyklu"""
-        with self.lock:
-            # Akumulacja stanów (sticky bits)
-            if fan > 0:
-                self.fan_triggered = True
-            if mist > 0:
-                self.mist_triggered = True
-            if heat > 0:
-                self.heat_triggered = True
-
-            self.latest_data = {
-                "field1": temp,
-                "field2": hum,
-                "field3": aq,
-                "field4": set_temp,
-                "field5": set_hum,
-                # field6 jest obliczany w pętli wysyłania (fan + mist)
-                "field7": heat,
-                "field8": aq_thresh,
-            }
-
-    def _logs_loop(self):
+        """Dolicza próbkę do statystyk okna, które zostanie wysłane w najbliższym cyklu"""
+        self.window.add(temp, hum, aq, set_temp, set_hum, fan, mist, heat, aq_thresh)
+
+    async def _logs_loop(self):
         """Wysyłanie logów co 15 sekund"""
         while self.running:
-            time.sleep(15)
-            data_to_send = None
-            with self.lock:
-                if self.latest_data:
-                    data_to_send = self.latest_data.copy()
-                    
-                    # Obliczanie statusu binarnego dla field6
-                    # 1 = Fan ON, 2 = Mist ON, 3 = Both ON
-                    status = 0
-                    if self.fan_triggered:
-                        status += 1
-                    elif self.mist_triggered:
-                        status += 2
-                    
-                    data_to_send["field6"] = status
-                    
-                    # Reset akumulatorów po przygotowaniu danych do wysyłki
-                    self.fan_triggered = False
-                    self.mist_triggered = False
-                    self.heat_triggered = False
-            
-            if data_to_send:
-                try:
-                    url = "https://api.thingspeak.com/update"
-                    data_to_send["api_key"] = self.ts_logs_write_key
-                    requests.post(url, data=data_to_send, timeout=5)
-                    logger.info(f"[TS] Wysłano logi do chmury (Status={data_to_send.get('field6')}).")
-                except Exception as e:
-                    logger.error(f"[TS] Błąd wysyłania logów: {e}")
-
-    def _settings_loop(self):
-        """Pobieranie ustawień co 15 sekund"""
-        while self.running:
+            await asyncio.sleep(15)
+            record = self.window.flush()
+            if record:
+                if len(self.backlog) == self.backlog.maxlen:
+                    self.logger.warning("[TS] Bufor zaległych logów pełny - odrzucam najstarsze okno.")
+                self.backlog.append(record)
+
+            if not self.backlog:
+                continue
+
             try:
-                url = f"https://api.thingspeak.com/channels/{self.ts_settings_channel_id}/feeds/last.json"
-                params = {"api_key": self.ts_settings_read_key}
-                response = requests.get(url, params=params, timeout=5)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    # Parsowanie pól (zakładamy: f1=Temp, f2=Hum, f3=AQ)
-                    new_settings = Settings(
-                        temp_setting=float(data.get("field1")),
-                        hum_setting=float(data.get("field2")),
-                        aq_thresh_setting=float(data.get("field3"))
-                    )
-                    self.update_settings_callback(new_settings)
-                    # logger.info("[TS] Zaktualizowano ustawienia z chmury.")
+                if len(self.backlog) > 1 and self.ts_logs_channel_id:
+                    sent = await self._send_bulk(list(islice(self.backlog, TS_BULK_BATCH_SIZE)))
+                else:
+                    sent = await self._send_single(self.backlog[0])
             except Exception as e:
-                logger.error(f"[TS] Błąd pobierania ustawień: {e}")
-            
-            time.sleep(15)
-    
-def find_and_connect_serial():
-        """Szuka dostępnych portów ttyUSB/ttyACM i próbuje się połączyć"""
-        # Wzorce nazw portów na Linux/Raspberry Pi
-        patterns = ['/dev/ttyUSB*', '/dev/ttyACM*']
-        candidates = []
-        for p in patterns:
-            candidates.extend(glob.glob(p))
-            
-        if not candidates:
-            print("[INIT] ❌ BŁĄD: Nie znaleziono żadnych urządzeń Arduino!")
-            print("       Sprawdź kabel USB (czy nie jest 'tylko do ładowania').")
-            print("       Wpisz w terminalu: ls /dev/tty* aby zobaczyć dostępne urządzenia.")
-            return None
+                self.logger.error(f"[TS] Błąd wysyłania logów: {e}")
+                continue
 
-        for port in candidates:
+            for _ in range(sent):
+                self.backlog.popleft()
+            if sent:
+                self.logger.info(f"[TS] Wysłano {sent} okien logów do chmury (zaległe: {len(self.backlog)}).")
+
+    async def _send_single(self, record):
+        data = dict(record, api_key=self.ts_logs_write_key)
+        response = await self.transport.request("POST", "/update", data=data)
+        # ThingSpeak zwraca "0", gdy odrzuci wpis (np. limit 15 s)
+        if response.status == 200 and response.body.strip() != b"0":
+            return 1
+        self.logger.warning(f"[TS] ThingSpeak odrzucił logi: {response.status} {response.body!r}")
+        return 0
+
+    async def _send_bulk(self, records):
+        """Wysyła zaległe okna jednym żądaniem bulk_update.json"""
+        path = f"/channels/{self.ts_logs_channel_id}/bulk_update.json"
+        payload = {"write_api_key": self.ts_logs_write_key, "updates": records}
+        response = await self.transport.request("POST", path, json=payload, timeout=15)
+        if response.status in (200, 202):
+            return len(records)
+        self.logger.warning(f"[TS] ThingSpeak odrzucił paczkę logów: {response.status} {response.body!r}")
+        return 0
+
+    async def _settings_loop(self):
+        """Pobieranie ustawień - okres skraca się przy zmianach i wydłuża, gdy nic się nie zmienia"""
+        while self.running:
             try:
-                print(f"[INIT] Próba połączenia z {port}...")
-                ser = serial.Serial(port, 9600, timeout=0.1)
-                print(f"[INIT] ✅ Sukces! Połączono z {port}")
-                return ser
+                changed = await self._poll_settings()
             except Exception as e:
-                print(f"[INIT] Nie udało się otworzyć {port}: {e}")
-        
-        print("[INIT] Znaleziono porty, ale żadnego nie udało się otworzyć.")
-        return None
+                changed = False
+                self.logger.error(f"[TS] Błąd pobierania ustawień: {e}")
 
-    
-def main():
+            if changed:
+                self.settings_interval = max(TS_SETTINGS_INTERVAL_MIN, self.settings_interval / 2)
+            else:
+                self.settings_interval = min(TS_SETTINGS_INTERVAL_MAX, self.settings_interval * 1.25)
+            await asyncio.sleep(self.settings_interval)
 
-    ser = find_and_connect_serial()
-    
-    settings = Settings(
-        temp_setting = 25.0,
-        hum_setting = 40.0,
-        aq_thresh_setting = 200
-    )
+    async def _poll_settings(self):
+        """Zwraca True, jeśli pojawił się nowy wpis ustawień"""
+        self.settings_polls += 1
+        path = f"/channels/{self.ts_settings_channel_id}/feeds/last.json"
+        params = {"api_key": self.ts_settings_read_key} if self.ts_settings_read_key else None
 
-    controller = Controller(settings)
-    
-    # INICJALIZACJA THINGSPEAK
-    # Przekazujemy metodę controller.update_settings jako callback
-    ts_client = ThingspeakClient(controller.update_settings)
-    ts_client.start()
-    
-    last_send_time = 0
+        # Żądanie warunkowe - serwer odpowie 304 bez treści, jeśli nic się nie zmieniło
+        headers = {}
+        if self._settings_etag:
+            headers["If-None-Match"] = self._settings_etag
+        if self._settings_last_modified:
+            headers["If-Modified-Since"] = self._settings_last_modified
+        response = await self.transport.request("GET", path, params=params, headers=headers)
+
+        if response.status == 304 or (response.status == 200 and response.body == self._settings_body):
+            self.settings_unchanged += 1
+            return False
+        if response.status != 200:
+            self.logger.warning(f"[TS] Nieoczekiwana odpowiedź ustawień: {response.status}")
+            return False
 
-    while True:
-        if ser and ser.in_waiting > 0:
-            raw_line = ser.readline()
+        self._settings_etag = response.headers.get("ETag")
+        self._settings_last_modified = response.headers.get("Last-Modified")
+        self._settings_body = response.body
+
+        data = json.loads(response.body)
+        entry_id = data.get("entry_id")
+        if entry_id is not None and entry_id == self._settings_entry_id:
+            self.settings_unchanged += 1
+            return False
+        self._settings_entry_id = entry_id
+
+        # Brakujące pola zostawiają bieżącą nastawę zamiast wywracać parsowanie
+        current = self.current_settings_callback()
+        values = {}
+        try:
+            for field, name in TS_SETTINGS_FIELDS:
+                raw = data.get(field)
+                values[name] = float(raw) if raw not in (None, "") else getattr(current, name)
+                if not math.isfinite(values[name]):
+                    raise ValueError(name)
+        except (TypeError, ValueError):
+            # nan/inf zamroziłyby regulator - zostają bieżące nastawy
+            raw_fields = {field: data.get(field) for field, _ in TS_SETTINGS_FIELDS}
+            self.logger.error(f"[TS] Niepoprawne ustawienia z chmury (wpis {entry_id}): {raw_fields}")
+            return False
+        new_settings = Settings(**values)
+
+        self.update_settings_callback(new_settings)
+        self.settings_applied += 1
+        created_at = data.get("created_at")
+        if created_at and self.settings_applied > 1:
+            # Od zapisu wpisu w kanale do zastosowania (obejmuje okres odpytywania); pierwszy wpis
+            # po starcie może być dowolnie stary, więc go pomijamy
+            created = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+            self.apply_lag.observe(max(0.0, time.time() - created.timestamp()))
+        self.logger.info(f"[TS] Nowe ustawienia z chmury (wpis {entry_id}, {data.get('created_at')}).")
+        return True
+
+class RedisSettingsListener:
+    """Odbiera nastawy publikowane przez API (Redis pub/sub) i od razu stosuje je w regulatorach"""
+
+    def __init__(self, url, controllers, backoff_min=1.0, backoff_max=30.0, connect=None):
+        self.url = url
+        # Fabryka klienta redis.asyncio (np. fakeredis w api/settings_latency.py); domyślnie from_url
+        self.connect = connect
+        # nazwa terrarium -> Controller
+        self.controllers = controllers
+        self.channels = {REDIS_SETTINGS_CHANNEL.format(name): name for name in controllers}
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.applied = 0
+        self.apply_lag = {name: SETTINGS_APPLY_LAG.labels(name, "redis") for name in controllers}
+
+    async def run(self):
+        # Redis jest opcjonalny - importujemy go tylko wtedy, gdy jest skonfigurowany
+        import redis.asyncio as aioredis
+        from redis.exceptions import RedisError
+
+        backoff = self.backoff_min
+        while True:
+            client = self.connect() if self.connect else aioredis.from_url(self.url, decode_responses=True)
             try:
-                line = raw_line.decode('utf-8').rstrip()
-            except UnicodeDecodeError:
-                logger.warning("Błąd dekodowania linii (śmieci na UART)")
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(*self.channels)
+                    # Pełny stan po (ponownym) połączeniu; subskrypcja już działa, więc nic nie umknie
+                    for name in self.controllers:
+                        self.apply(name, await client.hgetall(REDIS_SETTINGS_KEY.format(name)))
+                    backoff = self.backoff_min
+                    logger.info(f"[REDIS] Subskrypcja nastaw aktywna ({len(self.channels)} terrariów).")
+
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        name = self.channels[message["channel"]]
+                        try:
+                            fields = json.loads(message["data"])
+                        except ValueError:
+                            logger.error(f"[REDIS] Niepoprawna wiadomość dla {name}: {message['data']!r}")
+                            continue
+                        if not isinstance(fields, dict):
+                            logger.error(f"[REDIS] Niepoprawna wiadomość dla {name}: {message['data']!r}")
+                            continue
+                        self.apply(name, fields)
+            except (RedisError, OSError) as e:
+                logger.warning(f"[REDIS] Utracono połączenie ({e}), ponowna próba za {backoff:g} s")
+            finally:
+                await client.aclose()
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.backoff_max)
+
+    def apply(self, name, fields):
+        """Nakłada zmienione pola na bieżące nastawy terrarium"""
+        # API dokleja do publikacji czas zapisu nastawy
+        published_at = fields.pop("published_at", None)
+        if not fields:
+            return
+        controller = self.controllers[name]
+        values = asdict(controller.current_settings())
+        try:
+            for key, value in fields.items():
+                if key in values:
+                    values[key] = float(value)
+                    if not math.isfinite(values[key]):
+                        raise ValueError(key)
+        except (TypeError, ValueError):
+            logger.error(f"[REDIS] Niepoprawne nastawy dla {name}: {fields}")
+            return
+        controller.update_settings(Settings(**values))
+        self.applied += 1
+        if published_at is not None:
+            try:
+                self.apply_lag[name].observe(max(0.0, time.time() - float(published_at)))
+            except (TypeError, ValueError):
+                # Zły znacznik czasu - nastawy i tak obowiązują, tylko bez pomiaru opóźnienia
+                logger.warning(f"[REDIS] Niepoprawny published_at dla {name}: {published_at!r}")
+        logger.info(f"[REDIS] Nowe nastawy dla {name}: {fields}")
+
+class BridgeForwarder:
+    """Zbiera wszystkie próbki terrarium i wysyła je do bridge paczkami"""
+
+    def __init__(self, name, transport: HttpTransport):
+        self.name = name
+        self.transport = transport
+        self.logger = logger.getChild(name)
+        self.pending = deque(maxlen=BRIDGE_BUFFER_SIZE)
+
+    def add(self, ts, temp, hum, aq, fan, heat, mist, set_temp, set_hum, aq_thresh):
+        self.pending.append((ts, temp, hum, aq, fan, heat, mist, set_temp, set_hum, aq_thresh))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(BRIDGE_FLUSH_INTERVAL)
+            if not self.pending:
                 continue
-            
-            if not line: continue 
 
-            logger.info(f"RX: {line}")
-            
-            parts = line.split(";")
-            
-            # Walidacja: Obsłuż zarówno 3 parametry (dane) jak i 9 (dane + echo)
-            if len(parts) >= 3:
+            batch, self.pending = self.pending, deque(maxlen=BRIDGE_BUFFER_SIZE)
+            while batch:
+                chunk = list(islice(batch, BRIDGE_BATCH_SIZE))
+                if not await self._send(chunk):
+                    break
+                for _ in range(len(chunk)):
+                    batch.popleft()
+
+            # Niewysłane próbki wracają przed nowe (przy przepełnieniu giną najstarsze)
+            batch.extend(self.pending)
+            self.pending = batch
+
+    async def _send(self, batch):
+        payload = [{
+            "location": self.name, "time": s[0],
+            "temperature": s[1], "humidity": s[2], "air_quality": s[3],
+            "fan": s[4], "heat": s[5], "mist": s[6],
+            "temp_setting": s[7], "hum_setting": s[8], "aq_thresh_setting": s[9],
+        } for s in batch]
+        try:
+            response = await self.transport.request("POST", "/samples", json=payload)
+        except Exception as e:
+            # Sieć albo 5xx/429 po wyczerpaniu ponowień - paczka wraca do kolejki
+            self.logger.warning(f"[BRIDGE] Błąd wysyłania próbek: {e}")
+            return False
+        if 200 <= response.status < 300:
+            try:
+                rejected = json.loads(response.body).get("rejected", 0)
+            except (ValueError, AttributeError):
+                rejected = 0
+            if rejected:
+                self.logger.warning(f"[BRIDGE] Bridge pominął {rejected} z {len(batch)} próbek")
+            return True
+        if 400 <= response.status < 500:
+            # Ponowienie niczego nie zmieni - paczka blokowałaby kolejkę aż do przepełnienia bufora
+            self.logger.error(f"[BRIDGE] Bridge odrzucił paczkę ({response.status} {response.body!r}) - "
+                              f"pominięto {len(batch)} próbek")
+            return True
+        self.logger.warning(f"[BRIDGE] Nieoczekiwana odpowiedź bridge: {response.status}")
+        return False
+
+SERIAL_PATTERNS = ['/dev/ttyUSB*', '/dev/ttyACM*']
+# Wymuszony port (np. pty symulatora w bench.py) zamiast wyszukiwania
+SERIAL_PORT = os.getenv("SERIAL_PORT")
+
+def find_serial_ports():
+    """Zwraca listę dostępnych portów ttyUSB/ttyACM"""
+    if SERIAL_PORT:
+        return [SERIAL_PORT]
+    # Wzorce nazw portów na Linux/Raspberry Pi
+    candidates = []
+    for p in SERIAL_PATTERNS:
+        candidates.extend(sorted(glob.glob(p)))
+    return candidates
+
+def write_atomic(path, data: bytes):
+    """Zapis przez plik tymczasowy, fsync i os.replace - po awarii zostaje stara albo nowa treść"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    # Trwała zmiana nazwy wymaga jeszcze fsync katalogu
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def process_uptime():
+    """Sekundy od uruchomienia procesu (z /proc); None poza Linuksem"""
+    try:
+        with open("/proc/self/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0]) - started
+    except (OSError, ValueError, IndexError):
+        return None
+
+def open_serial(port):
+    """Otwiera wskazany port; zwraca None, jeśli się nie udało"""
+    try:
+        logger.info("[INIT] Próba połączenia z %s...", port)
+        ser = serial.Serial(port, SERIAL_BAUD, timeout=0.1)
+        logger.info("[INIT] ✅ Sukces! Połączono z %s", port)
+        return ser
+    except Exception as e:
+        logger.warning("[INIT] Nie udało się otworzyć %s: %s", port, e)
+        return None
+
+Probe = namedtuple("Probe", "port ser board_id elapsed")
+
+# Zapytanie o ID płytki i początek odpowiedzi (`!ID terrarium-a`)
+BOARD_HELLO = b"?ID\n"
+BOARD_ACK = b"!ID"
+
+
+def _identify(buf):
+    """(ID płytki albo None, czy przyszedł poprawny odczyt) z danych zebranych podczas rozpoznawania"""
+    board_id = None
+    valid = False
+    for line in bytes(buf).split(b"\n")[:-1]:
+        line = line.strip()
+        if line.startswith(BOARD_ACK):
+            board_id = line[len(BOARD_ACK):].strip().decode("utf-8", "replace") or None
+            continue
+        parts = line.split(b";")
+        if len(parts) >= 3:
+            try:
+                float(parts[0]), float(parts[1]), float(parts[2])
+                valid = True
+            except ValueError:
+                pass
+    # Płytka mogła zostać w trybie binarnym po poprzednim uruchomieniu sterownika
+    if not valid and BinaryProtocol(logger).decode(bytearray(buf)):
+        valid = True
+    return board_id, valid
+
+
+async def probe_port(port, timeout=SERIAL_PROBE_TIMEOUT, need_id=False):
+    """Otwiera port i czeka, aż płytka poda ID albo przyśle poprawny odczyt; inaczej zamyka port.
+
+    Bez need_id wystarczy poprawny odczyt (stary firmware nie odpowiada na `?ID`).
+    """
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+    try:
+        ser = serial.Serial(port, SERIAL_BAUD, timeout=0)
+    except (serial.SerialException, OSError, ValueError) as e:
+        logger.debug("[INIT] Nie udało się otworzyć %s: %s", port, e)
+        return None
+
+    buf = bytearray()
+    found = (None, False)
+    done = asyncio.Event()
+
+    def on_readable():
+        nonlocal found
+        try:
+            buf.extend(ser.read(ser.in_waiting or 1))
+        except (serial.SerialException, OSError):
+            done.set()
+            return
+        if len(buf) > 4096:
+            # Urządzenie, które nie jest płytką - wystarczy końcówka danych
+            del buf[:-4096]
+        found = _identify(buf)
+        if found[0] is not None or (found[1] and not need_id):
+            done.set()
+
+    fd = ser.fileno()
+    loop.add_reader(fd, on_readable)
+    identified = False
+    try:
+        deadline = start + timeout
+        while not done.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Powtarzamy pytanie - pierwsze mogło trafić w reset płytki po otwarciu portu
+            ser.write(BOARD_HELLO)
+            try:
+                await asyncio.wait_for(done.wait(), min(SERIAL_PROBE_RETRY, remaining))
+            except asyncio.TimeoutError:
+                pass
+        identified = found[0] is not None or found[1]
+    except (serial.SerialException, OSError) as e:
+        logger.debug("[INIT] Błąd zapisu na %s: %s", port, e)
+    finally:
+        loop.remove_reader(fd)
+        if not identified:
+            ser.close()
+    if not identified:
+        logger.debug("[INIT] %s: brak odpowiedzi płytki", port)
+        return None
+    return Probe(port, ser, found[0], time.monotonic() - start)
+
+
+async def probe_ports(ports, timeout=SERIAL_PROBE_TIMEOUT, need_id=False, stop=None):
+    """Rozpoznaje płytki na wszystkich portach równolegle i zwraca listę Probe.
+
+    stop(probe) -> True kończy wcześniej; porty jeszcze nierozpoznane są wtedy zamykane.
+    """
+    tasks = [asyncio.ensure_future(probe_port(port, timeout, need_id)) for port in ports]
+    found = []
+    try:
+        for next_probe in asyncio.as_completed(tasks):
+            probe = await next_probe
+            if probe is not None:
+                found.append(probe)
+                if stop is not None and stop(probe):
+                    break
+    finally:
+        for task in tasks:
+            task.cancel()
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Probe) and result not in found:
+                result.ser.close()
+    return found
+
+
+async def find_and_connect_serial(board_id=None):
+    """Sprawdza wszystkie porty ttyUSB/ttyACM naraz; zwraca pierwszą płytkę, która odpowie (z tym ID)"""
+    candidates = find_serial_ports()
+
+    if not candidates:
+        logger.error("[INIT] ❌ BŁĄD: Nie znaleziono żadnych urządzeń Arduino!\n"
+                     "       Sprawdź kabel USB (czy nie jest 'tylko do ładowania').\n"
+                     "       Wpisz w terminalu: ls /dev/tty* aby zobaczyć dostępne urządzenia.")
+        return None
+
+    def wanted(probe):
+        return board_id is None or probe.board_id == board_id
+
+    found = await probe_ports(candidates, need_id=board_id is not None, stop=wanted)
+    match = next((probe for probe in found if wanted(probe)), None)
+    for probe in found:
+        if probe is not match:
+            probe.ser.close()
+    if match is None:
+        logger.error("[INIT] Znaleziono porty, ale żadna płytka nie odpowiedziała.")
+        return None
+    logger.info("[INIT] ✅ Płytka %s na %s (po %.2f s)", match.board_id or "bez ID", match.port, match.elapsed)
+    return match.ser
+
+
+class BoardLocator:
+    """Przydziela terrariom płytki: po ID (`!ID`), po porcie z konfiguracji albo z PORT_CACHE_FILE.
+
+    Jedno rozpoznawanie obejmuje wszystkie wolne porty naraz. Płytki innych terrariów zostają
+    otwarte, aż terraria się po nie zgłoszą - ponowne otwarcie portu zresetowałoby Arduino.
+    """
+
+    def __init__(self, configs, cache_path=PORT_CACHE_FILE, timeout=SERIAL_PROBE_TIMEOUT):
+        self.configs = list(configs)
+        self.cache_path = cache_path
+        self.timeout = timeout
+        self.cache = self._load_cache()  # nazwa terrarium -> port
+        self.spare = {}                  # port -> Probe płytki czekającej na swoje terrarium
+        self.claimed = {}                # port -> Serial używany przez terrarium
+        self._lock = asyncio.Lock()
+
+    def _load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                return dict(json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"[INIT] Pominięto {self.cache_path}: {e}")
+            return {}
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            write_atomic(self.cache_path, json.dumps(self.cache, indent=2).encode())
+        except OSError as e:
+            logger.warning(f"[INIT] Nie udało się zapisać {self.cache_path}: {e}")
+
+    def connector(self, config):
+        return partial(self.connect, config)
+
+    def _explicit_ports(self, config=None):
+        """Porty wpisane w konfiguracji bez ID - otwierane wprost, rozpoznawanie ich nie dotyka"""
+        return {c.port for c in self.configs if c.port and not c.board_id and c is not config}
+
+    def _busy(self, port):
+        ser = self.claimed.get(port)
+        return ser is not None and ser.is_open
+
+    def _matches(self, config, probe):
+        if config.board_id:
+            return probe.board_id == config.board_id
+        if config.port:
+            return probe.port == config.port
+        # Bez ID i portu: dowolna płytka, której nie opisuje inny wpis
+        return not any(self._owned(c, probe) for c in self.configs if c is not config)
+
+    def _owned(self, config, probe):
+        return (probe.board_id == config.board_id) if config.board_id else (probe.port == config.port)
+
+    def _park(self, probe):
+        """Płytkę innego terrarium zostawia otwartą, nieznaną zamyka"""
+        if any(self._owned(c, probe) for c in self.configs):
+            self.spare[probe.port] = probe
+        else:
+            logger.debug("[INIT] %s: płytka %s bez wpisu w konfiguracji", probe.port, probe.board_id)
+            probe.ser.close()
+
+    def _take_spare(self, config):
+        for port, probe in list(self.spare.items()):
+            if not probe.ser.is_open:
+                del self.spare[port]
+            elif self._matches(config, probe):
+                return self.spare.pop(port)
+        return None
+
+    async def connect(self, config):
+        async with self._lock:
+            start = time.monotonic()
+            probe = self._take_spare(config)
+            if probe is None and config.port and not config.board_id:
+                # Port wpisany wprost - bez rozpoznawania, jak dotąd
+                ser = open_serial(config.port)
+                if ser is not None:
+                    self.claimed[config.port] = ser
+                return ser
+            tried = set()
+            if probe is None:
+                probe = await self._probe_cached(config, tried)
+            if probe is None:
+                probe = await self._sweep(config, tried)
+            if probe is None:
+                return None
+
+            self.claimed[probe.port] = probe.ser
+            if self.cache.get(config.name) != probe.port:
+                self.cache[config.name] = probe.port
+                self._save_cache()
+            logger.info(f"[INIT] ✅ {config.name}: płytka {probe.board_id or 'bez ID'} na {probe.port}"
+                        f" (po {time.monotonic() - start:.2f} s)")
+            return probe.ser
+
+    async def _probe_cached(self, config, tried):
+        """Po restarcie najpierw tylko zapamiętany port - bez otwierania (i resetowania) pozostałych"""
+        port = self.cache.get(config.name)
+        if not port or self._busy(port) or port in self.spare or port in self._explicit_ports(config):
+            return None
+        tried.add(port)
+        probe = await probe_port(port, self.timeout, need_id=bool(config.board_id))
+        if probe is None or self._matches(config, probe):
+            return probe
+        logger.warning(f"[INIT] {config.name}: na {port} jest inna płytka ({probe.board_id or 'bez ID'})"
+                       f" - szukanie na wszystkich portach")
+        self._park(probe)
+        return None
+
+    async def _sweep(self, config, tried):
+        explicit = self._explicit_ports(config)
+        ports = [p for p in find_serial_ports()
+                 if p not in tried and p not in explicit and p not in self.spare and not self._busy(p)]
+        if not ports:
+            logger.error(f"[INIT] ❌ {config.name}: brak wolnych portów ttyUSB/ttyACM do sprawdzenia.")
+            return None
+        need_id = any(c.board_id for c in self.configs)
+        # Jedno terrarium kończy na pierwszej pasującej płytce; przy kilku czekamy na wszystkie porty,
+        # żeby płytki pozostałych terrariów nie trzeba było rozpoznawać drugi raz
+        single = len(self.configs) == 1
+        found = await probe_ports(ports, self.timeout, need_id,
+                                  stop=lambda probe: single and self._matches(config, probe))
+        match = next((probe for probe in found if self._matches(config, probe)), None)
+        for probe in found:
+            if probe is not match:
+                self._park(probe)
+        if match is None:
+            wanted = f" z ID {config.board_id}" if config.board_id else ""
+            logger.error(f"[INIT] {config.name}: żadna płytka{wanted} nie odpowiedziała na {len(ports)} portach.")
+        return match
+
+    async def discover(self):
+        """Rozpoznanie przy starcie nadzorcy; zwraca płytki, których nie opisuje żaden wpis konfiguracji"""
+        explicit = self._explicit_ports()
+        ports = [p for p in find_serial_ports() if p not in explicit]
+        found = await probe_ports(ports, self.timeout, need_id=any(c.board_id for c in self.configs))
+        unknown = []
+        for probe in found:
+            if any(self._owned(c, probe) for c in self.configs):
+                self.spare[probe.port] = probe
+            else:
+                unknown.append(probe)
+        return unknown
+
+    def adopt(self, probe, config):
+        """Dodaje terrarium dla płytki bez wpisu - dostanie ją przy pierwszym połączeniu"""
+        self.configs.append(config)
+        self.spare[probe.port] = probe
+
+
+class SerialStats:
+    """Liczniki jednego portu; bez nazwy terrarium nie trafiają do eksportu"""
+
+    def __init__(self, name=None):
+        def child(family, *labels):
+            if name is None:
+                return metrics.Counter() if family.kind == "counter" else metrics.Histogram(**family.options)
+            return family.labels(name, *labels)
+
+        self.lines = child(SERIAL_LINES)
+        self.decode_errors = child(SERIAL_ERRORS, "decode")
+        self.parse_errors = child(SERIAL_ERRORS, "parse")
+        self.crc_errors = child(SERIAL_ERRORS, "crc")
+        self.lost = child(SERIAL_FRAMES_LOST)
+        self.dropped = child(READINGS_DROPPED)
+        self.write = child(SERIAL_WRITE_SECONDS)
+        self.first_sample = child(SERIAL_FIRST_SAMPLE)
+
+    @property
+    def errors(self):
+        return self.decode_errors.value + self.parse_errors.value + self.crc_errors.value
+
+
+class RawDump:
+    """Zrzut surowych danych z portu; tekst powstaje dopiero w wątku zapisującym logi"""
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def __str__(self):
+        return "\n".join(
+            f"  {datetime.fromtimestamp(t).strftime('%H:%M:%S.%f')[:-3]} {direction} {data!r}"
+            for t, direction, data in self.entries
+        )
+
+
+class TextProtocol:
+    """Linie ASCII: `temp;hum;quality` z płytki, `fan;heat;mist;set_temp;set_hum` do płytki"""
+
+    name = "text"
+    MAX_LINE_LENGTH = 1024
+
+    def __init__(self, log, stats=None):
+        self.logger = log
+        self.stats = stats or SerialStats()
+        self.binary_ack = None  # prędkość potwierdzona przez płytkę (`!BIN <baud>`)
+        self._rx_count = 0
+        self._last_line = time.monotonic()
+
+    def decode(self, buf: bytearray):
+        """Zdejmuje z bufora pełne linie i zwraca odczyty (temp, hum, quality)"""
+        samples = []
+        start = 0
+        lines = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            raw_line = bytes(buf[start:end])
+            start = end + 1
+            lines += 1
+            if raw_line.startswith(BinaryProtocol.ACK):
                 try:
-                    temp = float(parts[0])
-                    hum = float(parts[1])
-                    quality = float(parts[2])
-                    
-                    fan_speed, heating_on, humidifier_on = controller.process_sensor_data(temp, hum, quality)
-
-                    # AKTUALIZACJA DANYCH DLA WĄTKU TŁA
-                    heat_pwm = 255 if heating_on else 0
-                    mist = 1 if humidifier_on else 0
-                    
-                    # POPRAWKA: Przekazujemy argumenty zgodnie z nową logiką
-                    # Kolejność w update_current_state: temp, hum, set_temp, set_hum, aq, fan, mist, heat, aq_thresh
-                    ts_client.update_current_state(
-                        temp, 
-                        hum, 
-                        controller.temp_setting, 
-                        controller.hum_setting, 
-                        quality, 
-                        fan_speed, 
-                        mist,
-                        heat_pwm,
-                        controller.aq_thresh_setting # Dodano próg AQ
-                    )
-
-                    current_time = time.time()
-                    if current_time - last_send_time > SEND_INTERVAL:
-                        
-                        command = f"{fan_speed};{heat_pwm};{mist};{controller.temp_setting};{controller.hum_setting}\n"
-                        ser.write(command.encode('utf-8'))
-                        logger.info(f"TX: {command.strip()}")
-                        last_send_time = current_time
+                    baud = int(raw_line[len(BinaryProtocol.ACK):].strip() or 0)
                 except ValueError:
-                    logger.error("Błąd parsowania danych")
+                    self.stats.parse_errors.inc()
+                    self.logger.warning("Niepoprawne potwierdzenie protokołu binarnego: %r", raw_line)
+                    continue
+                # Dalsza część bufora jest już w formacie binarnym
+                self.binary_ack = baud
+                break
+            sample = self._parse(raw_line)
+            if sample:
+                samples.append(sample)
+        if start:
+            del buf[:start]
+            self.stats.lines.value += lines
+        if len(buf) > self.MAX_LINE_LENGTH:
+            # Śmieci bez znaku końca linii - odrzucamy
+            buf.clear()
+        return samples
+
+    def _parse(self, raw_line):
+        try:
+            line = raw_line.decode('utf-8').rstrip()
+        except UnicodeDecodeError:
+            self.stats.decode_errors.inc()
+            self.logger.warning("Błąd dekodowania linii (śmieci na UART)")
+            return None
+        if not line:
+            return None
+
+        # Na INFO tylko co LOG_SAMPLE_EVERY-ta linia; formatowanie dopiero, gdy rekord powstaje
+        self._rx_count += 1
+        if self._rx_count >= LOG_SAMPLE_EVERY:
+            self._rx_count = 0
+            self.logger.info("RX: %s", line)
+        else:
+            self.logger.debug("RX: %s", line)
+
+        # Walidacja: Obsłuż zarówno 3 parametry (dane) jak i 9 (dane + echo)
+        parts = line.split(";")
+        if len(parts) < 3:
+            return None
+        # Płytka mówi tekstem (także gdy czujnik zwraca nan) - protokół się zgadza
+        self._last_line = time.monotonic()
+        try:
+            sample = float(parts[0]), float(parts[1]), float(parts[2])
+        except ValueError:
+            self.stats.parse_errors.inc()
+            self.logger.error("Błąd parsowania danych")
+            return None
+        # `nan` przy nieudanym odczycie czujnika DHT - do regulatora trafiają tylko liczby skończone
+        if not all(map(math.isfinite, sample)):
+            self.stats.parse_errors.inc()
+            self.logger.error("Błąd parsowania danych (odczyt czujnika nieudany: %s)", line)
+            return None
+        return sample
+
+    def encode_command(self, fan, heat, mist, set_temp, set_hum):
+        return f"{fan};{heat};{mist};{set_temp};{set_hum}\n".encode('utf-8')
+
+    def stale(self):
+        return time.monotonic() - self._last_line > SERIAL_TEXT_SILENCE
+
+
+class BinaryProtocol:
+    """Ramki binarne: A5 5A | typ | nr kolejny | dane (stały rozmiar) | CRC-16/CCITT (LE).
+
+    CRC liczone od bajtu typu do końca danych. Temperatura i wilgotność jako setne części (int16/uint16).
+    Negocjacja: sterownik wysyła linię `?BIN <baud>`, płytka odpowiada `!BIN <baud>` i obie strony
+    przechodzą na ramki z nową prędkością. Bez odpowiedzi zostaje protokół tekstowy.
+    """
+
+    name = "binary"
+    HELLO = b"?BIN"
+    ACK = b"!BIN"
+    SYNC = b"\xa5\x5a"
+    SENSOR = 0x01
+    COMMAND = 0x02
+    # typ ramki -> cała ramka: synchronizacja, typ, nr, dane, CRC
+    FRAMES = {
+        SENSOR: struct.Struct("<2sBBhHHH"),     # temp*100, hum*100, quality
+        COMMAND: struct.Struct("<2sBBBBBhHH"),  # fan, heat, mist, set_temp*100, set_hum*100
+    }
+
+    def __init__(self, log, stats=None):
+        self.logger = log
+        self.stats = stats or SerialStats()
+        self._rx_seq = None
+        self._tx_seq = 0
+        self._last_frame = time.monotonic()
+
+    def decode(self, buf: bytearray):
+        """Zdejmuje z bufora pełne ramki; pola czytane bez kopiowania (unpack_from na buforze)"""
+        samples = []
+        frames = self.FRAMES
+        crc = binascii.crc_hqx
+        stats = self.stats
+        pos = 0
+        frames_count = 0
+        size = len(buf)
+        with memoryview(buf) as view:
+            while True:
+                pos = buf.find(self.SYNC, pos)
+                if pos < 0:
+                    # Zostawiamy ewentualny pierwszy bajt synchronizacji na końcu bufora
+                    pos = size - 1 if buf.endswith(self.SYNC[:1]) else size
+                    break
+                if size - pos < 3:
+                    break
+                kind = buf[pos + 2]
+                frame = frames.get(kind)
+                if frame is None:
+                    pos += 1
+                    continue
+                end = pos + frame.size
+                if size < end:
+                    break
+                fields = frame.unpack_from(buf, pos)
+                if crc(view[pos + 2:end - 2], 0xFFFF) != fields[-1]:
+                    # Fałszywa synchronizacja albo przekłamanie - szukamy od następnego bajtu
+                    stats.crc_errors.inc()
+                    pos += 1
+                    continue
+
+                seq = fields[2]
+                if self._rx_seq is not None:
+                    stats.lost.value += (seq - self._rx_seq - 1) & 0xFF
+                self._rx_seq = seq
+                frames_count += 1
+                if kind == self.SENSOR:
+                    samples.append((fields[3] / 100, fields[4] / 100, float(fields[5])))
+                pos = end
+        if pos:
+            del buf[:pos]
+        stats.lines.value += frames_count
+        if samples:
+            self._last_frame = time.monotonic()
+        return samples
+
+    def encode_command(self, fan, heat, mist, set_temp, set_hum):
+        frame = self.FRAMES[self.COMMAND]
+        data = bytearray(frame.pack(self.SYNC, self.COMMAND, self._tx_seq, max(0, min(255, int(fan))),
+                                    int(heat), int(mist), round(set_temp * 100), round(set_hum * 100), 0))
+        struct.pack_into("<H", data, frame.size - 2, binascii.crc_hqx(data[2:-2], 0xFFFF))
+        self._tx_seq = (self._tx_seq + 1) & 0xFF
+        return bytes(data)
+
+    def stale(self):
+        return time.monotonic() - self._last_frame > SERIAL_BINARY_SILENCE
+
+
+class SerialReader:
+    """Czyta odczyty z UART w pętli asyncio - budzi się tylko, gdy na porcie są dane"""
+
+    def __init__(self, connect=None, backoff_min=1.0, backoff_max=30.0, queue_size=256, log=None,
+                 binary_baud=0, stats=None):
+        self.connect = connect or find_and_connect_serial
+        self.logger = log or logger
+        self.stats = stats or SerialStats()
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.binary_baud = binary_baud
+        self.ser = None
+        self.protocol = TextProtocol(self.logger, self.stats)
+        self.samples = asyncio.Queue(maxsize=queue_size)
+        self.raw = deque(maxlen=RAW_RING_SIZE)
+        self._last_dump = -RAW_DUMP_MIN_INTERVAL
+        self._buffer = bytearray()
+        self._fd = None
+        self._lost = None
+        self._negotiated = None
+        # Początek łączenia - do pomiaru czasu do pierwszego poprawnego odczytu
+        self._connecting_since = None
+        self._first_reported = False
+
+    async def run(self):
+        """Utrzymuje połączenie z portem i wznawia je z rosnącym opóźnieniem"""
+        loop = asyncio.get_running_loop()
+        backoff = self.backoff_min
+        while True:
+            if self._connecting_since is None:
+                self._connecting_since = time.monotonic()
+            ser = self.connect()
+            if asyncio.iscoroutine(ser):
+                # Rozpoznawanie płytek (BoardLocator) czeka na odpowiedzi z portów
+                ser = await ser
+            if ser is None:
+                self.logger.warning(f"[SERIAL] Brak portu, ponowna próba za {backoff:g} s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.backoff_max)
+                continue
+
+            # Odczyt nieblokujący - na dane czeka selektor pętli zdarzeń
+            ser.timeout = 0
+            self.ser = ser
+            self.protocol = TextProtocol(self.logger, self.stats)
+            self._buffer.clear()
+            self._lost = asyncio.Event()
+            self._fd = ser.fileno()
+            loop.add_reader(self._fd, self._on_readable)
+            if self.binary_baud:
+                await self._negotiate()
+            await self._watch()
+
+            self._detach()
+            try:
+                ser.close()
+            except Exception:
+                pass
+            if self._connecting_since is None:
+                # Połączenie dało poprawne odczyty - kolejna awaria zaczyna odliczanie od nowa
+                backoff = self.backoff_min
+            self.logger.warning(f"[SERIAL] Utracono połączenie, ponowna próba za {backoff:g} s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.backoff_max)
+
+    async def _negotiate(self):
+        """Proponuje płytce ramki binarne; bez odpowiedzi zostaje protokół tekstowy"""
+        self._negotiated = asyncio.Event()
+        try:
+            if self.write(BinaryProtocol.HELLO + f" {self.binary_baud}\n".encode()):
+                await asyncio.wait_for(self._negotiated.wait(), SERIAL_NEGOTIATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.logger.info("[SERIAL] Płytka nie obsługuje ramek binarnych - protokół tekstowy")
+        finally:
+            self._negotiated = None
+
+    async def _watch(self):
+        # Czeka na utratę portu i pilnuje, czy płytka nadal wysyła dane w uzgodnionym protokole
+        while not self._lost.is_set():
+            try:
+                await asyncio.wait_for(self._lost.wait(), SERIAL_BINARY_SILENCE)
+            except asyncio.TimeoutError:
+                if self.protocol.stale():
+                    self.logger.warning(f"[SERIAL] Brak poprawnych danych (protokół {self.protocol.name})"
+                                        " - ponowne połączenie")
+                    self.dump_raw("brak danych")
+                    self._drop()
+
+    def write(self, data: bytes):
+        """Wysyła dane na port; przy błędzie zgłasza utratę połączenia"""
+        if self.ser is None:
+            return False
+        self.raw.append((time.time(), "TX", data))
+        start = time.perf_counter()
+        try:
+            self.ser.write(data)
+            self.stats.write.observe(time.perf_counter() - start)
+            return True
+        except (serial.SerialException, OSError) as e:
+            self.logger.error(f"[SERIAL] Błąd zapisu: {e}")
+            self.dump_raw("błąd zapisu")
+            self._drop()
+            return False
+
+    def send_command(self, fan, heat, mist, set_temp, set_hum):
+        return self.write(self.protocol.encode_command(fan, heat, mist, set_temp, set_hum))
+
+    def _on_readable(self):
+        try:
+            chunk = self.ser.read(self.ser.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            self.logger.error(f"[SERIAL] Błąd odczytu: {e}")
+            self.dump_raw("błąd odczytu")
+            self._drop()
+            return
+
+        self.raw.append((time.time(), "RX", chunk))
+        buf = self._buffer
+        buf += chunk
+        errors = self.stats.errors
+        for sample in self.protocol.decode(buf):
+            self._put(sample)
+        if self.stats.errors != errors:
+            self.dump_raw("błędna ramka")
+
+        baud = getattr(self.protocol, "binary_ack", None)
+        if baud and self.binary_baud:
+            # Także spóźnione potwierdzenie (po SERIAL_NEGOTIATE_TIMEOUT) - płytka już przełączyła się na ramki
+            self._switch_to_binary(baud)
+            for sample in self.protocol.decode(buf):
+                self._put(sample)
+
+    def _switch_to_binary(self, baud):
+        try:
+            self.ser.baudrate = baud
+        except (serial.SerialException, OSError, ValueError) as e:
+            self.logger.error(f"[SERIAL] Nie udało się ustawić {baud} baud: {e}")
+            self._drop()
+            return
+        self.protocol = BinaryProtocol(self.logger, self.stats)
+        if self._negotiated is not None:
+            self._negotiated.set()
+        self.logger.info(f"[SERIAL] Protokół binarny, {baud} baud")
+
+    def dump_raw(self, reason, force=False):
+        """Wypisuje do logu ostatnie dane z portu; przy błędach najwyżej raz na RAW_DUMP_MIN_INTERVAL"""
+        now = time.monotonic()
+        if not force and now - self._last_dump < RAW_DUMP_MIN_INTERVAL:
+            return
+        self._last_dump = now
+        self.logger.warning("[SERIAL] Ostatnie dane z portu (%s, %d wpisów):\n%s",
+                            reason, len(self.raw), RawDump(list(self.raw)))
+
+    def _put(self, sample):
+        if self._connecting_since is not None:
+            self._first_sample()
+        if self.samples.full():
+            # Najstarszy odczyt i tak jest już nieaktualny
+            self.samples.get_nowait()
+            self.stats.dropped.inc()
+        self.samples.put_nowait(sample)
+
+    def _first_sample(self):
+        elapsed = time.monotonic() - self._connecting_since
+        self._connecting_since = None
+        self.stats.first_sample.observe(elapsed)
+        if self._first_reported:
+            self.logger.info(f"[SERIAL] Pierwszy poprawny odczyt po ponownym połączeniu: {elapsed:.2f} s")
+            return
+        self._first_reported = True
+        uptime = process_uptime()
+        since_start = f", {uptime:.2f} s od uruchomienia procesu" if uptime is not None else ""
+        self.logger.info(f"[SERIAL] Pierwszy poprawny odczyt po {elapsed:.2f} s łączenia{since_start}")
+
+    def _detach(self):
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            self._fd = None
+        self.ser = None
+
+    def _drop(self):
+        self._detach()
+        if self._lost is not None:
+            self._lost.set()
+
+
+class Terrarium:
+    """Jedno terrarium: port szeregowy, regulator i klient ThingSpeak"""
+
+    def __init__(self, config: TerrariumConfig, transport: Optional[HttpTransport], connect=None,
+                 bridge_transport: Optional[HttpTransport] = None, channel: Optional[TelemetryChannel] = None):
+        self.config = config
+        self.logger = logger.getChild(config.name)
+
+        # Ostatnie nastawy i stan regulatorów z dysku - bez czekania na pierwsze odpytanie ThingSpeak
+        self.snapshot_path = os.path.join(SNAPSHOT_DIR, f"{config.name}.json") if SNAPSHOT_DIR else None
+        snapshot = self._load_snapshot()
+        if snapshot is not None:
+            settings = Settings(**snapshot["settings"])
+        else:
+            settings = Settings(
+                temp_setting = 25.0,
+                hum_setting = 40.0,
+                aq_thresh_setting = 200
+            )
+        # Planowa chwila bieżącego kroku - PID liczy dt z harmonogramu, nie z chwili wybudzenia
+        self.tick_time = None
+        self.controller = Controller(settings, clock=self._clock, log=self.logger)
+        if snapshot is not None:
+            self._restore(snapshot)
+
+        if connect is None and config.port:
+            connect = partial(open_serial, config.port)
+        self.reader = SerialReader(connect=connect, log=self.logger, binary_baud=config.binary_baud,
+                                   stats=SerialStats(config.name))
+        self.control_time = CONTROL_SECONDS.labels(config.name)
+        self.tick_lag = CONTROL_TICK_LAG.labels(config.name)
+        self.overruns = CONTROL_OVERRUNS.labels(config.name)
+        self.stale_ticks = CONTROL_STALE.labels(config.name)
+
+        # Odczyty od ostatniego kroku (pola temp, hum, aq) i ostatnia decyzja: fan, heat_pwm, mist
+        self.window = WindowAggregator()
+        self.last_sample = None
+        self.command = None
+        self._sent = 0
+
+        self.channel = channel
+        if channel is None:
+            # Przekazujemy metodę controller.update_settings jako callback
+            self.ts_client = ThingspeakClient(config, transport, self.controller.update_settings,
+                                              self.controller.current_settings)
+            self.bridge = BridgeForwarder(config.name, bridge_transport) if bridge_transport else None
+        else:
+            # Telemetria w osobnym procesie (--split) - tu tylko kanał w pamięci współdzielonej
+            self.ts_client = None
+            self.bridge = None
+            channel.write_settings(settings.temp_setting, settings.hum_setting, settings.aq_thresh_setting)
+            self._settings_seq = channel.settings_seq
+            self.telemetry_dropped = TELEMETRY_DROPPED.labels(config.name)
+        self.ring = self._open_ring()
+
+    def _open_ring(self):
+        if not RINGSTORE_DIR:
+            return None
+        path = os.path.join(RINGSTORE_DIR, f"{self.config.name}.ring")
+        try:
+            return ringstore.RingStore(path, RINGSTORE_CAPACITY)
+        except ValueError as e:
+            # Uszkodzony plik (ucięty, obcy format) odkładamy na bok i zaczynamy nowy bufor
+            self.logger.error(f"[RING] Uszkodzony bufor telemetrii ({e}) - przeniesiony do {path}.bad, nowy plik")
+            try:
+                os.replace(path, path + ".bad")
+                return ringstore.RingStore(path, RINGSTORE_CAPACITY)
+            except (OSError, ValueError) as e:
+                self.logger.error(f"[RING] Bufor telemetrii wyłączony ({path}): {e}")
+                return None
+        except OSError as e:
+            self.logger.error(f"[RING] Bufor telemetrii wyłączony ({path}): {e}")
+            return None
+
+    def _clock(self):
+        return time.monotonic() if self.tick_time is None else self.tick_time
+
+    def _load_snapshot(self):
+        if self.snapshot_path is None:
+            return None
+        # Pliki tymczasowe po zapisie przerwanym awarią; nieusuwalny nie blokuje startu
+        for leftover in glob.glob(glob.escape(self.snapshot_path) + ".*.tmp"):
+            try:
+                os.unlink(leftover)
+            except OSError as e:
+                self.logger.warning(f"[STATE] Nie udało się usunąć {leftover}: {e}")
+        try:
+            if not os.path.exists(self.snapshot_path):
+                return None
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            if snapshot.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(f"nieobsługiwana wersja {snapshot.get('version')}")
+            snapshot["saved_at"] = float(snapshot.get("saved_at", 0))
+            if not math.isfinite(snapshot["saved_at"]):
+                raise ValueError(f"saved_at={snapshot['saved_at']}")
+            snapshot["settings"] = {name: float(value) for name, value in snapshot["settings"].items()}
+            Settings(**snapshot["settings"])
+            return snapshot
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            self.logger.warning(f"[STATE] Pominięto zapisany stan ({self.snapshot_path}): {e}")
+            return None
+
+    def _restore(self, snapshot):
+        age = time.time() - snapshot.get("saved_at", 0)
+        settings = snapshot["settings"]
+        if age > SNAPSHOT_MAX_AGE:
+            self.logger.info(f"[STATE] Przywrócono nastawy {settings}; "
+                             f"stan regulatorów sprzed {age:.0f} s pominięty.")
+            return
+        try:
+            self.controller.restore(snapshot)
+        except (ValueError, KeyError, TypeError) as e:
+            self.logger.warning(f"[STATE] Nie udało się przywrócić stanu regulatorów: {e}")
+            return
+        self.logger.info(f"[STATE] Przywrócono nastawy {settings} i stan regulatorów sprzed {age:.0f} s.")
 
+    def _snapshot_data(self):
+        snapshot = dict(self.controller.snapshot(), version=SNAPSHOT_VERSION, saved_at=time.time())
+        return json.dumps(snapshot).encode()
+
+    async def _snapshot_loop(self):
+        """Stan zbierany w pętli zdarzeń, zapis (z fsync) w wątku pomocniczym - nie opóźnia kroków regulacji"""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await asyncio.sleep(SNAPSHOT_INTERVAL)
+                try:
+                    await loop.run_in_executor(None, write_atomic, self.snapshot_path, self._snapshot_data())
+                except OSError as e:
+                    self.logger.warning(f"[STATE] Nie udało się zapisać stanu: {e}")
+        finally:
+            # Przy zamykaniu (anulowanie zadań) ostatni stan zapisujemy od razu
+            try:
+                write_atomic(self.snapshot_path, self._snapshot_data())
+            except OSError:
+                pass
+
+    async def run(self):
+        tasks = [self.reader.run()]
+        if self.ts_client:
+            tasks.append(self.ts_client.run())
+        if SEND_INTERVAL > 0:
+            tasks += [self._ingest_loop(), self._scheduled_loop(SEND_INTERVAL)]
+        else:
+            tasks.append(self._control_loop())
+        if self.bridge:
+            tasks.append(self.bridge.run())
+        if self.snapshot_path:
+            tasks.append(self._snapshot_loop())
+        await asyncio.gather(*tasks)
+
+    async def _control_loop(self):
+        """Krok regulacji i komenda po każdym odczycie (SEND_INTERVAL = 0)"""
+        samples = self.reader.samples
+        while True:
+            temp, hum, quality = await samples.get()
+            if self.channel is not None:
+                self._apply_shared_settings()
+            self._step(temp, hum, quality)
+            self._record(temp, hum, quality)
+            self._send()
+
+    async def _ingest_loop(self):
+        """Odczyty trafiają do średniej okresu i do telemetrii z bieżącym stanem urządzeń"""
+        loop = asyncio.get_running_loop()
+        samples, window = self.reader.samples, self.window
+        while True:
+            temp, hum, quality = await samples.get()
+            window.add(temp, hum, quality)
+            self.last_sample = loop.time()
+            self._record(temp, hum, quality)
+
+    async def _scheduled_loop(self, period):
+        """Krok regulacji co `period` s niezależnie od tempa odczytów; jedna komenda na krok"""
+        loop = asyncio.get_running_loop()
+        window = self.window
+        stale = False
+        next_tick = loop.time() + period
+        while True:
+            await asyncio.sleep(next_tick - loop.time())
+            now = loop.time()
+            self.tick_lag.observe(now - next_tick)
+            self.tick_time = next_tick
+            if self.channel is not None:
+                self._apply_shared_settings()
+
+            if window.count:
+                self._step(window.mean(WindowAggregator.TEMP), window.mean(WindowAggregator.HUM),
+                           window.mean(WindowAggregator.AQ))
+                window.reset()
+                if stale:
+                    stale = False
+                    self.logger.info("[CONTROL] Odczyty wróciły - normalna regulacja.")
+            elif self.command is not None and now - self.last_sample > CONTROL_STALE_AFTER:
+                # Bez świeżych danych nie grzejemy i nie zraszamy na ślepo; wentylator bez zmian
+                self.stale_ticks.inc()
+                self.command = (self.command[0], 0, 0)
+                if not stale:
+                    stale = True
+                    self.logger.warning(f"[CONTROL] Brak odczytów od {now - self.last_sample:.1f} s - "
+                                        "grzanie i zraszanie wyłączone.")
+            # Bez nowego odczytu powtarzamy ostatnią decyzję (PID nie liczy drugi raz tych samych danych)
+            if self.command is not None:
+                self._send()
+
+            # Przy spóźnieniu o cały okres pomijamy zaległe kroki zamiast nadrabiać je serią
+            next_tick += period
+            behind = loop.time() - next_tick
+            if behind >= 0:
+                missed = int(behind // period) + 1
+                self.overruns.inc(missed)
+                next_tick += missed * period
+
+    def _apply_shared_settings(self):
+        """Nastawy zapisane przez proces telemetrii - wartości czytane tylko po zmianie numeru"""
+        if self.channel.settings_seq == self._settings_seq:
+            return
+        snapshot = self.channel.read_settings()
+        if snapshot is None:
+            return  # zapis w toku - nastawy wejdą w następnym kroku
+        self._settings_seq, (temp, hum, aq_thresh) = snapshot
+        self.controller.update_settings(Settings(temp_setting=temp, hum_setting=hum, aq_thresh_setting=aq_thresh))
+
+    def _step(self, temp, hum, quality):
+        start = time.perf_counter()
+        try:
+            fan_speed, heating_on, humidifier_on = self.controller.process_sensor_data(temp, hum, quality)
+        except (ValueError, ArithmeticError) as e:
+            # Jeden błędny odczyt nie może zatrzymać regulacji - zostaje poprzednia decyzja
+            self.logger.error(f"[CONTROL] Błąd kroku regulacji dla ({temp}, {hum}, {quality}): {e}")
+            return
+        self.control_time.observe(time.perf_counter() - start)
+        self.command = (fan_speed, 255 if heating_on else 0, 1 if humidifier_on else 0)
+
+    def _record(self, temp, hum, quality):
+        """Odczyt z bieżącą decyzją do lokalnego bufora i ThingSpeak/bridge (albo kanału do telemetrii)"""
+        controller = self.controller
+        fan_speed, heat_pwm, mist = self.command or (0, 0, 0)
+        current_time = time.time()
+        if self.ring is not None:
+            self.ring.append(current_time, temp, hum, quality, fan_speed, heat_pwm, mist,
+                             controller.temp_setting, controller.hum_setting,
+                             controller.aq_thresh_setting)
+        if self.channel is not None:
+            if not self.channel.publish(current_time, temp, hum, quality, fan_speed, heat_pwm, mist,
+                                        controller.temp_setting, controller.hum_setting,
+                                        controller.aq_thresh_setting):
+                self.telemetry_dropped.inc()
+            return
+
+        # Kolejność w update_current_state: temp, hum, set_temp, set_hum, aq, fan, mist, heat, aq_thresh
+        self.ts_client.update_current_state(
+            temp,
+            hum,
+            controller.temp_setting,
+            controller.hum_setting,
+            quality,
+            fan_speed,
+            mist,
+            heat_pwm,
+            controller.aq_thresh_setting # Dodano próg AQ
+        )
+        if self.bridge:
+            self.bridge.add(current_time, temp, hum, quality, fan_speed, heat_pwm, mist,
+                            controller.temp_setting, controller.hum_setting,
+                            controller.aq_thresh_setting)
+
+    def _send(self):
+        fan_speed, heat_pwm, mist = self.command
+        command = (fan_speed, heat_pwm, mist, self.controller.temp_setting, self.controller.hum_setting)
+        if self.reader.send_command(*command):
+            self._sent += 1
+            if self._sent >= LOG_SAMPLE_EVERY:
+                self._sent = 0
+                self.logger.info("TX: %s;%s;%s;%s;%s", *command)
+            else:
+                self.logger.debug("TX: %s;%s;%s;%s;%s", *command)
+
+
+def load_terrarium_configs(path=TERRARIUMS_FILE):
+    """Wczytuje listę terrariów (port + kanały ThingSpeak) z pliku JSON"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [TerrariumConfig.from_dict(entry) for entry in json.load(f)]
+
+
+def config_from_env():
+    """Konfiguracja pojedynczego terrarium ze zmiennych środowiskowych (.env)"""
+    return TerrariumConfig(
+        board_id=BOARD_ID,
+        ts_logs_channel_id=TS_LOGS_CHANNEL_ID,
+        ts_logs_write_key=TS_LOGS_WRITE_KEY,
+        ts_settings_channel_id=TS_SETTINGS_CHANNEL_ID,
+        ts_settings_read_key=TS_SETTINGS_READ_KEY,
+    )
+
+
+async def open_transports(stack):
+    # Jedna sesja HTTP (keep-alive) na usługę, współdzielona przez wszystkie terraria
+    transport = await stack.enter_async_context(HttpTransport(max_connections=16))
+    bridge_transport = None
+    if BRIDGE_URL:
+        bridge_transport = await stack.enter_async_context(HttpTransport(base_url=BRIDGE_URL, service="bridge"))
+    return transport, bridge_transport
+
+
+def install_dump_signal(terrariums):
+    def dump_raw():
+        for t in terrariums:
+            t.reader.dump_raw("SIGUSR1", force=True)
+
+    # kill -USR1 <pid> wypisuje ostatnie surowe dane ze wszystkich portów
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, dump_raw)
+
+
+async def run_terrariums(configs, connect=None, split=False, locator=None):
+    # Bez wskazanej funkcji łączenia porty przydziela rozpoznawanie płytek
+    if connect is None:
+        locator = locator or BoardLocator(configs)
+        connects = {c.name: locator.connector(c) for c in configs}
+    else:
+        connects = {c.name: connect for c in configs}
+    if split:
+        await run_control(configs, connects)
+        return
+
+    async with AsyncExitStack() as stack:
+        transport, bridge_transport = await open_transports(stack)
+        terrariums = [Terrarium(c, transport, connect=connects[c.name], bridge_transport=bridge_transport)
+                      for c in configs]
+        install_dump_signal(terrariums)
+        tasks = [t.run() for t in terrariums]
+        if REDIS_URL:
+            controllers = {t.config.name: t.controller for t in terrariums}
+            tasks.append(RedisSettingsListener(REDIS_URL, controllers).run())
+        if METRICS_PORT:
+            rings = {t.config.name: t.ring for t in terrariums if t.ring is not None}
+            tasks.append(metrics.serve(METRICS_HOST, METRICS_PORT, routes={"/samples": ring_samples_route(rings)}))
+        await asyncio.gather(*tasks)
+
+
+class SharedSettings:
+    """Nastawy terrarium w kanale współdzielonym - ten sam interfejs co Controller dla ThingSpeak i Redis"""
+
+    def __init__(self, channel: TelemetryChannel):
+        self.channel = channel
+        self._recover()
+
+    def _recover(self):
+        # Jedynym piszącym jest ten proces, więc nieparzysty numer to zapis przerwany przez
+        # zatrzymanie poprzedniego procesu telemetrii - bez naprawy sterowanie nie przyjęłoby nastaw
+        if self.channel.recover_settings():
+            logger.warning("[SPLIT] Nastawy w kanale po przerwanym zapisie - zapisano je ponownie")
+
+    def current_settings(self) -> Settings:
+        snapshot = self.channel.read_settings()
+        if snapshot is None:
+            self._recover()
+            snapshot = self.channel.read_settings()
+        temp, hum, aq_thresh = snapshot[1]
+        return Settings(temp_setting=temp, hum_setting=hum, aq_thresh_setting=aq_thresh)
+
+    def update_settings(self, new_settings: Settings):
+        self.channel.write_settings(new_settings.temp_setting, new_settings.hum_setting,
+                                    new_settings.aq_thresh_setting)
+
+
+class TelemetryWorker:
+    """Telemetria jednego terrarium w procesie --split: próbki z kanału do ThingSpeak i bridge"""
+
+    def __init__(self, config: TerrariumConfig, transport: HttpTransport, channel: TelemetryChannel,
+                 bridge_transport: Optional[HttpTransport] = None):
+        self.config = config
+        self.channel = channel
+        self.settings = SharedSettings(channel)
+        self.ts_client = ThingspeakClient(config, transport, self.settings.update_settings,
+                                          self.settings.current_settings)
+        self.bridge = BridgeForwarder(config.name, bridge_transport) if bridge_transport else None
+
+    async def run(self):
+        tasks = [self.ts_client.run(), self._drain_loop()]
+        if self.bridge:
+            tasks.append(self.bridge.run())
+        await asyncio.gather(*tasks)
+
+    async def _drain_loop(self):
+        ts_client, bridge = self.ts_client, self.bridge
+        while True:
+            await asyncio.sleep(TELEMETRY_POLL_INTERVAL)
+            for ts, temp, hum, aq, fan, heat, mist, set_temp, set_hum, aq_thresh in self.channel.drain():
+                ts_client.update_current_state(temp, hum, set_temp, set_hum, aq, fan, mist, heat, aq_thresh)
+                if bridge:
+                    bridge.add(ts, temp, hum, aq, fan, heat, mist, set_temp, set_hum, aq_thresh)
+
+
+class TelemetryProcess:
+    """Proces potomny telemetrii; wznawiany, gdy padnie - sterowanie działa dalej bez przerwy"""
+
+    def __init__(self, configs, channels):
+        self.args = ([asdict(c) for c in configs], {name: ch.name for name, ch in channels.items()})
+        self.process = None
+
+    def start(self):
+        # spawn, nie fork - proces sterowania ma już wątek logów i pętlę zdarzeń
+        context = multiprocessing.get_context("spawn")
+        self.process = context.Process(target=telemetry_main, args=self.args, name="terrarium-telemetry",
+                                       daemon=True)
+        self.process.start()
+        logger.info(f"[SPLIT] Proces telemetrii uruchomiony (pid {self.process.pid}).")
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(TELEMETRY_WATCH_INTERVAL)
+            if not self.process.is_alive():
+                logger.error(f"[SPLIT] Proces telemetrii zakończył się (kod {self.process.exitcode}) - restart.")
+                self.start()
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(5)
+
+
+def set_control_priority():
+    """Opcjonalnie podnosi priorytet procesu sterowania (zwykle wymaga CAP_SYS_NICE)"""
+    try:
+        if CONTROL_RT_PRIORITY:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(CONTROL_RT_PRIORITY))
+            logger.info(f"[SPLIT] Sterowanie z SCHED_FIFO, priorytet {CONTROL_RT_PRIORITY}.")
+        elif CONTROL_NICE:
+            os.setpriority(os.PRIO_PROCESS, 0, CONTROL_NICE)
+            logger.info(f"[SPLIT] Sterowanie z nice {CONTROL_NICE}.")
+    except (OSError, AttributeError) as e:
+        logger.warning(f"[SPLIT] Nie udało się podnieść priorytetu sterowania: {e}")
+
+
+async def run_control(configs, connects):
+    """Proces sterowania (--split): porty, regulatory i bufor lokalny; sieć tylko w procesie telemetrii"""
+    channels = {c.name: TelemetryChannel.create(TELEMETRY_CHANNEL_SIZE) for c in configs}
+    worker = TelemetryProcess(configs, channels)
+    try:
+        # Terraria zapisują początkowe nastawy do kanałów przed startem telemetrii
+        terrariums = [Terrarium(c, None, connect=connects[c.name], channel=channels[c.name]) for c in configs]
+        worker.start()
+        set_control_priority()
+        install_dump_signal(terrariums)
+        tasks = [t.run() for t in terrariums] + [worker.watch()]
+        if METRICS_PORT:
+            tasks.append(metrics.serve(METRICS_HOST, METRICS_PORT))
+        await asyncio.gather(*tasks)
+    finally:
+        worker.stop()
+        for channel in channels.values():
+            channel.close()
+
+
+def telemetry_main(config_dicts, channel_names):
+    """Wejście procesu telemetrii (--split)"""
+    listener = setup_logging()
+    try:
+        # Priorytet dziedziczony po sterowaniu (przy restarcie) wraca do zwykłego
+        if CONTROL_RT_PRIORITY:
+            os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+        if CONTROL_NICE:
+            os.setpriority(os.PRIO_PROCESS, 0, max(0, os.getpriority(os.PRIO_PROCESS, 0)))
+    except OSError:
+        pass
+    try:
+        asyncio.run(run_telemetry([TerrariumConfig(**c) for c in config_dicts], channel_names))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.stop()
+
+
+async def run_telemetry(configs, channel_names):
+    channels = {name: TelemetryChannel.attach(shm_name) for name, shm_name in channel_names.items()}
+    try:
+        async with AsyncExitStack() as stack:
+            transport, bridge_transport = await open_transports(stack)
+            workers = [TelemetryWorker(c, transport, channels[c.name], bridge_transport) for c in configs]
+            tasks = [w.run() for w in workers]
+            if REDIS_URL:
+                settings = {w.config.name: w.settings for w in workers}
+                tasks.append(RedisSettingsListener(REDIS_URL, settings).run())
+            if METRICS_PORT:
+                rings = {}
+                for c in configs:
+                    path = os.path.join(RINGSTORE_DIR, f"{c.name}.ring")
+                    if RINGSTORE_DIR and os.path.exists(path):
+                        try:
+                            rings[c.name] = stack.enter_context(ringstore.RingStore(path, readonly=True))
+                        except (OSError, ValueError) as e:
+                            logger.error(f"[RING] /samples bez bufora {c.name}: {e}")
+                tasks.append(metrics.serve(METRICS_HOST, METRICS_PORT + 1,
+                                           routes={"/samples": ring_samples_route(rings)}))
+
+            # Koniec procesu sterowania kończy telemetrię (kanały znikają razem z nim)
+            parent = multiprocessing.parent_process()
+            running = [asyncio.ensure_future(t) for t in tasks]
+            while parent is None or parent.is_alive():
+                done = [t for t in running if t.done()]
+                if done:
+                    done[0].result()
+                await asyncio.sleep(1.0)
+            logger.warning("[SPLIT] Proces sterowania zakończył się - koniec telemetrii.")
+            for t in running:
+                t.cancel()
+    finally:
+        for channel in channels.values():
+            channel.close()
+
+
+def ring_samples_route(rings):
+    """GET /samples?terrarium=&start=&end=&limit= - rekordy z bufora w formacie POST /samples bridge"""
+
+    def handle(query):
+        name = query.get("terrarium", [next(iter(rings), "")])[0]
+        ring = rings.get(name)
+        if ring is None:
+            return "404 Not Found", "text/plain; charset=utf-8", f"brak bufora dla {name}\n".encode()
+        try:
+            start = float(query["start"][0]) if "start" in query else time.time() - 3600
+            end = float(query["end"][0]) if "end" in query else None
+            limit = min(int(query.get("limit", [RINGSTORE_PAGE])[0]), RINGSTORE_PAGE)
+        except ValueError:
+            return "400 Bad Request", "text/plain; charset=utf-8", "start/end/limit muszą być liczbami\n".encode()
+        records = ring.range(start, end, limit)
+        return "200 OK", "application/json", json.dumps(ringstore.as_payload(records, name)).encode()
+
+    return handle
+
+
+async def run_single(split=False):
+    await run_terrariums([config_from_env()], split=split)
+
+
+async def run_supervisor(split=False):
+    """Jeden proces i jedna pętla zdarzeń dla wszystkich podłączonych terrariów"""
+    locator = BoardLocator(load_terrarium_configs())
+    for probe in await locator.discover():
+        name = probe.board_id or os.path.basename(probe.port)
+        logger.warning(f"[INIT] Brak wpisu dla płytki {name} ({probe.port}) w {TERRARIUMS_FILE}"
+                       f" - sterowanie bez telemetrii.")
+        config = TerrariumConfig(name=name, board_id=probe.board_id) if probe.board_id else \
+            TerrariumConfig(name=name, port=probe.port)
+        locator.adopt(probe, config)
+
+    if not locator.configs:
+        logger.error("[INIT] Nie znaleziono żadnych płytek ani wpisów w pliku konfiguracji.")
+        return
+
+    logger.info(f"[INIT] Nadzorca uruchamia {len(locator.configs)} terrariów.")
+    await run_terrariums(locator.configs, split=split, locator=locator)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Wrzuca rekord do kolejki bez formatowania - tekst składa dopiero wątek QueueListener"""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=LOG_LEVEL):
+    """Logi przez kolejkę: pętla zdarzeń tylko dokłada rekord, zapis na stderr robi osobny wątek"""
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers[:] = [LocalQueueHandler(log_queue)]
+    listener.start()
+    return listener
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sterownik terrarium")
+    parser.add_argument("--supervisor", action="store_true",
+                        help="obsługa wszystkich portów w jednym procesie (konfiguracja w TERRARIUMS_FILE)")
+    parser.add_argument("--split", action="store_true",
+                        help="telemetria (ThingSpeak, bridge, Redis) w osobnym procesie niż sterowanie")
+    args = parser.parse_args()
+
+    listener = setup_logging()
+    try:
+        if args.supervisor:
+            asyncio.run(run_supervisor(args.split))
+        else:
+            asyncio.run(run_single(args.split))
+    finally:
+        listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+"""Liczniki i histogramy sterownika w formacie tekstowym Prometheusa.
+
+Metryki aktualizuje wyłącznie wątek pętli zdarzeń, więc nie potrzebują blokad. Kubełki histogramów
+są prealokowane przy tworzeniu metryki - próbka to jedno wyszukiwanie binarne i dwa dodawania.
+"""
+import asyncio
+import logging
+from array import array
+from bisect import bisect_left
+from urllib.parse import parse_qs
+
+logger = logging.getLogger("terrarium_controller")
+
+# Domyślne granice kubełków (sekundy): od 10 µs do 10 s
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        # Ostatni kubełek to +Inf; liczniki nieskumulowane, sumowane dopiero przy eksporcie
+        self.counts = array("Q", bytes(8 * (len(self.bounds) + 1)))
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+
+class Family:
+    """Metryka o jednej nazwie; każdy zestaw wartości etykiet to osobne dziecko"""
+
+    def __init__(self, kind, name, help, labels=(), **options):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labels_names = tuple(labels)
+        self.options = options
+        self.children = {}
+
+    def labels(self, *values):
+        """Zwraca (i przy pierwszym użyciu tworzy) dziecko - wywoływać raz, poza gorącą ścieżką"""
+        key = tuple(str(v) for v in values)
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = (Counter() if self.kind == "counter" else Histogram(**self.options))
+        return child
+
+    def render(self, out):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        for key, child in self.children.items():
+            pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labels_names, key)]
+            if self.kind == "counter":
+                out.append(f"{self.name}{_labels(pairs)} {child.value}")
+                continue
+            total = 0
+            for bound, n in zip(child.bounds + (float("inf"),), child.counts):
+                total += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                out.append(f"{self.name}_bucket{_labels(pairs + [le])} {total}")
+            out.append(f"{self.name}_sum{_labels(pairs)} {child.sum!r}")
+            out.append(f"{self.name}_count{_labels(pairs)} {total}")
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}
+
+    def _family(self, kind, name, help, labels, **options):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = Family(kind, name, help, labels, **options)
+        return family
+
+    def counter(self, name, help, labels=()):
+        return self._family("counter", name, help, labels)
+
+    def histogram(self, name, help, labels=(), bounds=LATENCY_BUCKETS):
+        return self._family("histogram", name, help, labels, bounds=bounds)
+
+    def render(self):
+        out = []
+        for family in self.families.values():
+            if family.children:
+                family.render(out)
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+async def serve(host, port, registry=REGISTRY, routes=None):
+    """Minimalny serwer HTTP: GET /metrics i dodatkowe adresy (bez zależności od frameworka).
+
+    routes: ścieżka -> funkcja(parametry zapytania) zwracająca (status, content-type, treść).
+    """
+    routes = dict(routes or {})
+    routes["/metrics"] = lambda query: ("200 OK", "text/plain; version=0.0.4; charset=utf-8",
+                                        registry.render().encode())
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5.0)
+            method, target = request.decode("latin-1").split(" ", 2)[:2]
+            path, _, query = target.partition("?")
+            route = routes.get(path) if method == "GET" else None
+            if route is None:
+                status, content_type, body = "404 Not Found", "text/plain", b"not found\n"
+            else:
+                status, content_type, body = route(parse_qs(query))
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"[METRICS] Serwer na http://{host}:{port} ({', '.join(sorted(routes))})")
+    async with server:
+        await server.serve_forever()
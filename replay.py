@@ -0,0 +1,361 @@
+"""Odtwarzanie offline logiki sterownika na nagranych pomiarach.
+
+Przykłady:
+    python replay.py historia.csv                         # jedno odtworzenie, podsumowanie
+    python replay.py historia.csv --kp 40 --out kroki.csv # wynik krok po kroku
+    python replay.py historia.csv --sweep --kp 20:80:13 --kd 0:4:9 --ki 0,0.5,1 \\
+        --hysteresis 0.2:1.0:5 --aq-delay 30,60,90,120    # przegląd parametrów (numpy)
+
+Wejście: CSV z API (/history?format=csv), eksport InfluxDB (annotated CSV: _time,_field,_value)
+albo eksport kanału ThingSpeak (created_at,field1,field2,field3).
+
+Symulacja działa w pętli otwartej: odczyty pochodzą z nagrania, decyzje sterownika ich nie zmieniają.
+Porównujemy więc pracę urządzeń (wypełnienie, liczbę przełączeń), a nie przebieg temperatury.
+"""
+import argparse
+import csv
+import re
+import sys
+from array import array
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from main import Controller, Settings
+
+Recording = namedtuple("Recording", "time temperature humidity air_quality")
+# Parametry strojenia; domyślnie wartości z Controller/CoolingPID
+Params = namedtuple("Params", "kp ki kd hysteresis aq_delay")
+DEFAULT_PARAMS = Params(kp=255.0 / 5.0, ki=0.0, kd=1.0, hysteresis=0.5, aq_delay=90)
+
+METRICS = ("fan_mean", "fan_switches", "heat_duty", "heat_switches", "mist_duty", "mist_switches")
+THINGSPEAK_FIELDS = {"field1": "temperature", "field2": "humidity", "field3": "air_quality"}
+SERIES = ("temperature", "humidity", "air_quality")
+
+
+def parse_timestamp(value):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # InfluxDB podaje nanosekundy - datetime przyjmuje najwyżej mikrosekundy
+    value = re.sub(r"(\.\d{6})\d+", r"\1", value.strip().replace("Z", "+00:00"))
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def load_recording(path):
+    """Wczytuje nagranie do kolumn array('d') posortowanych po czasie"""
+    rows = {}  # czas -> {seria: wartość}
+    with open(path, newline="") as f:
+        header = None
+        for row in csv.reader(line for line in f if not line.startswith("#")):
+            if not any(row):
+                header = None  # pusta linia rozdziela tabele eksportu InfluxDB
+                continue
+            if header is None:
+                header = {name: i for i, name in enumerate(row)}
+                continue
+
+            if "_field" in header:
+                field = row[header["_field"]]
+                if field in SERIES:
+                    rows.setdefault(row[header["_time"]], {})[field] = float(row[header["_value"]])
+                continue
+
+            time_column = "created_at" if "created_at" in header else "time"
+            values = rows.setdefault(row[header[time_column]], {})
+            for column, i in header.items():
+                name = THINGSPEAK_FIELDS.get(column, column)
+                if name in SERIES and row[i] != "":
+                    values[name] = float(row[i])
+
+    samples = sorted(
+        (parse_timestamp(t), v["temperature"], v["humidity"], v["air_quality"])
+        for t, v in rows.items() if len(v) == len(SERIES)
+    )
+    if not samples:
+        raise ValueError(f"{path}: brak wierszy z temperaturą, wilgotnością i jakością powietrza")
+    return Recording(*(array("d", column) for column in zip(*samples)))
+
+
+def make_controller(settings, params, clock):
+    controller = Controller(settings, clock=clock)
+    controller.cooling_pid.tune(params.kp, params.ki, params.kd)
+    controller.heating_controller.heating_hysteresis = params.hysteresis
+    controller.aq_trigger_steps = params.aq_delay
+    return controller
+
+
+def replay(recording, settings, params=DEFAULT_PARAMS):
+    """Przepuszcza nagranie przez Controller z zegarem z nagrania; zwraca kolumny fan, heat, mist"""
+    now = recording.time[0]
+    controller = make_controller(settings, params, clock=lambda: now)
+    fan, heat, mist = array("d"), array("b"), array("b")
+
+    for now, temp, hum, quality in zip(*recording):
+        fan_speed, heating_on, humidifier_on = controller.process_sensor_data(temp, hum, quality)
+        fan.append(fan_speed)
+        heat.append(heating_on)
+        mist.append(humidifier_on)
+    return fan, heat, mist
+
+
+def count_switches(values):
+    return sum(1 for a, b in zip(values, values[1:]) if (a > 0) != (b > 0))
+
+
+def summarize(fan, heat, mist):
+    n = len(fan)
+    return {
+        "fan_mean": sum(fan) / n,
+        "fan_switches": count_switches(fan),
+        "heat_duty": sum(heat) / n,
+        "heat_switches": count_switches(heat),
+        "mist_duty": sum(mist) / n,
+        "mist_switches": count_switches(mist),
+    }
+
+
+# --- Przegląd parametrów (numpy) ---------------------------------------------------------------
+#
+# Ta sama logika co w Controller.process_sensor_data, rozbita na części zależne od różnych parametrów:
+# grzanie (histereza) i nawilżanie/wietrzenie (aq_delay) liczone są raz na wartość parametru,
+# a PID wektorowo dla wszystkich kombinacji wzmocnień naraz.
+
+def _relay(np, set_mask, reset_mask, initial=False):
+    """Przekaźnik: stan z ostatniego kroku, w którym zadziałał warunek włączenia lub wyłączenia"""
+    events = np.where(set_mask | reset_mask, np.arange(len(set_mask)), -1)
+    last = np.maximum.accumulate(events)
+    return np.where(last >= 0, set_mask[np.maximum(last, 0)], initial)
+
+
+def _switches(np, on):
+    return np.count_nonzero(on[..., 1:] != on[..., :-1], axis=-1)
+
+
+def _smog_and_mist(np, quality, hum, settings, delay):
+    """Wietrzenie po złej jakości powietrza (clear_smog) i nawilżacz dla jednej wartości aq_delay.
+
+    Zamiast iterować po każdym odczycie przeskakujemy między zmianami stanu clear_smog.
+    """
+    n = len(quality)
+    idx = np.arange(n)
+    high = quality > settings.aq_thresh_setting
+    low = quality <= settings.aq_thresh_setting * 0.9
+    next_high = np.minimum.accumulate(np.where(high, idx, n)[::-1])[::-1]
+    next_low = np.minimum.accumulate(np.where(low, idx, n)[::-1])[::-1]
+    next_high = np.append(next_high, n)
+    next_low = np.append(next_low, n)
+
+    # Nawilżacz (gdy nie wietrzymy): przekaźnik na wilgotności; `decisive` - ostatni krok, w którym
+    # wilgotność była różna od nastawy (przy równej nawilżacz zachowuje poprzedni stan)
+    differs = hum != settings.hum_setting
+    decisive = np.maximum.accumulate(np.where(differs, idx, -1))
+    next_decisive = np.append(np.minimum.accumulate(np.where(differs, idx, n)[::-1])[::-1], n)
+    relay_on = np.where(decisive >= 0, hum[np.maximum(decisive, 0)] < settings.hum_setting, False)
+    # Ostatni krok <= t, w którym przekaźnik był włączony
+    last_relay_on = np.maximum.accumulate(np.where(relay_on, idx, -1))
+
+    smog = np.zeros(n, dtype=bool)
+    mist = np.zeros(n, dtype=bool)
+    start, humidifier, last_on = 0, False, -delay  # licznik aq_trigger_delay startuje od 0
+
+    while start < n:
+        # Odcinek bez wietrzenia od `start`: nawilżacz = przekaźnik (do pierwszej decyzji - stan zapamiętany)
+        first_decisive = next_decisive[start]
+
+        def last_on_before(t):
+            # Ostatnie włączenie nawilżacza przed krokiem t (licząc wcześniejsze odcinki)
+            result = last_on
+            if humidifier and t > start:
+                result = max(result, min(t, first_decisive) - 1)
+            if t - 1 >= first_decisive and last_relay_on[t - 1] >= first_decisive:
+                result = max(result, last_relay_on[t - 1])
+            return result
+
+        # Szukamy pierwszego kroku ze złą jakością powietrza i wygasłym opóźnieniem
+        t = next_high[start]
+        while t < n:
+            previous_on = last_on_before(t)
+            if t - previous_on >= delay:
+                break
+            t = next_high[min(n, previous_on + delay)]
+
+        end = t
+        segment = slice(start, end)
+        if end > start:
+            mist[segment] = np.where(idx[segment] >= first_decisive, relay_on[segment], humidifier)
+            last_on = last_on_before(end)
+            humidifier = bool(relay_on[end - 1]) if end - 1 >= first_decisive else humidifier
+        if end >= n:
+            break
+
+        # Wietrzenie do pierwszego kroku z dobrą jakością powietrza; nawilżacz wyłączony, jego stan zamrożony
+        start = next_low[end + 1]
+        smog[end:start] = True
+    return smog, mist
+
+
+def _pid_inputs(np, time, temp, called, target):
+    """Składowe PID zależne tylko od nagrania: uchyb, całka uchybu i pochodna w krokach z dodatnim uchybem"""
+    t = time[called]
+    error = temp[called] - target
+    dt = np.diff(t, prepend=time[0])
+    positive = error > 0
+    prev_error = np.concatenate(([0.0], np.where(positive, error, 0.0)[:-1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        derivative = np.where(dt > 0, (error - prev_error) / dt, 0.0)
+    # Całka rośnie w ciągłych odcinkach dodatniego uchybu, spadek do zera zeruje ją
+    cumulative = np.cumsum(np.where(positive, error * dt, 0.0))
+    base = np.maximum.accumulate(np.where(positive, 0.0, cumulative))
+    integral = cumulative - base
+    return positive, error[positive], integral[positive], derivative[positive]
+
+
+def sweep(recording, settings, kp, ki, kd, hysteresis, aq_delay):
+    """Metryki dla wszystkich kombinacji parametrów (iloczyn kartezjański list)"""
+    # numpy jest potrzebny tylko do przeglądu (uv sync --extra sim)
+    import numpy as np
+
+    time = np.frombuffer(recording.time, dtype=np.float64)
+    temp = np.frombuffer(recording.temperature, dtype=np.float64)
+    hum = np.frombuffer(recording.humidity, dtype=np.float64)
+    quality = np.frombuffer(recording.air_quality, dtype=np.float64)
+    n = len(time)
+    reference = Controller(settings)
+    pid = reference.cooling_pid
+    target = pid.target
+
+    heat = {}
+    for h in hysteresis:
+        on = _relay(np, temp < settings.temp_setting - h, temp > settings.temp_setting + h)
+        heat[h] = {"heat_duty": np.count_nonzero(on) / n, "heat_switches": int(_switches(np, on))}
+
+    clear_humidity = _relay(np, hum > settings.hum_setting + 10, hum <= settings.hum_setting)
+    results = []
+    for delay in aq_delay:
+        smog, mist = _smog_and_mist(np, quality, hum, settings, int(delay))
+        override = smog | clear_humidity
+        called = ~override
+        positive, error, integral, derivative = _pid_inputs(np, time, temp, called, target)
+        pid_steps = np.flatnonzero(called)[positive]
+
+        fan_base = np.where(smog, 255.0, np.where(clear_humidity, 170.0, 0.0))
+        base_sum = fan_base.sum()
+        on_base = fan_base > 0
+        mist_stats = {"mist_duty": np.count_nonzero(mist) / n, "mist_switches": int(_switches(np, mist))}
+
+        # Przełączenia wentylatora: pary kroków bez PID są wspólne dla wszystkich wzmocnień. Kroki PID
+        # tworzą ciągłe serie - per kombinację liczymy zmiany wewnątrz serii i na ich brzegach.
+        in_pid = np.zeros(n, dtype=bool)
+        in_pid[pid_steps] = True
+        fixed_switches = np.count_nonzero((on_base[1:] != on_base[:-1]) & ~(in_pid[:-1] | in_pid[1:]))
+        adjacent = np.diff(pid_steps) == 1
+        first, last = np.ones(len(pid_steps), dtype=bool), np.ones(len(pid_steps), dtype=bool)
+        first[1:] = ~adjacent
+        last[:-1] = ~adjacent
+        run_start, run_end = np.flatnonzero(first), np.flatnonzero(last)
+        # Stan wentylatora przed serią i po niej (brak sąsiada na brzegu nagrania - brak przełączenia)
+        has_before = pid_steps[run_start] > 0
+        has_after = pid_steps[run_end] < n - 1
+        run_start, before = run_start[has_before], on_base[pid_steps[run_start[has_before]] - 1]
+        run_end, after = run_end[has_after], on_base[pid_steps[run_end[has_after]] + 1]
+
+        # Wyjście PID jak w CoolingPID.compute: (P + I) + D, próg startu, nasycenie, int()
+        size = len(error)
+        p_term, pi_term, output, d_term = (np.empty(size) for _ in range(4))
+        off = np.empty(size, dtype=bool)
+        changed = np.empty(max(0, size - 1), dtype=bool)
+        i_terms = {}
+        for g_ki in ki:
+            limit = pid.max_out / (g_ki if g_ki > 0 else 1)
+            i_terms[g_ki] = g_ki * np.minimum(integral, limit)
+
+        for g_kp in kp:
+            np.multiply(g_kp, error, out=p_term)
+            for g_ki in ki:
+                np.add(p_term, i_terms[g_ki], out=pi_term)
+                for g_kd in kd:
+                    np.multiply(g_kd, derivative, out=d_term)
+                    np.add(pi_term, d_term, out=output)
+                    np.less(output, pid.min_out, out=off)
+                    np.minimum(output, pid.max_out, out=output)
+                    np.floor(output, out=output)
+                    np.copyto(output, 0.0, where=off)
+
+                    np.not_equal(off[1:], off[:-1], out=changed)
+                    switches = (fixed_switches
+                                + np.count_nonzero(changed & adjacent)
+                                + np.count_nonzero(off[run_start] == before)
+                                + np.count_nonzero(off[run_end] == after))
+                    fan_mean = (base_sum + output.sum()) / n
+                    for h in hysteresis:
+                        row = {"kp": g_kp, "ki": g_ki, "kd": g_kd, "hysteresis": h, "aq_delay": int(delay),
+                               "fan_mean": float(fan_mean), "fan_switches": int(switches)}
+                        row.update(heat[h])
+                        row.update(mist_stats)
+                        results.append(row)
+    return results
+
+
+def parse_values(text):
+    """`a,b,c` albo zakres `start:stop:liczba` (końce włącznie)"""
+    if text.count(":") == 2:
+        start, stop, count = text.split(":")
+        start, stop, count = float(start), float(stop), int(count)
+        if count == 1:
+            return [start]
+        return [start + (stop - start) * i / (count - 1) for i in range(count)]
+    return [float(v) for v in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Odtwarzanie logiki sterownika na nagranych danych")
+    parser.add_argument("recording", help="plik CSV z pomiarami")
+    parser.add_argument("--temp", type=float, default=25.0, help="nastawa temperatury")
+    parser.add_argument("--hum", type=float, default=40.0, help="nastawa wilgotności")
+    parser.add_argument("--aq", type=float, default=200.0, help="próg jakości powietrza")
+    parser.add_argument("--kp", default=str(DEFAULT_PARAMS.kp))
+    parser.add_argument("--ki", default=str(DEFAULT_PARAMS.ki))
+    parser.add_argument("--kd", default=str(DEFAULT_PARAMS.kd))
+    parser.add_argument("--hysteresis", default=str(DEFAULT_PARAMS.hysteresis))
+    parser.add_argument("--aq-delay", default=str(DEFAULT_PARAMS.aq_delay), help="odczyty blokady wietrzenia po zraszaniu")
+    parser.add_argument("--sweep", action="store_true", help="przegląd wszystkich kombinacji (wymaga numpy)")
+    parser.add_argument("--sort", default="fan_switches", choices=METRICS, help="metryka sortowania przeglądu")
+    parser.add_argument("--top", type=int, default=20, help="liczba najlepszych kombinacji na wyjściu")
+    parser.add_argument("--out", help="zapis wyników do CSV (kroki albo wszystkie kombinacje)")
+    args = parser.parse_args()
+
+    settings = Settings(temp_setting=args.temp, hum_setting=args.hum, aq_thresh_setting=args.aq)
+    recording = load_recording(args.recording)
+    values = {name: parse_values(getattr(args, name)) for name in Params._fields}
+    values["aq_delay"] = [int(v) for v in values["aq_delay"]]
+    print(f"Nagranie: {len(recording.time)} odczytów, "
+          f"{(recording.time[-1] - recording.time[0]) / 86400:.1f} dni", file=sys.stderr)
+
+    if args.sweep:
+        results = sweep(recording, settings, **values)
+        results.sort(key=lambda row: row[args.sort])
+        columns = list(Params._fields) + list(METRICS)
+        writer = csv.DictWriter(open(args.out, "w", newline="") if args.out else sys.stdout, columns)
+        writer.writeheader()
+        writer.writerows(results if args.out else results[:args.top])
+        return
+
+    if any(len(v) != 1 for v in values.values()):
+        parser.error("lista wartości parametrów wymaga --sweep")
+    params = Params(**{name: v[0] for name, v in values.items()})
+    fan, heat, mist = replay(recording, settings, params)
+    if args.out:
+        with open(args.out, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("time",) + SERIES + ("fan", "heat", "mist"))
+            writer.writerows(zip(*recording, fan, heat, mist))
+    for name, value in summarize(fan, heat, mist).items():
+        print(f"{name}: {value:g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Lokalny bufor telemetrii: plik mmap o stałym rozmiarze z pierścieniem rekordów binarnych.
+
+Każda próbka sterownika (odczyt + decyzja) to jeden rekord 24 B; zapis to pack_into do mapowanej
+pamięci i aktualizacja licznika w nagłówku - bez bazy danych i bez fsync (zrzut robi jądro).
+Rekordy są w kolejności zapisu, więc zakres czasu znajdujemy wyszukiwaniem binarnym
+(zakłada to niemalejący zegar systemowy).
+
+Przykłady:
+    python ringstore.py telemetry/terrarium_1.ring                   # ostatnia godzina jako CSV
+    python ringstore.py telemetry/terrarium_1.ring --since 86400 > doba.csv && python replay.py doba.csv
+    python ringstore.py telemetry/terrarium_1.ring --stats
+"""
+import argparse
+import csv
+import mmap
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+
+MAGIC = b"TRRS"
+VERSION = 1
+# magic, wersja, rozmiar rekordu, pojemność (rekordy), liczba wszystkich zapisów
+HEADER = struct.Struct("<4sHHQQ")
+HEADER_SIZE = 64
+# czas, temp*100, hum*100, aq, fan, heat, mist, set_temp*100, set_hum*100, próg aq
+RECORD = struct.Struct("<dhHHBBBhHHx")
+# Zakresy pól rekordu (do przycięcia wartości, które się nie mieszczą)
+LIMITS = ((float("-inf"), float("inf")), (-32768, 32767), (0, 65535), (0, 65535), (0, 255), (0, 1), (0, 1),
+          (-32768, 32767), (0, 65535), (0, 65535))
+TIME = struct.Struct("<d")
+WRITTEN = struct.Struct("<Q")
+# Offset licznika zapisów w nagłówku
+WRITTEN_OFFSET = 16
+
+FIELDS = ("time", "temperature", "humidity", "air_quality", "fan", "heat", "mist",
+          "temp_setting", "hum_setting", "aq_thresh_setting")
+Record = namedtuple("Record", FIELDS)
+
+# 7 dni przy jednym odczycie na sekundę (~14,5 MB)
+DEFAULT_CAPACITY = 7 * 24 * 3600
+
+
+class RingStore:
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        if readonly:
+            self._file = open(path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._file = self._open_for_writing(path, capacity)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+
+        # Licznik zapisów trzymamy też w pamięci - jedynym piszącym jest ten obiekt
+        try:
+            magic, version, record_size, self.capacity, self._written = HEADER.unpack_from(self._map)
+        except struct.error:
+            self.close()
+            raise ValueError(f"{path}: plik telemetrii jest ucięty") from None
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path}: nieobsługiwany format pliku telemetrii")
+        # Poprawny nagłówek, ale ucięte rekordy (np. kopia przerwana w połowie) - append wyszedłby poza mapę
+        if not self.capacity or len(self._map) < HEADER_SIZE + self.capacity * RECORD.size:
+            size = len(self._map)
+            self.close()
+            raise ValueError(f"{path}: plik telemetrii jest ucięty ({size} B, pojemność {self.capacity})")
+
+    @staticmethod
+    def _open_for_writing(path, capacity):
+        if os.path.exists(path):
+            # Istniejący plik zachowuje swoją pojemność - dane przetrwają restart
+            return open(path, "r+b")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        f = open(path, "w+b")
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, capacity, 0).ljust(HEADER_SIZE, b"\0"))
+        # Plik rzadki - bloki na dysku zajmują się dopiero przy zapisie
+        f.truncate(HEADER_SIZE + capacity * RECORD.size)
+        f.flush()
+        return f
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    @property
+    def written(self):
+        return WRITTEN.unpack_from(self._map, WRITTEN_OFFSET)[0]
+
+    def __len__(self):
+        return self._window(self.written)[1]
+
+    def _window(self, written):
+        """Pierwszy dostępny rekord (numer zapisu) i liczba rekordów do odczytu.
+
+        Slot najstarszego rekordu jest następny do nadpisania, więc czytelnik go pomija.
+        """
+        count = min(written, self.capacity - 1)
+        return written - count, count
+
+    def append(self, ts, temp, hum, aq, fan, heat, mist, set_temp, set_hum, aq_thresh):
+        """Dopisuje rekord; przy pełnym pierścieniu nadpisuje najstarszy. False - rekord z NaN pominięty"""
+        written = self._written
+        offset = HEADER_SIZE + (written % self.capacity) * RECORD.size
+        try:
+            RECORD.pack_into(self._map, offset, ts, round(temp * 100), round(hum * 100), round(aq), int(fan),
+                             1 if heat else 0, 1 if mist else 0, round(set_temp * 100), round(set_hum * 100),
+                             round(aq_thresh))
+        except (struct.error, ValueError, OverflowError):
+            # Wartość spoza zakresu pola (np. przekłamany odczyt, nieskończoność) - zapisujemy skrajną
+            scaled = (temp * 100, hum * 100, aq, fan, 1 if heat else 0, 1 if mist else 0,
+                      set_temp * 100, set_hum * 100, aq_thresh)
+            if ts != ts or any(v != v for v in scaled):
+                return False
+            RECORD.pack_into(self._map, offset, ts,
+                             *(round(_clamp(v, lo, hi)) for v, (lo, hi) in zip(scaled, LIMITS[1:])))
+        # Licznik dopiero po rekordzie - czytelnik nigdy nie zobaczy niezapisanego wpisu
+        self._written = written + 1
+        WRITTEN.pack_into(self._map, WRITTEN_OFFSET, self._written)
+        return True
+
+    def _offset(self, seq):
+        return HEADER_SIZE + (seq % self.capacity) * RECORD.size
+
+    def _read(self, lo, hi):
+        """Rekordy o numerach zapisu [lo, hi)"""
+        records = [_decode(RECORD.unpack_from(self._map, self._offset(seq))) for seq in range(lo, hi)]
+        # Zapisy w trakcie odczytu mogły nadpisać najstarsze z nich - odrzucamy je
+        overwritten = self._window(self.written)[0] - lo
+        return records[overwritten:] if overwritten > 0 else records
+
+    def _bisect(self, lo, hi, ts):
+        """Pierwszy numer zapisu z czasem >= ts"""
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if TIME.unpack_from(self._map, self._offset(mid))[0] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start=None, end=None, limit=None):
+        """Rekordy z przedziału czasu [start, end), najstarsze pierwsze"""
+        first, count = self._window(self.written)
+        lo = first if start is None else self._bisect(first, first + count, start)
+        hi = first + count if end is None else self._bisect(lo, first + count, end)
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return self._read(lo, hi)
+
+    def latest(self, n):
+        """N najnowszych rekordów, najstarsze pierwsze"""
+        first, count = self._window(self.written)
+        return self._read(first + max(0, count - n), first + count)
+
+
+def _clamp(value, lo, hi):
+    return lo if value < lo else hi if value > hi else value
+
+
+def _decode(fields):
+    ts, temp, hum, aq, fan, heat, mist, set_temp, set_hum, aq_thresh = fields
+    return Record(ts, temp / 100, hum / 100, float(aq), fan, heat * 255, mist,
+                  set_temp / 100, set_hum / 100, float(aq_thresh))
+
+
+def as_payload(records, location):
+    """Rekordy w formacie żądania POST /samples bridge (do uzupełniania luk)"""
+    return [dict(zip(FIELDS, r), location=location) for r in records]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Odczyt lokalnego bufora telemetrii")
+    parser.add_argument("path", help="plik pierścienia (RINGSTORE_DIR/<terrarium>.ring)")
+    parser.add_argument("--since", type=float, default=3600, help="ile sekund wstecz (domyślnie godzina)")
+    parser.add_argument("--start", type=float, help="początek zakresu (unix, s) zamiast --since")
+    parser.add_argument("--end", type=float, help="koniec zakresu (unix, s)")
+    parser.add_argument("--last", type=int, help="tylko N ostatnich rekordów")
+    parser.add_argument("--stats", action="store_true", help="pojemność, zapełnienie i zakres czasu")
+    args = parser.parse_args()
+
+    with RingStore(args.path, readonly=True) as store:
+        if args.stats:
+            oldest, newest = store.range(limit=1), store.latest(1)
+            print(f"pojemność {store.capacity}  rekordów {len(store)}  zapisów {store.written}")
+            if newest:
+                print(f"od {time.ctime(oldest[0].time)}  do {time.ctime(newest[0].time)}")
+            return
+        if args.last:
+            records = store.latest(args.last)
+        else:
+            start = args.start if args.start is not None else time.time() - args.since
+            records = store.range(start, args.end)
+
+    # Ten sam układ kolumn co /history?format=csv - plik nadaje się wprost do replay.py
+    writer = csv.writer(sys.stdout)
+    writer.writerow(FIELDS)
+    writer.writerows(records)
+
+
+if __name__ == "__main__":
+    main()
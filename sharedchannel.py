@@ -0,0 +1,128 @@
+"""Kanał między procesem sterowania a procesem telemetrii (tryb --split) w pamięci współdzielonej.
+
+Jeden blok multiprocessing.shared_memory na terrarium:
+- pierścień próbek SPSC: pisze tylko sterowanie, czyta tylko telemetria. Przy pełnym pierścieniu
+  próbka jest odrzucana (i liczona), więc sterowanie nigdy nie czeka na sieć;
+- nastawy w drugą stronę pod seqlockiem: pisze tylko telemetria, sterowanie sprawdza numer przy
+  każdym kroku i czyta wartości dopiero, gdy się zmienił.
+
+Rekord nosi własny numer zapisu - czytelnik przyjmuje go dopiero, gdy numer się zgadza.
+"""
+import struct
+from multiprocessing import shared_memory
+
+U64 = struct.Struct("<Q")
+# Liczniki w osobnych liniach pamięci podręcznej (64 B), żeby strony nie unieważniały sobie nawzajem
+CAPACITY_OFFSET = 0
+HEAD_OFFSET = 64      # liczba zapisanych próbek (pisze sterowanie)
+TAIL_OFFSET = 128     # liczba odebranych próbek (pisze telemetria)
+DROPPED_OFFSET = 192  # próbki odrzucone przy pełnym pierścieniu
+SETTINGS_OFFSET = 256
+# numer seqlocka (nieparzysty = zapis w toku), temp_setting, hum_setting, aq_thresh_setting
+SETTINGS = struct.Struct("<Q3d")
+RECORDS_OFFSET = 320
+# numer zapisu + czas, temp, hum, aq, fan, heat, mist, set_temp, set_hum, aq_thresh
+RECORD = struct.Struct("<Q10d")
+
+DEFAULT_CAPACITY = 4096
+
+
+class TelemetryChannel:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+        self.buf = shm.buf
+        self.capacity = U64.unpack_from(self.buf, CAPACITY_OFFSET)[0]
+        # Własne liczniki każdej ze stron trzymamy też lokalnie - tylko ona je zmienia
+        self._head = U64.unpack_from(self.buf, HEAD_OFFSET)[0]
+        self._tail = U64.unpack_from(self.buf, TAIL_OFFSET)[0]
+        self._settings_seq = SETTINGS.unpack_from(self.buf, SETTINGS_OFFSET)[0]
+
+    @classmethod
+    def create(cls, capacity=DEFAULT_CAPACITY):
+        shm = shared_memory.SharedMemory(create=True, size=RECORDS_OFFSET + capacity * RECORD.size)
+        shm.buf[:RECORDS_OFFSET] = bytes(RECORDS_OFFSET)
+        U64.pack_into(shm.buf, CAPACITY_OFFSET, capacity)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    # --- strona sterowania ---
+
+    def publish(self, *values):
+        """Dopisuje próbkę; False, jeśli telemetria nie nadąża i pierścień jest pełny"""
+        head = self._head
+        buf = self.buf
+        if head - U64.unpack_from(buf, TAIL_OFFSET)[0] >= self.capacity:
+            U64.pack_into(buf, DROPPED_OFFSET, U64.unpack_from(buf, DROPPED_OFFSET)[0] + 1)
+            return False
+        RECORD.pack_into(buf, RECORDS_OFFSET + (head % self.capacity) * RECORD.size, head + 1, *values)
+        self._head = head + 1
+        U64.pack_into(buf, HEAD_OFFSET, self._head)
+        return True
+
+    @property
+    def settings_seq(self):
+        return U64.unpack_from(self.buf, SETTINGS_OFFSET)[0]
+
+    # --- strona telemetrii ---
+
+    def drain(self, limit=None):
+        """Zwraca odebrane próbki (krotki wartości) i zwalnia ich miejsce w pierścieniu"""
+        buf = self.buf
+        head = U64.unpack_from(buf, HEAD_OFFSET)[0]
+        tail = self._tail
+        if limit is not None:
+            head = min(head, tail + limit)
+        samples = []
+        while tail < head:
+            record = RECORD.unpack_from(buf, RECORDS_OFFSET + (tail % self.capacity) * RECORD.size)
+            if record[0] != tail + 1:
+                break  # zapis jeszcze niewidoczny w całości
+            samples.append(record[1:])
+            tail += 1
+        if tail != self._tail:
+            self._tail = tail
+            U64.pack_into(buf, TAIL_OFFSET, tail)
+        return samples
+
+    @property
+    def dropped(self):
+        return U64.unpack_from(self.buf, DROPPED_OFFSET)[0]
+
+    # --- nastawy (seqlock) ---
+
+    def write_settings(self, temp_setting, hum_setting, aq_thresh_setting):
+        """Jedyny piszący: sterowanie przed startem telemetrii, potem tylko telemetria"""
+        seq = max(self._settings_seq, self.settings_seq)
+        # Nieparzysty numer zostawia piszący przerwany w połowie zapisu (np. terminate procesu
+        # telemetrii) - zaokrąglamy w górę, inaczej parzystość odwróciłaby się na stałe
+        seq += seq & 1
+        U64.pack_into(self.buf, SETTINGS_OFFSET, seq + 1)
+        SETTINGS.pack_into(self.buf, SETTINGS_OFFSET, seq + 1, temp_setting, hum_setting, aq_thresh_setting)
+        self._settings_seq = seq + 2
+        U64.pack_into(self.buf, SETTINGS_OFFSET, self._settings_seq)
+
+    def recover_settings(self):
+        """Po przerwanym zapisie (nieparzysty numer) zapisuje bieżące wartości ponownie; True, jeśli było trzeba"""
+        seq, *values = SETTINGS.unpack_from(self.buf, SETTINGS_OFFSET)
+        if not seq & 1:
+            return False
+        self.write_settings(*values)
+        return True
+
+    def read_settings(self):
+        """(numer, (temp, hum, aq_thresh)) albo None, jeśli trwa zapis - wtedy spróbować później"""
+        seq, *values = SETTINGS.unpack_from(self.buf, SETTINGS_OFFSET)
+        if seq & 1 or U64.unpack_from(self.buf, SETTINGS_OFFSET)[0] != seq:
+            return None
+        return seq, tuple(values)
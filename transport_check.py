@@ -0,0 +1,151 @@
+"""Sprawdzenie HttpTransport na atrapie serwera (Stub z bench.py), bez sieci i bez sprzętu.
+
+Sprawdza:
+    - kolejne wysyłki idą jednym połączeniem keep-alive,
+    - 5xx i 429 są ponawiane, 4xx nie, a po wyczerpaniu prób błąd trafia do wywołującego,
+    - błąd sieci (zamknięty port) jest ponawiany,
+    - liczniki stats() i metryk terrarium_http_* zgadzają się z liczbą prób.
+
+Przykład:
+    python transport_check.py
+    python transport_check.py --uploads 200 -v
+"""
+import argparse
+import asyncio
+import socket
+import sys
+
+from aiohttp import web
+
+from bench import Stub
+from main import HTTP_ERRORS, HTTP_RETRIES, HTTP_SECONDS, HttpTransport, RetryableStatus
+
+
+class FlakyStub(Stub):
+    """Stub, który na /update zwraca najpierw zadane kody błędów i zapisuje, z którego połączenia przyszło żądanie"""
+
+    def __init__(self):
+        super().__init__()
+        self.fail_next = []
+        self.connections = set()
+
+    async def update(self, request):
+        self.connections.add(request.transport.get_extra_info("peername"))
+        if self.fail_next:
+            self.requests += 1
+            return web.Response(status=self.fail_next.pop(0))
+        return await super().update(request)
+
+
+class Check:
+    def __init__(self, verbose):
+        self.verbose = verbose
+        self.failed = 0
+
+    def __call__(self, name, ok, detail=""):
+        if not ok:
+            self.failed += 1
+        if not ok or self.verbose:
+            print(f"{'OK  ' if ok else 'BŁĄD'} {name}" + (f" ({detail})" if detail else ""))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def snapshot(transport, service):
+    # Metryki są wspólne dla procesu, więc porównujemy przyrosty
+    return (transport.stats(), HTTP_ERRORS.labels(service).value, HTTP_RETRIES.labels(service).value,
+            HTTP_SECONDS.labels(service).count)
+
+
+async def run(args):
+    check = Check(args.verbose)
+    stub = FlakyStub()
+    runner = web.AppRunner(stub.app())
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        async with HttpTransport(base_url, timeout=5, retries=2, retry_backoff=0.01,
+                                 service="check") as transport:
+            # 1. Keep-alive: wszystkie wysyłki jednym połączeniem
+            for i in range(args.uploads):
+                resp = await transport.request("POST", "/update", data={"field1": i})
+                if resp.status != 200:
+                    check("wysyłka", False, f"HTTP {resp.status}")
+                    break
+            check("jedno połączenie keep-alive", len(stub.connections) == 1,
+                  f"{args.uploads} wysyłek, połączeń: {len(stub.connections)}")
+            stats = transport.stats()
+            check("liczniki po wysyłkach", stats["requests"] == args.uploads and stats["errors"] == 0
+                  and stats["retries"] == 0, str(stats))
+
+            # 2. 503 i 429 ponawiane, potem sukces
+            before, errors, retries, observed = snapshot(transport, "check")
+            stub.fail_next = [503, 429]
+            resp = await transport.request("POST", "/update", data={"field1": 0})
+            after, errors_after, retries_after, observed_after = snapshot(transport, "check")
+            check("ponowienie 503 i 429", resp.status == 200, f"HTTP {resp.status}")
+            check("liczniki ponowień", after["requests"] - before["requests"] == 3
+                  and after["errors"] - before["errors"] == 2 and after["retries"] - before["retries"] == 2,
+                  f"{before} -> {after}")
+            check("metryki terrarium_http_*", errors_after - errors == 2 and retries_after - retries == 2
+                  and observed_after - observed == 3,
+                  f"błędy +{errors_after - errors}, ponowienia +{retries_after - retries}, "
+                  f"próby +{observed_after - observed}")
+            check("ponowienia tym samym połączeniem", len(stub.connections) == 1,
+                  f"połączeń: {len(stub.connections)}")
+
+            # 3. Wyczerpane próby: 3 x 500 -> wyjątek u wywołującego
+            before = transport.stats()
+            stub.fail_next = [500, 500, 500]
+            try:
+                await transport.request("POST", "/update", data={"field1": 0})
+                check("wyjątek po wyczerpaniu prób", False, "brak wyjątku")
+            except RetryableStatus as e:
+                check("wyjątek po wyczerpaniu prób", True, str(e))
+            after = transport.stats()
+            check("liczniki po wyczerpaniu prób", after["requests"] - before["requests"] == 3
+                  and after["retries"] - before["retries"] == 2, f"{before} -> {after}")
+
+            # 4. 4xx to błąd klienta - bez ponowień
+            before = transport.stats()
+            stub.fail_next = [400]
+            resp = await transport.request("POST", "/update", data={"field1": 0})
+            after = transport.stats()
+            check("4xx bez ponowień", resp.status == 400 and after["requests"] - before["requests"] == 1
+                  and after["retries"] == before["retries"], f"HTTP {resp.status}, {before} -> {after}")
+
+        # 5. Błąd sieci: zamknięty port, ponowienia aż do wyczerpania prób
+        async with HttpTransport(f"http://127.0.0.1:{free_port()}", timeout=2, retries=2, retry_backoff=0.01,
+                                 service="check") as transport:
+            try:
+                await transport.request("POST", "/update", data={"field1": 0})
+                check("błąd sieci ponawiany", False, "brak wyjątku")
+            except RetryableStatus as e:
+                check("błąd sieci ponawiany", False, repr(e))
+            except Exception as e:
+                stats = transport.stats()
+                check("błąd sieci ponawiany", stats["requests"] == 3 and stats["retries"] == 2
+                      and stats["errors"] == 3, f"{type(e).__name__}, {stats}")
+    finally:
+        await runner.cleanup()
+
+    print("wszystkie sprawdzenia poprawne" if not check.failed else f"nieudane sprawdzenia: {check.failed}")
+    return 1 if check.failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sprawdzenie HttpTransport na atrapie serwera")
+    parser.add_argument("--uploads", type=int, default=50, help="liczba wysyłek w teście keep-alive")
+    parser.add_argument("-v", "--verbose", action="store_true", help="wypisz także udane sprawdzenia")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()